@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response
 import sys
 import time
 from functools import wraps
@@ -9,27 +9,43 @@ import re
 import base64
 import random
 import requests
-from contextlib import contextmanager
 from pathlib import Path
 from typing import Optional
 from werkzeug.utils import secure_filename
-import pymupdf as fitz
 import google.generativeai as genai
 from flask_cors import CORS
 from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
 from requests.exceptions import ConnectionError
-from youtube_transcript_api import YouTubeTranscriptApi, NoTranscriptFound, TranscriptsDisabled
-from io import BytesIO
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from docx import Document
-import zipfile
-from docx.enum.text import WD_ALIGN_PARAGRAPH
 from PIL import Image
 import datetime
 import googleapiclient.discovery
+from services.rate_limiter import (
+    TokenBucketLimiter, RateLimitTimeout, PRIORITY_CHAT, PRIORITY_BULK, PRIORITY_PREFETCH,
+    priority_scope, scoped_priority, is_rate_limit_error, retry_after_seconds,
+)
+from services.gemini_client import GeminiClientPool, StubGenerativeModel
+from services.prompt_packer import PromptPacker, relevance, terms, truncate_to_tokens
+from services.conversation_store import ConversationStore
+from services.semantic_cache import SemanticAnswerCache
+from services.session_store import SessionStore, SessionNotFound
+from services.blob_store import BlobStore, THUMBNAIL_SIZES
+from services.document_store import DocumentStore, DocumentNotFound
+from services.http_layer import install_json_provider, compress_response, stream_json
+from services.image_pipeline import ImageDescriber
+from services.transcript_cache import TranscriptCache, YouTubeTranscriptTransport, StubTranscriptTransport
+from services.exports import RenderCache, UnsupportedExport, MIME_TYPES, plan_bulk_export, stream_zip
+from services.extraction import extract_text_from_pdf, extract_text_from_scanned_pdf
+from services.work_budget import ResourceBudget, BudgetTimeout, map_ordered
+from services.artifact_store import ArtifactStore, UnknownArtifact, STATUS_READY
+from services.question_bank import ShardedQuestionGenerator
+from services import quiz_service, notification_service, progress_service, metrics
+from services.profiler import StackSampler, ProfileStore, ProfilingMiddleware, folded, token_matches
+from pymongo import MongoClient
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import threading
+import uuid
 
 # Initialize logging first
 logging.basicConfig(level=logging.INFO)
@@ -59,6 +75,24 @@ else:
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+# orjson-backed jsonify when installed; gzip/brotli negotiated per response
+if install_json_provider(app):
+    logger.info("Using orjson for JSON responses")
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "1").lower() in ("1", "true", "yes")
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+# Stage timings are exported at /metrics; tqdm bars are off in the server unless PROGRESS_BARS=1
+metrics.show_progress_bars(os.getenv("PROGRESS_BARS", "0").lower() in ("1", "true", "yes"))
+
+@app.after_request
+def compress_after_request(response):
+    if RESPONSE_COMPRESSION:
+        return compress_response(response, request.headers.get('Accept-Encoding'), COMPRESSION_MIN_BYTES)
+    return response
+
+def json_stream(data):
+    """Stream a large JSON payload, compressed if the client accepts it."""
+    return stream_json(data, request.headers.get('Accept-Encoding') if RESPONSE_COMPRESSION else None)
+
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
@@ -67,12 +101,120 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_CHAT_API_KEY = os.getenv("GEMINI_CHAT_API_KEY") or GEMINI_API_KEY
 YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
 
+# Generate summary, notes, flashcards and MCQs with one structured call on upload
+# (can be overridden per request with the `combined_mode` form field)
+COMBINED_GENERATION = os.getenv("COMBINED_GENERATION", "0").lower() in ("1", "true", "yes")
+# Upload generates only the summary; notes, flashcards and MCQs are generated on
+# first request (override per request with the `lazy_artifacts` form field)
+LAZY_ARTIFACTS = os.getenv("LAZY_ARTIFACTS", "1").lower() in ("1", "true", "yes")
+# Generate lazy artifacts in the background at low priority after upload
+ARTIFACT_PREFETCH = os.getenv("ARTIFACT_PREFETCH", "1").lower() in ("1", "true", "yes")
+
 # Configure the default client for non-chat features
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
 else:
     logger.warning("GEMINI_API_KEY not found in environment variables")
 
+# Model handles pinned per API key; never reconfigure genai globally per call
+GEMINI_MODEL = "gemini-2.5-flash"
+# GEMINI_STUB_MODEL=1 serves canned replies from a local stub (offline testing)
+_stub_model = None
+if os.getenv("GEMINI_STUB_MODEL", "0").lower() in ("1", "true", "yes"):
+    _stub_model = StubGenerativeModel(GEMINI_MODEL, token_delay=float(os.getenv("GEMINI_STUB_TOKEN_DELAY", "0")))
+    logger.warning("GEMINI_STUB_MODEL enabled - Gemini calls return canned stub responses")
+gemini_pool = GeminiClientPool(transport=os.getenv("GEMINI_TRANSPORT") or None, stub_model=_stub_model)
+
+# Local state (SQLite databases shared by all workers)
+DB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db')
+os.makedirs(DB_DIR, exist_ok=True)
+
+# /metrics adds up the snapshots every worker process writes here every METRICS_INTERVAL_SECONDS
+metrics.enable_multiprocess(os.getenv("METRICS_DIR") or os.path.join(DB_DIR, 'metrics'),
+                            interval=float(os.getenv("METRICS_INTERVAL_SECONDS", "5")))
+
+# Uploaded images are stored once by content hash and served from /blobs/<hash>
+blob_store = BlobStore(os.getenv("BLOB_DIR") or os.path.join(DB_DIR, 'blobs'))
+BLOB_MAX_AGE = 365 * 24 * 3600
+# INLINE_IMAGE_BASE64=1 also returns base64_image data URIs (for older clients)
+INLINE_IMAGE_BASE64 = os.getenv("INLINE_IMAGE_BASE64", "0").lower() in ("1", "true", "yes")
+
+# Rendered downloads (PDF/TXT/DOCX) are cached by content hash
+render_cache = RenderCache(
+    os.getenv("EXPORT_CACHE_DIR") or os.path.join(DB_DIR, 'exports'),
+    max_bytes=int(float(os.getenv("EXPORT_CACHE_MB", "256")) * 1024 * 1024),
+)
+render_cache.prune()
+EXPORT_MAX_FILES = int(os.getenv("EXPORT_MAX_FILES", "500"))
+
+# Profiling (admin only, off unless PROFILE_TOKEN is set): a request sent with
+# "X-Profile: sample|cprofile" (or ?profile=...) and the token in
+# X-Profile-Token (or ?profile_token=) is profiled; the profile is stored and
+# its id returned in X-Profile-Id. PROFILE_SAMPLE_HZ > 0 also samples all
+# threads continuously at that rate. With both unset no hook is installed.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_SAMPLE_HZ = float(os.getenv("PROFILE_SAMPLE_HZ", "0"))
+profile_store = None
+continuous_sampler = None
+if PROFILE_TOKEN:
+    profile_store = ProfileStore(os.getenv("PROFILE_DIR") or os.path.join(DB_DIR, 'profiles'),
+                                 keep=int(os.getenv("PROFILE_KEEP", "50")))
+    if PROFILE_SAMPLE_HZ > 0:
+        continuous_sampler = StackSampler(interval=1.0 / PROFILE_SAMPLE_HZ).start()
+        logger.info(f"✓ Continuous stack sampling at {PROFILE_SAMPLE_HZ:g} Hz")
+
+    app.wsgi_app = ProfilingMiddleware(app.wsgi_app, profile_store, PROFILE_TOKEN,
+                                       interval=PROFILE_INTERVAL_MS / 1000)
+
+def profile_authorized():
+    return token_matches(request.headers.get('X-Profile-Token') or request.args.get('profile_token'), PROFILE_TOKEN)
+
+# Quiz question bank (MongoDB); the question bank endpoints need MONGO_URI.
+# Notifications about new questions are fanned out on a background worker.
+MONGO_URI = os.getenv("MONGO_URI")
+quiz_db = None
+notification_worker = None
+if MONGO_URI:
+    try:
+        quiz_db = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)[os.getenv("MONGO_DB", "notelooms")]
+        quiz_service.ensure_indexes(quiz_db)
+        notification_service.ensure_indexes(quiz_db)
+        progress_service.ensure_indexes(quiz_db)
+        notification_worker = notification_service.NotificationWorker(
+            quiz_db, chunk_size=int(os.getenv("NOTIFY_CHUNK_SIZE", "1000")),
+        )
+        logger.info("✓ Quiz database connected")
+    except Exception as e:
+        logger.error(f"Quiz database unavailable: {e}")
+        quiz_db = None
+
+# Extracted text is kept server-side, page-indexed, under a document id
+document_store = DocumentStore(os.path.join(DB_DIR, 'documents.db'))
+
+# Token-bucket budgets per API key, shared across workers. Chat only gets its
+# own bucket when it has its own key; otherwise it shares the main quota.
+GEMINI_LIMIT_KEY = "gemini"
+GEMINI_CHAT_LIMIT_KEY = "gemini_chat" if os.getenv("GEMINI_CHAT_API_KEY") else GEMINI_LIMIT_KEY
+llm_limiter = TokenBucketLimiter(
+    os.path.join(DB_DIR, 'rate_limiter.db'),
+    queue_timeout=float(os.getenv("GEMINI_QUEUE_TIMEOUT", "60")),
+    max_retries=int(os.getenv("GEMINI_429_RETRIES", "2")),
+)
+llm_limiter.register(
+    GEMINI_LIMIT_KEY,
+    requests_per_minute=float(os.getenv("GEMINI_RPM", "20")),
+    burst=int(os.getenv("GEMINI_BURST", "5")),
+    max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "4")),
+)
+if GEMINI_CHAT_LIMIT_KEY != GEMINI_LIMIT_KEY:
+    llm_limiter.register(
+        GEMINI_CHAT_LIMIT_KEY,
+        requests_per_minute=float(os.getenv("GEMINI_CHAT_RPM", "20")),
+        burst=int(os.getenv("GEMINI_CHAT_BURST", "5")),
+        max_concurrency=int(os.getenv("GEMINI_CHAT_MAX_CONCURRENCY", "4")),
+    )
+
 # Initialize YouTube API client conditionally
 youtube = None
 if YOUTUBE_API_KEY:
@@ -85,6 +227,20 @@ if YOUTUBE_API_KEY:
 else:
     logger.warning("YOUTUBE_API_KEY not found - YouTube metadata extraction will be unavailable (transcript extraction will still work)")
 
+# Transcripts are cached by video id and language (including "disabled" results)
+# YOUTUBE_TRANSCRIPT_STUB=1 serves canned transcripts from a local stub (offline testing)
+if os.getenv("YOUTUBE_TRANSCRIPT_STUB", "0").lower() in ("1", "true", "yes"):
+    transcript_transport = StubTranscriptTransport()
+    logger.warning("YOUTUBE_TRANSCRIPT_STUB enabled - transcripts come from a local stub")
+else:
+    transcript_transport = YouTubeTranscriptTransport()
+transcript_cache = TranscriptCache(
+    transcript_transport,
+    os.path.join(DB_DIR, 'transcripts.db'),
+    ttl_seconds=float(os.getenv("TRANSCRIPT_CACHE_TTL_DAYS", "30")) * 86400,
+    negative_ttl_seconds=float(os.getenv("TRANSCRIPT_NEGATIVE_TTL_HOURS", "6")) * 3600,
+)
+
 # Initialize RAG if available (only when ENABLE_RAG=1 and import succeeded)
 rag_processor = None
 rag_init_error = None
@@ -141,7 +297,7 @@ def extract_video_id(url):
 
 def get_youtube_transcript_advanced(video_url_or_id):
     """
-    Fetch transcript with multiple fallback options
+    Fetch transcript through the transcript cache (fallback methods run concurrently on a miss)
     Returns: List of transcript segments with timing or None
     """
     try:
@@ -151,69 +307,7 @@ def get_youtube_transcript_advanced(video_url_or_id):
             return None
         
         logger.info(f"Attempting to fetch transcript for video ID: {video_id}")
-        
-        # Try direct method first (most reliable)
-        try:
-            transcript_data = YouTubeTranscriptApi.get_transcript(video_id, languages=['en'])
-            formatted_transcript = []
-            for entry in transcript_data:
-                formatted_transcript.append({
-                    'text': entry['text'].strip(),
-                    'start': float(entry['start']),
-                    'duration': float(entry['duration'])
-                })
-            logger.info(f"✓ Successfully fetched transcript using direct method with {len(formatted_transcript)} segments")
-            return formatted_transcript
-        except Exception as e:
-            logger.warning(f"Direct method failed: {e}")
-        
-        # Advanced fallback methods
-        try:
-            transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-            transcript = None
-            
-            # Priority 1: Manual English transcript
-            try:
-                transcript = transcript_list.find_manually_created_transcript(['en'])
-                logger.info("✓ Found manually created English transcript")
-            except:
-                pass
-            
-            # Priority 2: Auto-generated English transcript
-            if not transcript:
-                try:
-                    transcript = transcript_list.find_generated_transcript(['en'])
-                    logger.info("✓ Found auto-generated English transcript")
-                except:
-                    pass
-            
-            if transcript:
-                # Fetch the actual transcript data
-                transcript_data = transcript.fetch()
-                
-                # Format the transcript with timing
-                formatted_transcript = []
-                for entry in transcript_data:
-                    formatted_transcript.append({
-                        'text': entry['text'].strip(),
-                        'start': float(entry['start']),
-                        'duration': float(entry['duration'])
-                    })
-                
-                logger.info(f"✓ Successfully fetched transcript with {len(formatted_transcript)} segments")
-                return formatted_transcript
-            
-        except TranscriptsDisabled:
-            logger.warning(f"Transcripts are disabled for video: {video_id}")
-            return None
-        except NoTranscriptFound:
-            logger.warning(f"No transcripts found for video: {video_id}")
-            return None
-        except Exception as e:
-            logger.error(f"Error getting transcript list: {e}")
-        
-        logger.error(f"✗ All transcript fetch methods failed for video: {video_id}")
-        return None
+        return transcript_cache.get(video_id, "en")
         
     except Exception as e:
         logger.error(f"Error fetching transcript: {str(e)}")
@@ -244,17 +338,6 @@ def get_transcript_endpoint():
             'transcript': []
         })
 
-@contextmanager
-def open_pdf(pdf_path: str):
-    """Context manager for safely opening PDF files."""
-    doc = None
-    try:
-        doc = fitz.open(pdf_path)
-        yield doc
-    finally:
-        if doc:
-            doc.close()
-
 def get_removal_delay(filepath: str) -> float:
     """Calculate delay based on file size. Larger files get longer delays."""
     try:
@@ -303,96 +386,6 @@ def safe_remove(filepath: str, max_retries: int = 5, initial_delay: float = None
     
     return False
 
-def extract_text_from_pdf(pdf_path: str, max_pages: int = 100) -> Optional[str]:
-    """Extract text from PDF using PyMuPDF with memory optimization."""
-    try:
-        text_chunks = []
-        with open_pdf(pdf_path) as doc:
-            total_pages = len(doc)
-            pages_to_process = min(total_pages, max_pages)
-            
-            for page_num in range(pages_to_process):
-                try:
-                    page = doc[page_num]
-                    page_text = page.get_text("text")
-                    if page_text and page_text.strip():
-                        text_chunks.append(f"--- Page {page_num + 1} ---\n{page_text.strip()}")
-                    
-                    # Memory management: Clear references periodically
-                    if page_num % 50 == 0:
-                        import gc
-                        gc.collect()
-                        
-                except Exception as page_error:
-                    logger.warning(f"Error processing page {page_num}: {page_error}")
-                    continue
-        
-        if text_chunks:
-            return "\n\n".join(text_chunks)
-        return None
-        
-    except Exception as e:
-        logger.error(f"Error extracting text from PDF: {e}")
-        return None
-
-def extract_text_from_scanned_pdf(pdf_path: str, max_pages: int = 20, dpi: int = 200) -> Optional[str]:
-    """Extract text from scanned PDF using OCR with memory optimization."""
-    # Lazy-import heavy OCR stack so startup stays fast when OCR is not used
-    from pdf2image import convert_from_path
-    import cv2
-    import numpy as np
-    import pytesseract
-
-    try:
-        logger.info(f"Starting OCR processing for {pdf_path} (max {max_pages} pages)")
-        
-        # Convert limited number of pages to images
-        images = convert_from_path(pdf_path, first_page=1, last_page=max_pages, dpi=dpi)
-        extracted_text = []
-        
-        for i, image in enumerate(images):
-            if i >= max_pages:
-                break
-                
-            try:
-                # Convert PIL image to OpenCV format
-                img = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-                
-                # Apply preprocessing for better OCR
-                denoised = cv2.medianBlur(gray, 3)
-                _, binary = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-                
-                # OCR with optimized config
-                custom_config = r'--oem 3 --psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789.,!?;:()[]{}@#$%^&*+-= '
-                text = pytesseract.image_to_string(binary, config=custom_config)
-                
-                if text.strip():
-                    extracted_text.append(f"--- Page {i + 1} ---\n{text.strip()}")
-                
-                # Memory management
-                if i % 5 == 0:
-                    import gc
-                    gc.collect()
-                    
-            except Exception as img_e:
-                logger.error(f"Error processing page {i}: {img_e}")
-                continue
-        
-        if extracted_text:
-            result = "\n\n".join(extracted_text)
-            logger.info(f"OCR extracted {len(extracted_text)} pages of text")
-            return result
-        return None
-        
-    except Exception as e:
-        logger.error(f"Error processing scanned PDF: {e}")
-        return None
-    finally:
-        # Clean up any temporary image files
-        for img_path in temp_images:
-            safe_remove(img_path)
-
 def extract_text_from_youtube(url):
     """Extract text and transcript from YouTube video"""
     try:
@@ -443,13 +436,24 @@ def extract_text_from_youtube(url):
         logger.error(f"YouTube processing error: {str(e)}", exc_info=True)
         return None, None
 
+def timed_generate(stage, model, contents, **kwargs):
+    """model.generate_content under a metrics timer (the call itself, not the limiter queue)."""
+    if isinstance(contents, str):
+        metrics.add_bytes(stage, len(contents.encode("utf-8")))
+    with metrics.timed(stage):
+        return model.generate_content(contents, **kwargs)
+
 def generate_gemini_response(prompt):
     """Generate response with proper error handling and model selection."""
     try:
         # Using gemini-2.5-flash as it's available in the environment
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        response = model.generate_content(prompt)
+        model = gemini_pool.get_model(GEMINI_API_KEY, GEMINI_MODEL)
+        response = llm_limiter.call(GEMINI_LIMIT_KEY, lambda: timed_generate("gemini_generate", model, prompt),
+                                    priority=scoped_priority(PRIORITY_BULK))
         return response.text.strip().replace("*", "")
+    except RateLimitTimeout as e:
+        logger.error(f"Gemini API queue timeout: {e}")
+        return "⚠ ERROR: API quota exceeded. Please try again later."
     except Exception as e:
         logger.error(f"Gemini API error: {e}")
         if "429" in str(e):
@@ -459,17 +463,20 @@ def generate_gemini_response(prompt):
         return f"⚠ ERROR: {e}"
 
 
-def generate_chat_response(prompt):
+def generate_chat_response(prompt, priority=PRIORITY_CHAT):
     """
     Use a dedicated chat API key if provided, to avoid burning the main quota.
     Falls back to GEMINI_API_KEY when GEMINI_CHAT_API_KEY is not set.
     """
     try:
-        # Reconfigure client with chat key for this call
-        genai.configure(api_key=GEMINI_CHAT_API_KEY)
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        response = model.generate_content(prompt)
+        # Model handle pinned to the chat key; no global reconfiguration
+        model = gemini_pool.get_model(GEMINI_CHAT_API_KEY, GEMINI_MODEL)
+        response = llm_limiter.call(GEMINI_CHAT_LIMIT_KEY, lambda: timed_generate("gemini_chat", model, prompt),
+                                    priority=priority)
         return response.text.strip().replace("*", "")
+    except RateLimitTimeout as e:
+        logger.error(f"Gemini Chat API queue timeout: {e}")
+        return "⚠ ERROR: Chat API quota exceeded. Please try again later."
     except Exception as e:
         logger.error(f"Gemini Chat API error: {e}")
         if "429" in str(e):
@@ -478,17 +485,31 @@ def generate_chat_response(prompt):
             return "⚠ ERROR: Chat model not available. Please check the chat model configuration."
         return f"⚠ ERROR: {e}"
 
+def describe_image_bytes(img_data, mime_type):
+    """One Gemini call for an already prepared (downscaled) image."""
+    # Use the same stable model as the rest of the app to avoid 404 / unsupported errors
+    model = gemini_pool.get_model(GEMINI_API_KEY, GEMINI_MODEL)
+    metrics.add_bytes("gemini_image", len(img_data))
+    response = llm_limiter.call(GEMINI_LIMIT_KEY, lambda: timed_generate("gemini_image", model, [
+        "Provide a detailed description of this image for educational purposes.",
+        {"mime_type": mime_type, "data": img_data}
+    ]), priority=PRIORITY_BULK)
+    return response.text.strip().replace("*", "")
+
+# Images are downscaled before upload to Gemini and descriptions are cached by
+# content/perceptual hash. Images in one upload are described concurrently (see
+# upload processing below); the limiter's max_concurrency still caps in-flight calls.
+image_describer = ImageDescriber(
+    describe_image_bytes,
+    os.path.join(DB_DIR, 'image_descriptions.db'),
+    namespace=GEMINI_MODEL,
+    max_edge=int(os.getenv("IMAGE_MAX_EDGE", "1536")),
+    jpeg_quality=int(os.getenv("IMAGE_JPEG_QUALITY", "85")),
+)
+
 def generate_image_description(image_path):
     try:
-        # Use the same stable model as the rest of the app to avoid 404 / unsupported errors
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        with open(image_path, "rb") as img_file:
-            img_data = img_file.read()
-        response = model.generate_content([
-            "Provide a detailed description of this image for educational purposes.",
-            {"mime_type": "image/jpeg", "data": img_data}
-        ])
-        return response.text.strip().replace("*", "")
+        return image_describer.describe(image_path)
     except Exception as e:
         logger.error(f"Image description error: {e}")
         return f"⚠ ERROR: Unable to describe image - {e}"
@@ -578,6 +599,62 @@ Text:
             return {"status": "error", "message": "Quota exceeded. Please try later."}
         raise
 
+def parse_json_response(response_text, opener="["):
+    """
+    Parse JSON out of a model reply, tolerating markdown code fences and
+    surrounding prose. `opener` is "[" for arrays and "{" for objects.
+    Raises json.JSONDecodeError when nothing parseable is found.
+    """
+    closer = "]" if opener == "[" else "}"
+    raw = (response_text or "").strip()
+
+    # Strip common markdown code fences
+    if raw.startswith("```json"):
+        raw = raw[7:]
+    elif raw.startswith("```JSON"):
+        raw = raw[7:]
+    elif raw.startswith("```"):
+        raw = raw[3:]
+    if raw.endswith("```"):
+        raw = raw[:-3]
+    raw = raw.strip()
+
+    # If there is still extra text around the JSON, try to isolate it
+    if not (raw.startswith(opener) and raw.endswith(closer)):
+        start = raw.find(opener)
+        end = raw.rfind(closer)
+        if start != -1 and end != -1 and end > start:
+            raw = raw[start : end + 1]
+
+    return json.loads(raw)
+
+def clean_mcq_items(data, num_questions: int = 10):
+    """Keep only well-formed MCQs (question, 4 options, answer among the options)."""
+    cleaned = []
+    if not isinstance(data, list):
+        return cleaned
+    for item in data[:num_questions]:
+        if not isinstance(item, dict):
+            continue
+            
+        q = (item.get('question') or '').strip()
+        opts = item.get('options') or []
+        ans = (item.get('answer') or '').strip()
+        
+        # Ensure we have exactly 4 options
+        if q and isinstance(opts, list) and len(opts) >= 4 and ans:
+            # Take first 4 options and ensure they're strings
+            options_list = [str(opt).strip() for opt in opts[:4]]
+            
+            # Check if answer is in options
+            if ans in options_list:
+                cleaned.append({
+                    'question': q.replace("**", "").replace("*", ""),
+                    'options': options_list,
+                    'answer': ans.replace("**", "").replace("*", "")
+                })
+    return cleaned
+
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
 def generate_mcqs_with_retry(extracted_text, num_questions: int = 10):
     """Generate MCQs with retry logic and error handling"""
@@ -595,51 +672,10 @@ def generate_mcqs_with_retry(extracted_text, num_questions: int = 10):
         if "ERROR" in response:
             raise Exception("API error occurred")
             
-        # Clean the response and parse JSON more robustly
-        raw = response.strip()
-        
-        # Strip common markdown code fences
-        if raw.startswith("```json"):
-            raw = raw[7:]
-        elif raw.startswith("```JSON"):
-            raw = raw[7:]
-        elif raw.startswith("```"):
-            raw = raw[3:]
-        if raw.endswith("```"):
-            raw = raw[:-3]
-        raw = raw.strip()
-
-        # If there is still extra text around the JSON, try to isolate the array
-        if not (raw.startswith("[") and raw.endswith("]")):
-            start = raw.find("[")
-            end = raw.rfind("]")
-            if start != -1 and end != -1 and end > start:
-                raw = raw[start : end + 1]
-        
-        data = json.loads(raw)
+        data = parse_json_response(response, "[")
         
         # Validate and clean the MCQs
-        cleaned = []
-        for item in data[:num_questions]:
-            if not isinstance(item, dict):
-                continue
-                
-            q = (item.get('question') or '').strip()
-            opts = item.get('options') or []
-            ans = (item.get('answer') or '').strip()
-            
-            # Ensure we have exactly 4 options
-            if q and isinstance(opts, list) and len(opts) >= 4 and ans:
-                # Take first 4 options and ensure they're strings
-                options_list = [str(opt).strip() for opt in opts[:4]]
-                
-                # Check if answer is in options
-                if ans in options_list:
-                    cleaned.append({
-                        'question': q.replace("**", "").replace("*", ""),
-                        'options': options_list,
-                        'answer': ans.replace("**", "").replace("*", "")
-                    })
+        cleaned = clean_mcq_items(data, num_questions)
         
         return cleaned if cleaned else [{"error": "No valid MCQs could be generated from the AI response."}]
         
@@ -653,19 +689,441 @@ def generate_mcqs_with_retry(extracted_text, num_questions: int = 10):
             return [{"error": "MCQ generation is temporarily unavailable because the Gemini API quota was exceeded. Please wait a bit and try again."}]
         return [{"error": f"MCQ generation failed: {str(e)}"}]
 
+# MCQ pools are generated per document section (sections spread over the whole
+# text, requested concurrently) and merged with near-duplicates removed by
+# question-embedding similarity (word overlap when RAG's model is not loaded)
+question_bank = ShardedQuestionGenerator(
+    generate_mcqs_with_retry,
+    embed_fn=rag_processor.embeddings.embed_documents if rag_processor else None,
+    max_sections=int(os.getenv("MCQ_MAX_SECTIONS", "6")),
+    section_chars=int(os.getenv("MCQ_SECTION_CHARS", "3000")),
+    similarity_threshold=float(os.getenv("MCQ_DEDUP_THRESHOLD", "0.88")),
+    max_workers=int(os.getenv("MCQ_SECTION_WORKERS", "4")),
+)
+
+def generate_summary_artifact(clipped_text):
+    """Generate the summary shown first after upload."""
+    return generate_gemini_response(f"Summarize this text concisely:\n\n{clipped_text}")
+
+def generate_notes_artifact(extracted_text):
+    """Generate short notes, returning a user-facing message on failure."""
+    short_notes_response = generate_short_notes_with_retry(extracted_text)
+    if isinstance(short_notes_response, dict) and short_notes_response.get("status") == "error":
+        return f"Note generation failed: {short_notes_response.get('message')}"
+    return short_notes_response
+
+def generate_flashcards_artifact(extracted_text):
+    """Generate and parse flashcards, returning [] on failure."""
+    flashcards_response = generate_flashcards_with_retry(extracted_text)
+    if isinstance(flashcards_response, dict) and flashcards_response.get("status") == "error":
+        logger.warning(f"Flashcard generation failed: {flashcards_response.get('message')}")
+        return []
+    return process_flashcards(flashcards_response)
+
+def simplify_mcqs(items):
+    """Keep only valid, non-error MCQ dicts with text options."""
+    simple_mcqs = []
+    if not isinstance(items, list):
+        return simple_mcqs
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        if "error" in item:
+            continue
+        q = (item.get("question") or "").strip()
+        opts = item.get("options") or []
+        ans = (item.get("answer") or "").strip()
+        if q and isinstance(opts, list) and len(opts) >= 2 and ans:
+            simple_mcqs.append({
+                "question": q,
+                "options": [str(o).strip() for o in opts],
+                "answer": ans,
+            })
+    return simple_mcqs
+
+def generate_mcqs_artifact(extracted_text, num_questions: int = 40):
+    """Pre-generate a pool of MCQs, returning [] on failure."""
+    try:
+        return simplify_mcqs(question_bank.generate(extracted_text, num_questions))
+    except Exception as e:
+        logger.warning(f"Initial MCQ generation during upload failed: {e}")
+        return []
+
+STUDY_PACK_SECTIONS = ("summary", "short_notes", "flashcards", "mcqs")
+
+def validate_study_pack(data, num_mcqs: int = 40):
+    """
+    Validate a combined study-pack reply section by section.
+    Returns (valid_sections, failed_section_names) so callers can regenerate
+    only the sections that did not survive validation.
+    """
+    valid = {}
+    if not isinstance(data, dict):
+        return valid, list(STUDY_PACK_SECTIONS)
+
+    summary = data.get("summary")
+    if isinstance(summary, str) and summary.strip():
+        valid["summary"] = summary.strip()
+
+    notes = data.get("short_notes")
+    if isinstance(notes, list):
+        notes = "\n".join(str(n).strip() for n in notes if str(n).strip())
+    if isinstance(notes, str) and notes.strip():
+        valid["short_notes"] = notes.strip()
+
+    flashcards = []
+    cards = data.get("flashcards")
+    for i, card in enumerate(cards if isinstance(cards, list) else [], 1):
+        if i > 20:  # Limit to 20 flashcards
+            break
+        if not isinstance(card, dict):
+            continue
+        front = str(card.get("question") or card.get("front") or "").strip()
+        back = str(card.get("answer") or card.get("back") or "").strip()
+        if len(front) > 3 and len(back) > 3:
+            flashcards.append({"id": i, "front": front, "back": back})
+    if flashcards:
+        valid["flashcards"] = flashcards
+
+    mcqs = simplify_mcqs(clean_mcq_items(data.get("mcqs"), num_mcqs))
+    if mcqs:
+        valid["mcqs"] = mcqs
+
+    failed = [section for section in STUDY_PACK_SECTIONS if section not in valid]
+    return valid, failed
+
+def generate_study_pack(extracted_text, num_mcqs: int = 40):
+    """
+    Generate summary, short notes, flashcards and MCQs with a single Gemini call.
+    Sections missing from (or invalid in) the combined reply fall back to the
+    per-artifact generators, so the result always has all four keys.
+    """
+    clipped = extracted_text[:8000]
+    prompt = (
+        "Create a complete study pack from the following text. "
+        "Return ONLY a valid JSON object with exactly these keys:\n"
+        "{\"summary\": \"concise summary\", "
+        "\"short_notes\": \"bullet points, one per line, each starting with '- '\", "
+        "\"flashcards\": [{\"question\": \"Question text\", \"answer\": \"Answer text\"}], "
+        "\"mcqs\": [{\"question\": \"Question text\", \"options\": [\"Option A\", \"Option B\", \"Option C\", \"Option D\"], \"answer\": \"Correct option text\"}]}\n"
+        f"Include up to 20 flashcards and {num_mcqs} multiple-choice questions. "
+        "Keep each note brief (1-2 sentences), each flashcard concise, MCQ options distinct, "
+        "and make every MCQ answer match exactly one option. Do not use markdown symbols like asterisks.\n\n"
+        "Text:\n" + clipped
+    )
+
+    valid, failed = {}, list(STUDY_PACK_SECTIONS)
+    response = generate_gemini_response(prompt)
+    if "⚠ ERROR" in response:
+        logger.warning(f"Combined study pack generation failed: {response}")
+    else:
+        try:
+            valid, failed = validate_study_pack(parse_json_response(response, "{"), num_mcqs)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Combined study pack reply was not valid JSON: {e}")
+
+    if failed:
+        logger.info(f"Falling back to per-artifact generation for: {', '.join(failed)}")
+    fallbacks = {
+        "summary": lambda: generate_summary_artifact(clipped),
+        "short_notes": lambda: generate_notes_artifact(extracted_text),
+        "flashcards": lambda: generate_flashcards_artifact(extracted_text),
+        "mcqs": lambda: generate_mcqs_artifact(extracted_text, num_mcqs),
+    }
+    for section in failed:
+        valid[section] = fallbacks[section]()
+    return valid
+
+def is_failed_artifact(kind, data):
+    """True for empty results and the error messages the generators return instead of raising."""
+    if not data:
+        return True
+    if isinstance(data, str):
+        return "⚠ ERROR" in data or "generation failed" in data
+    return False
+
+# Notes, flashcards and MCQs memoised per document; generated on first request
+# or by the background prefetch, whose Gemini calls queue behind chat and
+# on-demand generation. A request waits at most ARTIFACT_WAIT_SECONDS (keep it
+# below gunicorn's --timeout 120) and then gets 202 while generation goes on.
+ARTIFACT_WAIT_SECONDS = float(os.getenv("ARTIFACT_WAIT_SECONDS", "60"))
+artifact_store = ArtifactStore(
+    os.path.join(DB_DIR, 'artifacts.db'),
+    generators={
+        "short_notes": generate_notes_artifact,
+        "flashcards": generate_flashcards_artifact,
+        # A pool of 40 so the frontend can offer 10/20/30-question tests
+        "mcqs": lambda text: generate_mcqs_artifact(text, 40),
+    },
+    text_fn=document_store.text,
+    prefetch_workers=int(os.getenv("ARTIFACT_PREFETCH_WORKERS", "1")),
+    is_failure=is_failed_artifact,
+    background_context=lambda: priority_scope(PRIORITY_PREFETCH),
+)
+
+def artifact_handles(document_id):
+    """Status and URL of each lazily generated artifact of a document."""
+    return {
+        kind: {"status": status, "url": f"/api/documents/{document_id}/artifacts/{kind}"}
+        for kind, status in artifact_store.status(document_id).items()
+    }
+
+# Upload processing: each file of a request is processed as its own task.
+# PDF extraction/OCR is CPU-bound and runs in a small process pool ("spawn",
+# so workers never inherit locks from this multi-threaded process); image
+# descriptions, RAG ingest and artifact generation are I/O-bound and run on
+# threads. A process-wide budget limits how many files are in flight and their
+# estimated memory, admitting them in arrival order, and one request never
+# uses more than UPLOAD_PER_REQUEST_PARALLEL of the slots.
+EXTRACTION_PROCESSES = int(os.getenv("EXTRACTION_PROCESSES", "2"))
+UPLOAD_PER_REQUEST_PARALLEL = int(os.getenv("UPLOAD_PER_REQUEST_PARALLEL", "4"))
+UPLOAD_MEMORY_FACTOR = float(os.getenv("UPLOAD_MEMORY_FACTOR", "4"))
+UPLOAD_QUEUE_TIMEOUT = float(os.getenv("UPLOAD_QUEUE_TIMEOUT", "120"))
+# YouTube transcripts are indexed into RAG in windows of this many seconds
+TRANSCRIPT_WINDOW_SECONDS = float(os.getenv("TRANSCRIPT_WINDOW_SECONDS", "60"))
+upload_budget = ResourceBudget(
+    max_tasks=int(os.getenv("UPLOAD_MAX_CONCURRENT_FILES", "6")),
+    max_bytes=int(float(os.getenv("UPLOAD_MEMORY_BUDGET_MB", "512")) * 1024 * 1024),
+)
+upload_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.getenv("UPLOAD_WORKERS", "8")),
+    thread_name_prefix="upload",
+)
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+
+def get_extraction_pool():
+    """Process pool for PDF extraction, created on first use (None = run inline)."""
+    global _extraction_pool
+    if EXTRACTION_PROCESSES <= 0:
+        return None
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            _extraction_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=EXTRACTION_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _extraction_pool
+
+def run_extraction(fn, *args, **kwargs):
+    """Run an extraction function in the process pool, falling back to this thread."""
+    global _extraction_pool
+    pool = get_extraction_pool()
+    if pool is None:
+        return fn(*args, **kwargs)
+    try:
+        return pool.submit(fn, *args, **kwargs).result()
+    except BrokenProcessPool as e:
+        # A worker died (e.g. out of memory); start a fresh pool next time
+        logger.error(f"Extraction worker failed, retrying in-process: {e}")
+        with _extraction_pool_lock:
+            if _extraction_pool is pool:
+                _extraction_pool = None
+        return fn(*args, **kwargs)
+
+def upload_cost(filepath):
+    """Estimated peak memory for processing one uploaded file."""
+    try:
+        size = os.path.getsize(filepath)
+    except OSError:
+        size = 0
+    return max(int(size * UPLOAD_MEMORY_FACTOR), 1024 * 1024)
+
+def process_uploaded_file(filepath, filename, quick_mode):
+    """Extract one saved upload (image description or PDF text + RAG ingest)."""
+    with upload_budget.reserve(upload_cost(filepath), timeout=UPLOAD_QUEUE_TIMEOUT):
+        try:
+            file_data = {"filename": filename}
+
+            if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
+                file_data["type"] = "image"
+                file_data["image_description"] = generate_image_description(filepath)
+
+                image_hash = blob_store.put_file(filepath)
+                file_data["image_hash"] = image_hash
+                file_data["image_url"] = f"/blobs/{image_hash}"
+                file_data["thumbnail_url"] = f"/blobs/{image_hash}/thumbnail"
+                if INLINE_IMAGE_BASE64:
+                    with open(filepath, "rb") as img_file:
+                        mime_type = blob_store.mime_type(image_hash)
+                        file_data["base64_image"] = f"data:{mime_type};base64,{base64.b64encode(img_file.read()).decode('utf-8')}"
+                return file_data
+
+            file_data["type"] = "pdf"
+
+            # Extract text using PyMuPDF with page limits (timed in this process,
+            # so the extraction timers include waiting for a pool worker)
+            max_pages = 50 if quick_mode else 100
+            with metrics.timed("extract_text", nbytes=os.path.getsize(filepath)):
+                extracted_text = run_extraction(extract_text_from_pdf, filepath, max_pages=max_pages)
+
+            # Fall back to OCR if no text found (with even stricter limits)
+            if not extracted_text:
+                logger.info(f"No text found with PyMuPDF in {filename}, trying OCR...")
+                ocr_pages = 10 if quick_mode else 20
+                with metrics.timed("ocr", nbytes=os.path.getsize(filepath)):
+                    extracted_text = run_extraction(extract_text_from_scanned_pdf, filepath, max_pages=ocr_pages)
+
+            file_data["extracted_text"] = extracted_text if extracted_text else "No text could be extracted from this PDF."
+
+            # Process PDF into RAG vector store if RAG is available
+            if rag_processor and extracted_text and "No text could be extracted" not in extracted_text:
+                try:
+                    # Generate a unique book_id from filename
+                    book_id = secure_filename(filename).replace('.pdf', '').replace(' ', '_')[:50]
+                    logger.info(f"Processing {filename} into RAG vector store...")
+                    chunk_count = rag_processor.process_document(
+                        file_path=filepath,
+                        book_id=book_id,
+                        metadata={"filename": filename, "type": "pdf"},
+                        max_pages=max_pages
+                    )
+                    if answer_cache is not None:
+                        answer_cache.invalidate(book_id)
+                    file_data["book_id"] = book_id
+                    file_data["rag_processed"] = True
+                    file_data["rag_chunks"] = chunk_count
+                    logger.info(f"✓ Processed {chunk_count} chunks into RAG for {filename}")
+                except Exception as rag_error:
+                    logger.warning(f"RAG processing failed for {filename}: {rag_error}")
+                    file_data["rag_processed"] = False
+                    file_data["rag_error"] = str(rag_error)
+            else:
+                file_data["rag_processed"] = False
+
+            return file_data
+        except Exception as e:
+            logger.error(f"Error processing file {filename}: {e}")
+            return None
+
+def build_upload_result(file_data, quick_mode, combined_mode, include_text, lazy_mode=False):
+    """
+    Response entry for one processed upload, generating its study artifacts.
+    In lazy mode only the summary is generated; the entry carries `artifacts`
+    handles for the rest (needs the document to be stored).
+    """
+    processed_data = {
+        "type": file_data["type"],
+        "filename": file_data["filename"],
+        "summary": "",
+        "flashcards": [],
+        "short_notes": "",
+        "mcqs": [],
+        "raw_text": "",
+        "is_image": file_data["type"] == "image"
+    }
+
+    # Add RAG-related fields if available
+    if file_data.get("book_id"):
+        processed_data["book_id"] = file_data["book_id"]
+        processed_data["rag_processed"] = file_data.get("rag_processed", False)
+        if file_data.get("rag_chunks"):
+            processed_data["rag_chunks"] = file_data["rag_chunks"]
+
+    # Add transcript data for YouTube videos
+    if file_data["type"] == "youtube":
+        processed_data["transcript"] = file_data.get("transcript")
+        processed_data["youtube_id"] = file_data.get("youtube_id")
+
+    if file_data["type"] == "image":
+        processed_data["image_description"] = file_data["image_description"]
+        for key in ("image_hash", "image_url", "thumbnail_url", "base64_image"):
+            if key in file_data:
+                processed_data[key] = file_data[key]
+    elif file_data["type"] in ["pdf", "youtube"]:
+        extracted_text = file_data["extracted_text"]
+        if extracted_text and "No text could be extracted" not in extracted_text:
+            # Use clipped text for all processing to avoid quota issues
+            clipped = extracted_text[:4000] if quick_mode else extracted_text[:8000]
+            if include_text:
+                processed_data["raw_text"] = extracted_text
+            document_id = None
+            try:
+                document = document_store.put(extracted_text, file_data["filename"], file_data["type"])
+                document_id = document["document_id"]
+                processed_data["document_id"] = document_id
+                processed_data["page_count"] = document["page_count"]
+                # A re-upload regenerates the artifacts instead of serving stale ones
+                artifact_store.invalidate(document_id)
+            except Exception as store_error:
+                logger.warning(f"Could not store document text for {file_data['filename']}: {store_error}")
+                processed_data["raw_text"] = extracted_text
+
+            # Default: no MCQs yet; may be filled below (for non-quick mode)
+            processed_data["mcqs"] = []
+
+            if document_id and (lazy_mode or quick_mode) and not combined_mode:
+                # Summary now; the rest on demand (and prefetched unless in quick mode)
+                processed_data["summary"] = generate_summary_artifact(clipped)
+                if lazy_mode and not quick_mode and ARTIFACT_PREFETCH:
+                    artifact_store.prefetch(document_id)
+                processed_data["artifacts"] = artifact_handles(document_id)
+            elif quick_mode:
+                # Quick mode: summary only
+                processed_data["summary"] = generate_summary_artifact(clipped)
+            elif combined_mode:
+                # One structured call for all four artifacts
+                processed_data.update(generate_study_pack(extracted_text, 40))
+            else:
+                processed_data["summary"] = generate_summary_artifact(clipped)
+                processed_data["short_notes"] = generate_notes_artifact(extracted_text)
+                processed_data["flashcards"] = generate_flashcards_artifact(extracted_text)
+                # Ask the model for more MCQs so the frontend can offer 10/20/30-question tests
+                # We request 40 and will later use at most the first 30 valid ones.
+                processed_data["mcqs"] = generate_mcqs_artifact(extracted_text, 40)
+
+            if document_id and not quick_mode and "artifacts" not in processed_data:
+                # Memoise eagerly generated artifacts so the artifact endpoints serve them
+                for kind in artifact_store.generators:
+                    if not is_failed_artifact(kind, processed_data.get(kind)):
+                        artifact_store.put(document_id, kind, processed_data[kind])
+
+    return processed_data
+
+def index_youtube_transcript(file_data):
+    """Index transcript segments into RAG as time windows, so chat can cite timestamps."""
+    transcript_data = file_data.get("transcript")
+    if not (rag_processor and transcript_data and file_data.get("youtube_id")):
+        file_data["rag_processed"] = False
+        return
+    book_id = f"youtube_{file_data['youtube_id']}_transcript"
+    try:
+        chunk_count = rag_processor.process_transcript(
+            transcript_data,
+            book_id=book_id,
+            metadata={"filename": file_data["filename"], "source": file_data["filename"], "type": "youtube"},
+            window_seconds=TRANSCRIPT_WINDOW_SECONDS,
+        )
+        if answer_cache is not None:
+            answer_cache.invalidate(book_id)
+        file_data["book_id"] = book_id
+        file_data["rag_processed"] = True
+        file_data["rag_chunks"] = chunk_count
+        logger.info(f"✓ Indexed {chunk_count} transcript windows for {file_data['youtube_id']}")
+    except Exception as rag_error:
+        logger.warning(f"RAG transcript indexing failed for {file_data['filename']}: {rag_error}")
+        file_data["rag_processed"] = False
+        file_data["rag_error"] = str(rag_error)
+
 @app.route('/upload', methods=['POST'])
 def upload_file_or_url():
-    """Handle file uploads and URL processing with optimized memory management."""
+    """Handle file uploads and URL processing; files are processed concurrently, results keep upload order."""
     logger.info("Received upload request")
-    files_data = []
     temp_files = []  # Track all temporary files for cleanup
     quick_mode = request.form.get('quick_mode') in ['1', 'true', 'True']
+    combined_form = request.form.get('combined_mode')
+    combined_mode = COMBINED_GENERATION if combined_form is None else combined_form in ['1', 'true', 'True']
+    # Clients that fetch text by document_id can skip raw_text in the response
+    include_text = request.form.get('include_text', '1') not in ['0', 'false', 'False']
+    lazy_form = request.form.get('lazy_artifacts')
+    lazy_mode = LAZY_ARTIFACTS if lazy_form is None else lazy_form in ['1', 'true', 'True']
 
     try:
         if 'files' not in request.files and 'youtube_url' not in request.form:
             return jsonify({"error": "No files or YouTube URL provided."}), 400
 
-        # Process file uploads
+        # Save file uploads (in the request thread; the stream belongs to it)
+        uploads = []
         if 'files' in request.files:
             files = request.files.getlist('files')
             if not files or all(file.filename == '' for file in files):
@@ -674,81 +1132,44 @@ def upload_file_or_url():
             for file in files:
                 if not file.filename:
                     continue
-                    
+
                 if not file.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.pdf')):
                     return jsonify({"error": f"Unsupported file type for {file.filename}."}), 400
 
-                filepath = os.path.join(UPLOAD_FOLDER, secure_filename(file.filename))
+                # Unique name: concurrent requests may upload files with the same name
+                filepath = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex[:12]}_{secure_filename(file.filename)}")
                 temp_files.append(filepath)  # Track for cleanup
-                
                 try:
                     file.save(filepath)
-                    file_data = {"filename": file.filename}
-                    
-                    if file.filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-                        file_data["type"] = "image"
-                        file_data["image_description"] = generate_image_description(filepath)
-                        
-                        with open(filepath, "rb") as img_file:
-                            mime_type = "image/jpeg" if file.filename.lower().endswith(('.jpg', '.jpeg')) else "image/png"
-                            file_data["base64_image"] = f"data:{mime_type};base64,{base64.b64encode(img_file.read()).decode('utf-8')}"
-                        
-                        files_data.append(file_data)
-                        
-                    elif file.filename.lower().endswith('.pdf'):
-                        file_data["type"] = "pdf"
-                        
-                        # Extract text using PyMuPDF with page limits
-                        max_pages = 50 if quick_mode else 100
-                        extracted_text = extract_text_from_pdf(filepath, max_pages=max_pages)
-                        
-                        # Fall back to OCR if no text found (with even stricter limits)
-                        if not extracted_text:
-                            logger.info("No text found with PyMuPDF, trying OCR...")
-                            ocr_pages = 10 if quick_mode else 20
-                            extracted_text = extract_text_from_scanned_pdf(filepath, max_pages=ocr_pages)
-                        
-                        file_data["extracted_text"] = extracted_text if extracted_text else "No text could be extracted from this PDF."
-                        
-                        # Process PDF into RAG vector store if RAG is available
-                        if rag_processor and extracted_text and "No text could be extracted" not in extracted_text:
-                            try:
-                                # Generate a unique book_id from filename
-                                book_id = secure_filename(file.filename).replace('.pdf', '').replace(' ', '_')[:50]
-                                # Process document into vector store (async in background would be better, but sync for now)
-                                logger.info(f"Processing {file.filename} into RAG vector store...")
-                                chunk_count = rag_processor.process_document(
-                                    file_path=filepath,
-                                    book_id=book_id,
-                                    metadata={"filename": file.filename, "type": "pdf"},
-                                    max_pages=max_pages
-                                )
-                                file_data["book_id"] = book_id
-                                file_data["rag_processed"] = True
-                                file_data["rag_chunks"] = chunk_count
-                                logger.info(f"✓ Processed {chunk_count} chunks into RAG for {file.filename}")
-                            except Exception as rag_error:
-                                logger.warning(f"RAG processing failed for {file.filename}: {rag_error}")
-                                file_data["rag_processed"] = False
-                                file_data["rag_error"] = str(rag_error)
-                        else:
-                            file_data["rag_processed"] = False
-                        
-                        files_data.append(file_data)
-                        
+                    uploads.append((filepath, file.filename))
                 except Exception as e:
-                    logger.error(f"Error processing file {file.filename}: {e}")
-                    continue
+                    logger.error(f"Error saving file {file.filename}: {e}")
 
-        # Process YouTube URL if provided
+        youtube_url = None
         if 'youtube_url' in request.form:
             youtube_url = request.form['youtube_url']
             if not youtube_url:
                 return jsonify({"error": "Empty YouTube URL provided."}), 400
-            
+        # The transcript is fetched while the files are being processed
+        youtube_future = upload_executor.submit(extract_text_from_youtube, youtube_url) if youtube_url else None
+
+        try:
+            files_data = map_ordered(
+                upload_executor,
+                lambda upload: process_uploaded_file(upload[0], upload[1], quick_mode),
+                uploads,
+                UPLOAD_PER_REQUEST_PARALLEL,
+            )
+        except BudgetTimeout as e:
+            logger.warning(f"Upload rejected: {e}")
+            return jsonify({"error": "The server is busy processing other uploads. Please try again shortly."}), 503
+        files_data = [file_data for file_data in files_data if file_data]
+
+        # Process YouTube URL if provided
+        if youtube_future is not None:
             try:
-                extracted_text, transcript_data = extract_text_from_youtube(youtube_url)
-                
+                extracted_text, transcript_data = youtube_future.result()
+
                 if not extracted_text:
                     video_id = extract_video_id(youtube_url)
                     error_msg = f"Failed to extract content from YouTube video. "
@@ -758,16 +1179,18 @@ def upload_file_or_url():
                         error_msg += "Invalid YouTube URL format."
                     logger.error(error_msg)
                     return jsonify({"error": error_msg}), 400
-                
+
                 video_id = extract_video_id(youtube_url)
-                
-                files_data.append({
+
+                youtube_data = {
                     "type": "youtube",
                     "filename": youtube_url,
                     "extracted_text": extracted_text,
                     "transcript": transcript_data,
                     "youtube_id": video_id,
-                })
+                }
+                index_youtube_transcript(youtube_data)
+                files_data.append(youtube_data)
             except Exception as e:
                 logger.error(f"Error processing YouTube URL {youtube_url}: {e}")
                 return jsonify({"error": f"Failed to process YouTube URL: {str(e)}"}), 500
@@ -775,94 +1198,14 @@ def upload_file_or_url():
         if not files_data:
             return jsonify({"error": "Failed to process any files or URLs."}), 400
 
-        # Process content generation for each file
-        response_data = []
-        for file_data in files_data:
-            processed_data = {
-                "type": file_data["type"],
-                "filename": file_data["filename"],
-                "summary": "",
-                "flashcards": [],
-                "short_notes": "",
-                "mcqs": [],
-                "raw_text": "",
-                "is_image": file_data["type"] == "image"
-            }
-            
-            # Add RAG-related fields if available
-            if file_data.get("book_id"):
-                processed_data["book_id"] = file_data["book_id"]
-                processed_data["rag_processed"] = file_data.get("rag_processed", False)
-                if file_data.get("rag_chunks"):
-                    processed_data["rag_chunks"] = file_data["rag_chunks"]
-            
-            # Add transcript data for YouTube videos
-            if file_data["type"] == "youtube":
-                processed_data["transcript"] = file_data.get("transcript")
-                processed_data["youtube_id"] = file_data.get("youtube_id")
-            
-            if file_data["type"] == "image":
-                processed_data["image_description"] = file_data["image_description"]
-                processed_data["base64_image"] = file_data["base64_image"]
-            elif file_data["type"] in ["pdf", "youtube"]:
-                extracted_text = file_data["extracted_text"]
-                if extracted_text and "No text could be extracted" not in extracted_text:
-                    # Use clipped text for all processing to avoid quota issues
-                    clipped = extracted_text[:4000] if quick_mode else extracted_text[:8000]
-                    processed_data["raw_text"] = extracted_text
-                    
-                    # Generate summary
-                    processed_data["summary"] = generate_gemini_response(f"Summarize this text concisely:\n\n{clipped}")
-                    # Default: no MCQs yet; may be filled below (for non-quick mode)
-                    processed_data["mcqs"] = []
-                    
-                    # Only generate short notes, flashcards, and MCQs in non-quick mode
-                    if not quick_mode:
-                        # Short notes
-                        short_notes_response = generate_short_notes_with_retry(extracted_text)
-                        if isinstance(short_notes_response, dict) and short_notes_response.get("status") == "error":
-                            processed_data["short_notes"] = f"Note generation failed: {short_notes_response.get('message')}"
-                        else:
-                            processed_data["short_notes"] = short_notes_response
-                        
-                        # Flashcards
-                        flashcards_response = generate_flashcards_with_retry(extracted_text)
-                        if isinstance(flashcards_response, dict) and flashcards_response.get("status") == "error":
-                            processed_data["flashcards"] = []
-                            logger.warning(f"Flashcard generation failed: {flashcards_response.get('message')}")
-                        else:
-                            processed_data["flashcards"] = process_flashcards(flashcards_response)
-
-                        # MCQs – pre-generate a set during upload (like the old behavior)
-                        try:
-                            # Ask the model for more MCQs so the frontend can offer 10/20/30-question tests
-                            # We request 40 and will later use at most the first 30 valid ones.
-                            initial_mcqs = generate_mcqs_with_retry(extracted_text, 40)
-                            if isinstance(initial_mcqs, list):
-                                # Keep only valid, non-error MCQ dicts with text options
-                                simple_mcqs = []
-                                for item in initial_mcqs:
-                                    if not isinstance(item, dict):
-                                        continue
-                                    if "error" in item:
-                                        continue
-                                    q = (item.get("question") or "").strip()
-                                    opts = item.get("options") or []
-                                    ans = (item.get("answer") or "").strip()
-                                    if q and isinstance(opts, list) and len(opts) >= 2 and ans:
-                                        simple_mcqs.append({
-                                            "question": q,
-                                            "options": [str(o).strip() for o in opts],
-                                            "answer": ans,
-                                        })
-                                if simple_mcqs:
-                                    processed_data["mcqs"] = simple_mcqs
-                        except Exception as e:
-                            logger.warning(f"Initial MCQ generation during upload failed: {e}")
-            
-            response_data.append(processed_data)
-            
-        return jsonify(response_data)
+        # Generate content for each file concurrently (LLM calls stay within the limiter)
+        response_data = map_ordered(
+            upload_executor,
+            lambda file_data: build_upload_result(file_data, quick_mode, combined_mode, include_text, lazy_mode),
+            files_data,
+            UPLOAD_PER_REQUEST_PARALLEL,
+        )
+        return json_stream(response_data)
         
     except Exception as e:
         logger.error(f"Unexpected error in upload_file_or_url: {e}")
@@ -876,12 +1219,40 @@ def upload_file_or_url():
         import gc
         gc.collect()
 
+def _page_arg(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid page number: {value}")
+
+def resolve_source_text(data):
+    """
+    Source text for a generation request: the stored document (optionally
+    start_page..end_page) when document_id is given, else the posted text.
+    """
+    document_id = data.get('document_id')
+    if document_id:
+        return document_store.text(document_id, _page_arg(data.get('start_page')), _page_arg(data.get('end_page')))
+    return (data.get('text') or '').strip()
+
+def source_text_or_error(data):
+    """(text, None) or (None, error response) for generation endpoints."""
+    try:
+        text = resolve_source_text(data)
+    except DocumentNotFound:
+        return None, (jsonify({"error": "Document not found. Please re-upload the file."}), 404)
+    except ValueError as e:
+        return None, (jsonify({"error": str(e)}), 400)
+    if not text:
+        return None, (jsonify({"error": "text or document_id is required"}), 400)
+    return text, None
+
 @app.route('/generate/notes', methods=['POST'])
 def generate_notes():
     data = request.get_json(force=True)
-    text = data.get('text') or ''
-    if not text:
-        return jsonify({"error": "text is required"}), 400
+    text, error = source_text_or_error(data)
+    if error:
+        return error
     try:
         clipped_text = text[:6000]
         response = generate_short_notes_with_retry(clipped_text)
@@ -895,9 +1266,9 @@ def generate_notes():
 @app.route('/generate/flashcards', methods=['POST'])
 def generate_flashcards_endpoint():
     data = request.get_json(force=True)
-    text = data.get('text') or ''
-    if not text:
-        return jsonify({"error": "text is required"}), 400
+    text, error = source_text_or_error(data)
+    if error:
+        return error
     try:
         clipped_text = text[:8000]
         resp = generate_flashcards_with_retry(clipped_text)
@@ -910,15 +1281,14 @@ def generate_flashcards_endpoint():
 @app.route('/generate/mcqs', methods=['POST'])
 def generate_mcqs_endpoint():
     data = request.get_json() or {}
-    text = data.get('text', '').strip()
     n = min(max(1, int(data.get('num_questions', 10))), 20)
-
-    if not text:
-        return jsonify({"error": "Text is required"}), 400
+    text, error = source_text_or_error(data)
+    if error:
+        return error
 
     try:
-        # Generate MCQs using the retry function
-        raw_mcqs = generate_mcqs_with_retry(text, n)
+        # Generate MCQs across the document's sections
+        raw_mcqs = question_bank.generate(text, n)
         
         # If the generator returned only an error entry, surface it clearly
         if isinstance(raw_mcqs, list) and len(raw_mcqs) == 1 and isinstance(raw_mcqs[0], dict) and "error" in raw_mcqs[0]:
@@ -965,9 +1335,113 @@ def generate_mcqs_endpoint():
         logger.error(f"MCQ generation error: {e}")
         return jsonify({"error": "Failed to generate MCQs. Please try again."}), 500
 
+def quiz_db_or_error():
+    """(db, None), or (None, error response) when no quiz database is configured."""
+    if quiz_db is None:
+        return None, (jsonify({"error": "Question bank not configured (set MONGO_URI)"}), 503)
+    return quiz_db, None
+
+@app.route('/mcq/questions', methods=['GET'])
+def list_bank_questions():
+    """
+    Browse the question bank: ?topic=&difficulty=&limit= (max 100) and
+    ?cursor= from the previous page's next_cursor. Answers are not included.
+    """
+    db, error = quiz_db_or_error()
+    if error:
+        return error
+    topic, difficulty = request.args.get('topic'), request.args.get('difficulty')
+    if not topic or not difficulty:
+        return jsonify({"error": "topic and difficulty are required"}), 400
+    try:
+        questions, next_cursor = quiz_service.list_questions(
+            db, topic, difficulty,
+            limit=request.args.get('limit', default=20, type=int),
+            cursor=request.args.get('cursor'),
+        )
+    except Exception as e:
+        logger.error(f"Question bank error: {e}")
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"questions": questions, "next_cursor": next_cursor})
+
+@app.route('/mcq/questions', methods=['POST'])
+def add_bank_questions():
+    """
+    Add questions to the bank: {"questions": [{"topic", "difficulty", "question",
+    "options", "correct_answer"}]}. Users are notified per topic in the background.
+    """
+    db, error = quiz_db_or_error()
+    if error:
+        return error
+    questions = (request.get_json() or {}).get('questions') or []
+    required = ("topic", "difficulty", "question", "options", "correct_answer")
+    if not questions or not all(isinstance(q, dict) and all(q.get(k) for k in required) for q in questions):
+        return jsonify({"error": f"questions must be a non-empty list with {', '.join(required)}"}), 400
+    try:
+        ids = quiz_service.save_questions(db, questions)
+    except Exception as e:
+        logger.error(f"Question bank error: {e}")
+        return jsonify({"error": str(e)}), 500
+    fanouts = {topic: notification_worker.submit(topic) for topic in {q["topic"] for q in questions}}
+    return jsonify({"ids": ids, "notifications": fanouts}), 201
+
+@app.route('/mcq/questions/sample', methods=['GET'])
+def sample_bank_questions():
+    """A random quiz: ?topic=&difficulty=&user_id=&size= (max 50), unattempted questions first."""
+    db, error = quiz_db_or_error()
+    if error:
+        return error
+    topic, difficulty = request.args.get('topic'), request.args.get('difficulty')
+    if not topic or not difficulty:
+        return jsonify({"error": "topic and difficulty are required"}), 400
+    try:
+        questions = quiz_service.fetch_questions(
+            db, topic, difficulty, request.args.get('user_id', 'guest'),
+            size=request.args.get('size', default=10, type=int),
+        )
+    except Exception as e:
+        logger.error(f"Question bank error: {e}")
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"questions": questions})
+
+def record_progress(db, user_id, results):
+    """Update the user's progress aggregates; a failure never fails the submission."""
+    try:
+        progress_service.record_attempt(db, user_id, results)
+    except Exception as e:
+        logger.error(f"Progress update failed for {user_id}: {e}")
+
+def quiz_feedback(score):
+    return "Excellent!" if score >= 90 else "Great!" if score >= 70 else "Good effort!" if score >= 50 else "Keep practicing!"
+
 @app.route('/mcq/submit', methods=['POST'])
 def submit_mcq_answers():
-    data = request.get_json()
+    """
+    Score a quiz. Question-bank quizzes ({"user_id", "answers": [{"question_id",
+    "selected_option"}]}) are graded and recorded server-side in one batch;
+    generated quizzes without question ids ({"mcqs": [{"user_answer",
+    "correct_answer"}]}) are scored from the submitted answers.
+    """
+    data = request.get_json() or {}
+    answers = data.get('answers') or [
+        {"question_id": q.get('question_id') or q.get('_id'), "selected_option": q.get('user_answer')}
+        for q in data.get('mcqs', []) if q.get('question_id') or q.get('_id')
+    ]
+    if answers:
+        db, error = quiz_db_or_error()
+        if error:
+            return error
+        user_id = data.get('user_id', 'guest')
+        try:
+            result = quiz_service.submit_attempt(db, user_id, answers)
+        except Exception as e:
+            logger.error(f"Quiz submission error: {e}")
+            return jsonify({"error": str(e)}), 500
+        if not result["total"]:
+            return jsonify({"error": "None of the answered questions exist", "results": result["results"]}), 400
+        record_progress(db, user_id, result["results"])
+        return jsonify(dict(result, success=True, feedback=quiz_feedback(result["score"])))
+
     mcqs = data.get('mcqs', [])
     if not mcqs:
         return jsonify({"error": "No answers provided"}), 400
@@ -976,26 +1450,34 @@ def submit_mcq_answers():
     total = len(mcqs)
     score = (correct / total) * 100 if total else 0
 
-    feedback = "Excellent!" if score >= 90 else "Great!" if score >= 70 else "Good effort!" if score >= 50 else "Keep practicing!"
-
     return jsonify({
         "success": True,
         "score": round(score, 1),
         "correct": correct,
         "total": total,
-        "feedback": feedback
+        "feedback": quiz_feedback(score)
     })
 
 @app.route('/mcq/progress', methods=['GET'])
 def get_mcq_progress():
-    """Get user's MCQ progress history (placeholder for future implementation)"""
-    return jsonify({
-        "total_quizzes_taken": 0,
-        "average_score": 0,
-        "best_score": 0,
-        "quizzes_completed": 0,
-        "improvement_trend": "beginner"
-    })
+    """
+    A user's quiz progress (?user_id=): totals, best/average score and recent
+    trend, overall and per topic. Read from incrementally maintained aggregates.
+    """
+    user_id = request.args.get('user_id', 'guest')
+    if quiz_db is None or user_id == 'guest':
+        return jsonify({
+            "total_quizzes_taken": 0,
+            "average_score": 0,
+            "best_score": 0,
+            "quizzes_completed": 0,
+            "improvement_trend": "beginner"
+        })
+    try:
+        return jsonify(progress_service.get_progress(quiz_db, user_id))
+    except Exception as e:
+        logger.error(f"Progress lookup failed for {user_id}: {e}")
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/download', methods=['POST'])
 def download_content():
@@ -1006,183 +1488,421 @@ def download_content():
     
     # Handle transcript download
     if content_type == 'transcript':
-        transcript_data = content.get('transcript', [])
-        if format_type == 'txt':
-            buffer = BytesIO()
-            buffer.write(b"YouTube Video Transcript\n\n")
-            for segment in transcript_data:
-                time_str = f"[{int(segment['start']//60)}:{int(segment['start']%60):02d}]"
-                buffer.write(f"{time_str} {segment['text']}\n".encode('utf-8'))
-            buffer.seek(0)
-            return send_file(buffer, as_attachment=True, download_name='transcript.txt', mimetype='text/plain')
+        content = (content or {}).get('transcript', []) if isinstance(content, dict) else content
     
     if not content_type or not format_type or not content:
         return jsonify({"error": "Missing required fields"}), 400
-        
-    filename = f"{content_type}.{format_type}"
-    buffer = BytesIO()
     
-    if format_type == 'pdf':
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        styles = getSampleStyleSheet()
-        custom_style = ParagraphStyle(
-            'CustomStyle',
-            parent=styles['Normal'],
-            fontSize=12,
-            leading=14,
-            spaceAfter=12,
-            alignment=1
-        )
-        story = []
-        if content_type in ['summary', 'short_notes', 'image_description']:
-            story.append(Paragraph(content_type.replace('_', ' ').title(), styles['Title']))
-            for paragraph in content.split('\n\n'):
-                story.append(Paragraph(paragraph, custom_style))
-                story.append(Spacer(1, 12))
-        elif content_type == 'flashcards':
-            story.append(Paragraph("Flashcards", styles['Title']))
-            for i, card in enumerate(content, 1):
-                story.append(Paragraph(f"Card {i}", styles['Heading2']))
-                story.append(Paragraph(f"Question: {card['front']}", custom_style))
-                story.append(Paragraph(f"Answer: {card['back']}", custom_style))
-                story.append(Spacer(1, 12))
-        elif content_type == 'mcqs':
-            story.append(Paragraph("Multiple Choice Questions", styles['Title']))
-            for i, mcq in enumerate(content, 1):
-                story.append(Paragraph(f"Question {i}: {mcq['question']}", styles['Heading2']))
-                for option in mcq['options']:
-                    story.append(Paragraph(f"{option['letter']}) {option['text']}", custom_style))
-                story.append(Paragraph(f"Correct Answer: {mcq['correct_answer']}", custom_style))
-                story.append(Paragraph(f"Explanation: {mcq.get('explanation', 'No explanation available')}", custom_style))
-                story.append(Spacer(1, 12))
-        doc.build(story)
-        buffer.seek(0)
-        return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/pdf')
-        
-    elif format_type == 'txt':
-        buffer = BytesIO()
-        if content_type in ['summary', 'short_notes', 'image_description']:
-            buffer.write(content.encode('utf-8'))
-        elif content_type == 'flashcards':
-            buffer.write(b"Flashcards\n\n")
-            for i, card in enumerate(content, 1):
-                buffer.write(f"Card {i}\n".encode('utf-8'))
-                buffer.write(f"  Question: {card['front']}\n".encode('utf-8'))
-                buffer.write(f"  Answer: {card['back']}\n".encode('utf-8'))
-                buffer.write(b"\n")
-        elif content_type == 'mcqs':
-            buffer.write(b"Multiple Choice Questions\n\n")
-            for i, mcq in enumerate(content, 1):
-                buffer.write(f"Question {i}: {mcq['question']}\n".encode('utf-8'))
-                for option in mcq['options']:
-                    buffer.write(f"  {option['letter']}) {option['text']}\n".encode('utf-8'))
-                buffer.write(f"Correct Answer: {mcq['correct_answer']}\n".encode('utf-8'))
-                buffer.write(f"Explanation: {mcq.get('explanation', 'No explanation available')}\n".encode('utf-8'))
-                buffer.write(b"\n")
-        buffer.seek(0)
-        return send_file(buffer, as_attachment=True, download_name=filename, mimetype='text/plain')
-        
-    elif format_type == 'docx':
-        doc = Document()
-        doc.add_heading(content_type.replace('_', ' ').title(), level=1).alignment = WD_ALIGN_PARAGRAPH.CENTER
-        if content_type in ['summary', 'short_notes', 'image_description']:
-            for paragraph in content.split('\n\n'):
-                p = doc.add_paragraph(paragraph)
-                p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-        elif content_type == 'flashcards':
-            for i, card in enumerate(content, 1):
-                doc.add_paragraph(f"Card {i}", style='Heading 2')
-                doc.add_paragraph(f"Question: {card['front']}")
-                doc.add_paragraph(f"Answer: {card['back']}", style='Normal').runs[0].italic = True
-        elif content_type == 'mcqs':
-            for i, mcq in enumerate(content, 1):
-                doc.add_paragraph(f"Question {i}: {mcq['question']}", style='Heading 2')
-                for option in mcq['options']:
-                    doc.add_paragraph(f"{option['letter']}) {option['text']}")
-                doc.add_paragraph(f"Correct Answer: {mcq['correct_answer']}", style='Normal').runs[0].bold = True
-                doc.add_paragraph(f"Explanation: {mcq.get('explanation', 'No explanation available')}", style='Normal')
-        doc.save(buffer)
-        buffer.seek(0)
-        return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-        
-    return jsonify({"error": "Unsupported format"}), 400
+    try:
+        with metrics.timed("download_render"):
+            path = render_cache.render(content_type, format_type, content)
+    except UnsupportedExport:
+        return jsonify({"error": "Unsupported format"}), 400
+    return send_file(path, as_attachment=True, download_name=f"{content_type}.{format_type}",
+                     mimetype=MIME_TYPES[format_type])
+
+@app.route('/download/bulk', methods=['POST'])
+def download_bulk():
+    """
+    ZIP of every artifact of one or more files, e.g.
+    {"files": [<upload result>, ...], "formats": ["pdf", "docx"], "types": ["summary", "mcqs"]}.
+    Artifacts are rendered through the cache first, then the archive is streamed.
+    """
+    data = request.get_json(silent=True) or {}
+    files = data.get('files') or ([data['content']] if isinstance(data.get('content'), dict) else [])
+    formats = data.get('formats') or ['pdf']
+    types = data.get('types')
+    if not isinstance(files, list) or not files or not isinstance(formats, list):
+        return jsonify({"error": "Provide files (a list of upload results) and formats"}), 400
+
+    try:
+        plan = plan_bulk_export(files, formats, types)
+    except UnsupportedExport as e:
+        return jsonify({"error": str(e)}), 400
+    if not plan:
+        return jsonify({"error": "Nothing to export"}), 400
+    if len(plan) > EXPORT_MAX_FILES:
+        return jsonify({"error": f"Too many files in one export (max {EXPORT_MAX_FILES})"}), 400
+
+    try:
+        with metrics.timed("download_render"):
+            entries = [(arcname, render_cache.render(content_type, format_type, content))
+                       for arcname, content_type, format_type, content in plan]
+    except Exception as e:
+        logger.error(f"Bulk export rendering failed: {e}")
+        return jsonify({"error": "Failed to render the export. Please try again."}), 500
+
+    response = Response(stream_zip(entries), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename="notelooms_export.zip"'
+    return response
+
+# Chat helpers shared by /chat and /chat/stream. RAG retrieval is started in
+# the background so it overlaps with assembling the rest of the prompt.
+chat_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.getenv("CHAT_RETRIEVAL_WORKERS", "4")),
+    thread_name_prefix="chat-rag",
+)
+
+# Chat prompts are packed to a token budget; history beyond the most recent
+# turns is folded into a rolling summary stored per conversation, once more
+# than CHAT_HISTORY_SUMMARIZE_AFTER messages (default 2x KEEP_RECENT) pile up.
+CHAT_PROMPT_TOKEN_BUDGET = int(os.getenv("CHAT_PROMPT_TOKEN_BUDGET", "1500"))
+conversation_store = ConversationStore(
+    os.path.join(DB_DIR, 'conversations.db'),
+    keep_recent=int(os.getenv("CHAT_HISTORY_KEEP_RECENT", "6")),
+    summarize_after=int(os.getenv("CHAT_HISTORY_SUMMARIZE_AFTER", "0")) or None,
+)
+conversation_store.prune(max_age_days=float(os.getenv("CHAT_HISTORY_MAX_AGE_DAYS", "30")))
+# Summaries are Gemini calls that can queue behind the rate limiter for up to a
+# minute, so they get their own pool and never delay chat retrieval
+summary_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.getenv("CHAT_SUMMARY_WORKERS", "2")),
+    thread_name_prefix="chat-summary",
+)
+
+# Semantic answer cache for book-grounded questions (needs the RAG embedding model)
+answer_cache = None
+if rag_processor and os.getenv("CHAT_CACHE_ENABLED", "1").lower() in ("1", "true", "yes"):
+    answer_cache = SemanticAnswerCache(
+        threshold=float(os.getenv("CHAT_CACHE_THRESHOLD", "0.92")),
+        capacity_per_book=int(os.getenv("CHAT_CACHE_SIZE", "256")),
+        ttl_seconds=float(os.getenv("CHAT_CACHE_TTL_SECONDS", "86400")),
+    )
+
+CHAT_FALLBACK_MESSAGE = (
+    "I'm having trouble reaching the AI right now. "
+    "Here's a friendly response while I recover: I read your message and the uploaded context. "
+    "Try again in a moment, or ask a simpler question."
+)
+
+def start_chat_retrieval(book_id, user_message):
+    """Start RAG retrieval in the background. Returns a future, or None if RAG is unavailable."""
+    if not (rag_processor and book_id):
+        return None
+
+    def _retrieve():
+        started = time.perf_counter()
+        # Embed once: the vector serves both retrieval and the answer cache
+        embedding = rag_processor.embed_query(user_message)
+        results = rag_processor.query_book(book_id, user_message, k=3, query_embedding=embedding).get('results', [])
+        return results, (time.perf_counter() - started) * 1000, embedding
+
+    return chat_executor.submit(_retrieve)
+
+def collect_chat_retrieval(rag_future, timeout: float = 15.0):
+    """Wait for background retrieval. Returns (results, elapsed_ms, embedding); empty on failure."""
+    if rag_future is None:
+        return [], 0.0, None
+    try:
+        return rag_future.result(timeout=timeout)
+    except Exception as rag_error:
+        logger.warning(f"RAG query failed: {rag_error}")
+        # Continue without RAG context
+        return [], 0.0, None
+
+def lookup_cached_answer(book_id, rag_future):
+    """Return a cached answer for a near-identical question over the same chunks, if any."""
+    if answer_cache is None or rag_future is None:
+        return None
+    results, _, embedding = collect_chat_retrieval(rag_future)
+    if not results or embedding is None:
+        return None
+    return answer_cache.lookup(book_id, embedding, [r.get('chunk_id') for r in results])
+
+def remember_answer(book_id, rag_future, answer):
+    """Cache a book-grounded answer for later near-duplicate questions."""
+    if answer_cache is None or rag_future is None or not answer:
+        return
+    results, _, embedding = collect_chat_retrieval(rag_future)
+    if results and embedding is not None:
+        answer_cache.store(book_id, embedding, [r.get('chunk_id') for r in results], answer)
+
+def format_timestamp(seconds):
+    """12:34 or 1:02:03 for a position in a video."""
+    seconds = int(seconds or 0)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
+
+def rag_result_label(result):
+    """Citation label for a retrieved chunk: its page, or its time range in a video."""
+    if result.get('start') is not None:
+        return f"{format_timestamp(result['start'])}–{format_timestamp(result.get('end', result['start']))}"
+    return f"Page {result.get('page')}" if result.get('page') else None
+
+def rag_timestamps(rag_results):
+    """Time ranges of retrieved video chunks, for citations in the client."""
+    return [
+        {"start": r["start"], "end": r.get("end"), "label": rag_result_label(r)}
+        for r in rag_results if r.get("start") is not None
+    ]
+
+CHAT_INSTRUCTIONS = (
+    "You are a friendly and helpful study assistant chatbot. You can answer questions about the user's uploaded study content "
+    "and also engage in general conversation on any topic. Use the provided content and conversation history to give context-aware, "
+    "natural, and concise responses. If the user asks about something unrelated to the content, respond appropriately with general knowledge "
+    "or conversational replies. Keep responses under 150 words and maintain a friendly tone.\n\n"
+)
+
+def build_chat_prompt(user_message, conversation_history, content, rag_future=None, history_summary=""):
+    """
+    Assemble the chat prompt within CHAT_PROMPT_TOKEN_BUDGET. RAG chunks are
+    ranked by retrieval score; content sections and history turns by overlap
+    with the question (recent turns get a boost). Content and history are
+    scored first, then the background retrieval is joined.
+    Returns (prompt, rag_results, retrieval_ms).
+    """
+    user_message = truncate_to_tokens(user_message, 300)
+    question_terms = terms(user_message)
+    packer = PromptPacker(CHAT_PROMPT_TOKEN_BUDGET)
+    packer.reserve(CHAT_INSTRUCTIONS)
+    packer.reserve(user_message)
+
+    if history_summary:
+        packer.add("summary", history_summary, score=1.5, max_tokens=250)
+
+    sections = (
+        ("summary", "Summary of the uploaded content", 500),
+        ("short_notes", "Short notes from the uploaded content", 500),
+        ("image_description", "Image description", 250),
+    )
+    for key, title, max_tokens in sections:
+        text = content.get(key)
+        if isinstance(text, str):
+            packer.add("content", text, score=0.3 + relevance(question_terms, text), label=title, max_tokens=max_tokens)
+
+    history = conversation_history if isinstance(conversation_history, list) else []
+    for i, message in enumerate(history):
+        if not isinstance(message, dict):
+            continue
+        text = message.get('text', '')
+        recency = 0.6 * (0.5 ** (len(history) - 1 - i))
+        packer.add("history", text, score=0.8 * relevance(question_terms, text) + recency,
+                   label=message.get('sender', 'user'), max_tokens=150)
+
+    rag_results, retrieval_ms, _ = collect_chat_retrieval(rag_future)
+    for result in rag_results:
+        # Chroma returns a distance: smaller means more similar
+        similarity = 1.0 / (1.0 + max(0.0, float(result.get('score', 1.0))))
+        packer.add("rag", result.get('content', ''), score=0.6 + similarity,
+                   label=rag_result_label(result), max_tokens=200)
+
+    packed = packer.pack()
+    prompt = CHAT_INSTRUCTIONS
+
+    if packed.get("rag"):
+        prompt += "\n\nRelevant content from your document:\n"
+        if any(result.get('start') is not None for result in rag_results):
+            prompt += "(Video excerpts are labelled with their time range; cite it, e.g. [12:34], when you use one.)\n"
+        for i, (label, text) in enumerate(packed["rag"], 1):
+            prompt += f"[{i}] {text}\n"
+            if label:
+                prompt += f"   ({label})\n"
+        prompt += "\n\n"
+        logger.info(f"Packed {len(packed['rag'])} of {len(rag_results)} retrieved chunks into the chat prompt")
+
+    content_context = "".join(f"{label}:\n{text}\n\n" for label, text in packed.get("content", []))
+    history_text = "\n".join(f"{label}: {text}" for label, text in packed.get("history", []))
+    if packed.get("summary"):
+        history_text = f"Earlier in this conversation: {packed['summary'][0][1]}\n" + history_text
+
+    prompt += (
+        f"Uploaded content context:\n{content_context}\n\n"
+        f"Conversation history:\n{history_text}\n\n"
+        f"User message: {user_message}\n\n"
+        "Respond as the chatbot:"
+    )
+    return prompt, rag_results, retrieval_ms
+
+def summarize_chat_history(previous_summary, messages):
+    """Fold older chat turns into the rolling conversation summary."""
+    transcript = "\n".join(f"{m['sender']}: {truncate_to_tokens(m['text'], 200)}" for m in messages)
+    prompt = (
+        "Update the running summary of a conversation between a student and a study assistant. "
+        "Keep the topics discussed, questions asked and key facts from the answers. "
+        "Reply with the summary only, under 120 words, without markdown.\n\n"
+        f"Current summary:\n{previous_summary or '(none)'}\n\n"
+        f"New messages:\n{transcript}"
+    )
+    summary = generate_chat_response(prompt, priority=PRIORITY_BULK)
+    if "⚠ ERROR" in summary:
+        logger.warning(f"Conversation summarization failed: {summary}")
+        return None
+    return summary
+
+def load_chat_history(data, user_message):
+    """
+    Resolve (conversation_id, history_summary, history) for a chat request.
+    Known conversations use the server-side history; otherwise any
+    client-sent history seeds a new conversation.
+    """
+    conversation_id = data.get('conversation_id')
+    if conversation_id:
+        conversation_id = conversation_store.ensure(conversation_id)
+        summary, history = conversation_store.history(conversation_id)
+        if summary or history:
+            return conversation_id, summary, history
+    else:
+        conversation_id = conversation_store.ensure()
+
+    history = [
+        {"sender": m.get('sender', 'user'), "text": m.get('text', '')}
+        for m in (data.get('history') or []) if isinstance(m, dict) and m.get('text')
+    ]
+    # Older clients include the current message as the last history entry
+    if history and history[-1]["sender"] == "user" and history[-1]["text"].strip() == user_message.strip():
+        history = history[:-1]
+    if history:
+        conversation_store.append(conversation_id, history)
+    return conversation_id, "", history
+
+def record_chat_turn(conversation_id, user_message, reply):
+    """Store a completed turn and refresh the rolling summary in the background."""
+    messages = [{"sender": "user", "text": user_message}]
+    if reply:
+        messages.append({"sender": "bot", "text": reply})
+    conversation_store.append(conversation_id, messages)
+    if conversation_store.needs_summary(conversation_id):
+        summary_executor.submit(conversation_store.summarize, conversation_id, summarize_chat_history)
 
 @app.route('/chat', methods=['POST'])
 def chat():
     try:
         data = request.get_json()
         user_message = data.get('message')
-        conversation_history = data.get('history', [])
         content = data.get('content', {})
         if not user_message:
             return jsonify({"error": "No message provided."}), 400
         
-        def _truncate(txt: str, max_len: int) -> str:
-            if not isinstance(txt, str):
-                return ""
-            return txt[:max_len]
-
         # Try to use RAG if available and book_id is provided
-        rag_context = ""
         book_id = content.get('book_id')
-        if rag_processor and book_id:
-            try:
-                # Query RAG for relevant context
-                rag_results = rag_processor.query_book(book_id, user_message, k=3)
-                if rag_results.get('results'):
-                    rag_context = "\n\nRelevant content from your document:\n"
-                    for i, result in enumerate(rag_results['results'], 1):
-                        rag_context += f"[{i}] {_truncate(result.get('content', ''), 300)}\n"
-                        if result.get('page'):
-                            rag_context += f"   (Page {result.get('page')})\n"
-                    rag_context += "\n"
-                    logger.info(f"Retrieved {len(rag_results['results'])} relevant chunks from RAG")
-            except Exception as rag_error:
-                logger.warning(f"RAG query failed: {rag_error}")
-                # Continue without RAG context
-
-        content_context = ""
-        if content.get("summary"):
-            content_context += f"Summary of the uploaded content:\n{_truncate(content['summary'], 2000)}\n\n"
-        if content.get("short_notes"):
-            content_context += f"Short notes from the uploaded content:\n{_truncate(content['short_notes'], 2000)}\n\n"
-        if content.get("image_description"):
-            content_context += f"Image description:\n{_truncate(content['image_description'], 1000)}\n\n"
-        
-        recent_history = conversation_history[-5:] if isinstance(conversation_history, list) else []  # Reduced history
-        history_text = "\n".join([f"{m.get('sender','user')}: {_truncate(m.get('text',''), 200)}" for m in recent_history])
-        
-        # Build prompt with RAG context if available
-        prompt = (
-            "You are a friendly and helpful study assistant chatbot. You can answer questions about the user's uploaded study content "
-            "and also engage in general conversation on any topic. Use the provided content and conversation history to give context-aware, "
-            "natural, and concise responses. If the user asks about something unrelated to the content, respond appropriately with general knowledge "
-            "or conversational replies. Keep responses under 150 words and maintain a friendly tone.\n\n"
-        )
-        
-        if rag_context:
-            prompt += f"{rag_context}\n"
-        
-        prompt += (
-            f"Uploaded content context:\n{content_context}\n\n"
-            f"Conversation history:\n{history_text}\n\n"
-            f"User message: {_truncate(user_message, 300)}\n\n"
-            "Respond as the chatbot:"
-        )
+        rag_future = start_chat_retrieval(book_id, user_message)
+        conversation_id, history_summary, conversation_history = load_chat_history(data, user_message)
+
+        cached_answer = lookup_cached_answer(book_id, rag_future)
+        if cached_answer:
+            record_chat_turn(conversation_id, user_message, cached_answer)
+            return jsonify({"response": cached_answer, "conversation_id": conversation_id, "cached": True,
+                            "timestamps": rag_timestamps(collect_chat_retrieval(rag_future)[0])})
+
+        prompt, rag_results, _ = build_chat_prompt(user_message, conversation_history, content, rag_future, history_summary)
         
         response_text = generate_chat_response(prompt)
         if "⚠ ERROR" in response_text:
-            fallback = (
-                "I'm having trouble reaching the AI right now. "
-                "Here's a friendly response while I recover: I read your message and the uploaded context. "
-                "Try again in a moment, or ask a simpler question."
-            )
-            return jsonify({"response": fallback})
-        return jsonify({"response": response_text})
+            record_chat_turn(conversation_id, user_message, None)
+            return jsonify({"response": CHAT_FALLBACK_MESSAGE, "conversation_id": conversation_id})
+        record_chat_turn(conversation_id, user_message, response_text)
+        remember_answer(book_id, rag_future, response_text)
+        return jsonify({"response": response_text, "conversation_id": conversation_id,
+                        "timestamps": rag_timestamps(rag_results)})
     except Exception as e:
         logger.error(f"Chat endpoint error: {e}")
         return jsonify({"error": f"Chat error: {str(e)}"}), 500
 
+def format_sse(data, event: Optional[str] = None) -> str:
+    """Encode one Server-Sent Event with a JSON payload."""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Streaming variant of /chat over Server-Sent Events.
+    Emits `token` events ({"text": ...}) as Gemini generates, an `error` event
+    if generation fails, and a final `done` event with retrieved pages and timings.
+    """
+    data = request.get_json() or {}
+    user_message = data.get('message')
+    content = data.get('content', {}) or {}
+    if not user_message:
+        return jsonify({"error": "No message provided."}), 400
+
+    started = time.perf_counter()
+    book_id = content.get('book_id')
+    rag_future = start_chat_retrieval(book_id, user_message)
+    conversation_id, history_summary, conversation_history = load_chat_history(data, user_message)
+
+    def _elapsed_ms(since):
+        return round((since - started) * 1000, 1) if since else None
+
+    def generate():
+        cached_answer = lookup_cached_answer(book_id, rag_future)
+        if cached_answer:
+            rag_results, retrieval_ms, _ = collect_chat_retrieval(rag_future)
+            first_token_at = time.perf_counter()
+            record_chat_turn(conversation_id, user_message, cached_answer)
+            yield format_sse({"text": cached_answer}, "token")
+            yield format_sse({
+                "conversation_id": conversation_id,
+                "cached": True,
+                "pages": [r.get("page") for r in rag_results if r.get("page")],
+                "timestamps": rag_timestamps(rag_results),
+                "sources": sorted({r.get("source") for r in rag_results if r.get("source")}),
+                "rag_used": True,
+                "error": None,
+                "timings": {
+                    "retrieval_ms": round(retrieval_ms, 1),
+                    "prompt_ms": None,
+                    "first_token_ms": _elapsed_ms(first_token_at),
+                    "total_ms": _elapsed_ms(time.perf_counter()),
+                },
+            }, "done")
+            return
+
+        prompt, rag_results, retrieval_ms = build_chat_prompt(
+            user_message, conversation_history, content, rag_future, history_summary
+        )
+        prompt_ready = time.perf_counter()
+        first_token_at = None
+        error = None
+        reply = ""
+        try:
+            model = gemini_pool.get_model(GEMINI_CHAT_API_KEY, GEMINI_MODEL)
+            with llm_limiter.slot(GEMINI_CHAT_LIMIT_KEY, PRIORITY_CHAT), metrics.timed("gemini_chat_stream"):
+                for chunk in model.generate_content(prompt, stream=True):
+                    try:
+                        text = (chunk.text or "").replace("*", "")
+                    except ValueError:
+                        # Chunks without text parts (e.g. safety metadata)
+                        continue
+                    if not text:
+                        continue
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    reply += text
+                    yield format_sse({"text": text}, "token")
+        except Exception as e:
+            logger.error(f"Gemini Chat streaming error: {e}")
+            if is_rate_limit_error(e):
+                llm_limiter.penalize(GEMINI_CHAT_LIMIT_KEY, retry_after_seconds(e) or 2.0)
+            error = str(e)
+            yield format_sse({"error": error, "fallback": CHAT_FALLBACK_MESSAGE}, "error")
+
+        record_chat_turn(conversation_id, user_message, reply.strip() or None)
+        if not error:
+            remember_answer(book_id, rag_future, reply.strip())
+        yield format_sse({
+            "conversation_id": conversation_id,
+            "cached": False,
+            "pages": [r.get("page") for r in rag_results if r.get("page")],
+            "timestamps": rag_timestamps(rag_results),
+            "sources": sorted({r.get("source") for r in rag_results if r.get("source")}),
+            "rag_used": bool(rag_results),
+            "error": error,
+            "timings": {
+                "retrieval_ms": round(retrieval_ms, 1),
+                "prompt_ms": _elapsed_ms(prompt_ready),
+                "first_token_ms": _elapsed_ms(first_token_at),
+                "total_ms": _elapsed_ms(time.perf_counter()),
+            },
+        }, "done")
+
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
 # Add this debug route before the if __name__ == '__main__': line
 @app.route('/debug/rag-status')
 def debug_rag_status():
@@ -1262,6 +1982,126 @@ def debug_rag_status():
     
     return jsonify(rag_status)
 
+@app.route('/debug/llm-limiter')
+def debug_llm_limiter():
+    """Queue depth, in-flight calls and queue-wait metrics for the Gemini rate limiter."""
+    return jsonify(llm_limiter.metrics())
+
+@app.route('/debug/chat-cache')
+def debug_chat_cache():
+    """Hit rate and size of the semantic chat answer cache."""
+    if answer_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **answer_cache.stats()})
+
+@app.route('/debug/image-descriptions')
+def debug_image_descriptions():
+    """Description cache hits and bytes saved by downscaling."""
+    return jsonify(image_describer.stats())
+
+@app.route('/debug/artifacts')
+def debug_artifacts():
+    """Lazy artifact hits, generations, prefetches and queue length."""
+    return jsonify(dict(artifact_store.stats(), lazy=LAZY_ARTIFACTS, prefetch=ARTIFACT_PREFETCH))
+
+@app.route('/debug/question-bank')
+def debug_question_bank():
+    """Sharded MCQ generation: sections, failures and duplicates removed."""
+    return jsonify(question_bank.stats())
+
+@app.route('/debug/notifications')
+def debug_notifications():
+    """Notification fan-outs queued, completed, retried and failed."""
+    if notification_worker is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **notification_worker.stats()})
+
+def cache_metrics():
+    """Metrics collector: cache hits, limiter queues and upload budget from their stats()."""
+    caches = {
+        "render": (lambda st: (st["hits"], st["hits"] + st["misses"]), render_cache),
+        "image_descriptions": (lambda st: (st["exact_hits"] + st["perceptual_hits"], st["requests"]), image_describer),
+        "transcripts": (lambda st: (st["hits"] + st["negative_hits"], st["requests"]), transcript_cache),
+        "artifacts": (lambda st: (st["hits"], st["hits"] + st["generated"]), artifact_store),
+        "chat_answers": (lambda st: (st["hits"], st["lookups"]), answer_cache),
+    }
+    hits, lookups = [], []
+    for name, (counts, cache) in caches.items():
+        if cache is None:
+            continue
+        hit, total = counts(cache.stats())
+        hits.append(({"cache": name}, hit))
+        lookups.append(({"cache": name}, total))
+    yield "cache_hits_total", "counter", "Cache hits.", hits
+    yield "cache_lookups_total", "counter", "Cache lookups.", lookups
+
+    limiter = llm_limiter.metrics()
+    yield "llm_queue_depth", "gauge", "Gemini calls waiting for the rate limiter.", [
+        ({"bucket": name}, bucket["queue_depth"]) for name, bucket in limiter.items()]
+    yield "llm_in_flight", "gauge", "Gemini calls in flight.", [
+        ({"bucket": name}, bucket["in_flight"]) for name, bucket in limiter.items()]
+    yield "llm_queue_wait_seconds_total", "counter", "Time Gemini calls waited in the rate limiter queue.", [
+        ({"bucket": name}, bucket["wait_seconds_total"]) for name, bucket in limiter.items()]
+
+    budget = upload_budget.stats()
+    yield "upload_files_in_flight", "gauge", "Uploaded files being processed.", [({}, budget["running"])]
+    yield "upload_files_waiting", "gauge", "Uploaded files waiting for the upload budget.", [({}, budget["waiting"])]
+    yield "upload_reserved_bytes", "gauge", "Memory reserved by files in flight.", [({}, budget["reserved_bytes"])]
+
+metrics.REGISTRY.register_collector(cache_metrics)
+metrics.REGISTRY.register_ratio("cache_hit_ratio", "Cache hits / lookups, all workers since start.",
+                                "cache_hits_total", "cache_lookups_total")
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Stage latency histograms, in-flight gauges, bytes processed and cache hit ratios (Prometheus text)."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/debug/profiles')
+def debug_profiles():
+    """Stored request profiles, newest first (needs the profile token)."""
+    if not profile_authorized():
+        return jsonify({"error": "Profiling is disabled or the token is wrong"}), 403
+    return jsonify({"profiles": profile_store.list(), "continuous_hz": PROFILE_SAMPLE_HZ if continuous_sampler else 0})
+
+@app.route('/debug/profiles/continuous')
+def debug_profile_continuous():
+    """Folded stacks from continuous sampling since start (or the last ?reset=1)."""
+    if not profile_authorized():
+        return jsonify({"error": "Profiling is disabled or the token is wrong"}), 403
+    if continuous_sampler is None:
+        return jsonify({"error": "Continuous sampling is off (set PROFILE_SAMPLE_HZ)"}), 404
+    counts = continuous_sampler.snapshot(reset=request.args.get('reset') in ['1', 'true', 'True'])
+    return Response(folded(counts), mimetype='text/plain')
+
+@app.route('/debug/profiles/<profile_id>')
+def debug_profile(profile_id):
+    """One stored profile: folded stacks (text) or cProfile pstats (binary)."""
+    if not profile_authorized():
+        return jsonify({"error": "Profiling is disabled or the token is wrong"}), 403
+    path = profile_store.path(profile_id)
+    if path is None:
+        return jsonify({"error": "Profile not found"}), 404
+    folded_stacks = path.endswith('.folded')
+    return send_file(path, mimetype='text/plain' if folded_stacks else 'application/octet-stream',
+                     as_attachment=not folded_stacks, download_name=os.path.basename(path))
+
+@app.route('/debug/render-cache')
+def debug_render_cache():
+    """Download render cache hits, misses and size."""
+    return jsonify(render_cache.stats())
+
+@app.route('/debug/transcript-cache')
+def debug_transcript_cache():
+    """Transcript cache hits, negative hits and which fallback method won."""
+    return jsonify(transcript_cache.stats())
+
+@app.route('/debug/upload-budget')
+def debug_upload_budget():
+    """Files in flight, reserved memory and queueing of the upload budget."""
+    return jsonify(dict(upload_budget.stats(), extraction_processes=EXTRACTION_PROCESSES,
+                        per_request_parallel=UPLOAD_PER_REQUEST_PARALLEL))
+
 @app.route('/api/rag/books', methods=['GET'])
 def list_rag_books():
     """List all books/documents that have been processed into RAG."""
@@ -1315,39 +2155,131 @@ def rag_query():
         logger.error(f"RAG query error: {e}")
         return jsonify({"error": str(e)}), 500
 
+# Document Endpoints
+@app.route('/api/documents/<document_id>', methods=['GET'])
+def get_document(document_id):
+    """Metadata of a stored document (page count, size, page numbers)."""
+    try:
+        return jsonify(document_store.metadata(document_id))
+    except DocumentNotFound:
+        return jsonify({"error": "Document not found"}), 404
+
+@app.route('/api/documents/<document_id>/text', methods=['GET'])
+def get_document_text(document_id):
+    """
+    Page-range text of a stored document:
+    ?start_page=&end_page= (inclusive) and ?limit= pages per response (max 100).
+    `next_page` is set when more pages remain in the requested range.
+    """
+    try:
+        start_page = _page_arg(request.args.get('start_page'))
+        end_page = _page_arg(request.args.get('end_page'))
+        limit = min(max(1, request.args.get('limit', default=20, type=int)), 100)
+        rows = document_store.pages(document_id, start_page, end_page, limit=limit + 1)
+    except DocumentNotFound:
+        return jsonify({"error": "Document not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "document_id": document_id,
+        "pages": [{"page": page, "text": text} for page, text in rows[:limit]],
+        "next_page": rows[limit][0] if len(rows) > limit else None,
+    })
+
+@app.route('/api/documents/<document_id>/artifacts', methods=['GET'])
+def list_document_artifacts(document_id):
+    """Status (pending/running/ready/error) and URL of each study artifact of a document."""
+    try:
+        document_store.metadata(document_id)
+    except DocumentNotFound:
+        return jsonify({"error": "Document not found"}), 404
+    return jsonify({"document_id": document_id, "artifacts": artifact_handles(document_id)})
+
+@app.route('/api/documents/<document_id>/artifacts/<kind>', methods=['GET'])
+def get_document_artifact(document_id, kind):
+    """
+    A study artifact (short_notes, flashcards or mcqs), generated on first request.
+    ?wait=0 returns 202 with the current status instead of generating/waiting.
+    """
+    if kind not in artifact_store.generators:
+        return jsonify({"error": f"Unknown artifact '{kind}'"}), 404
+    try:
+        document_store.metadata(document_id)
+        if request.args.get('wait', '1') in ['0', 'false', 'False']:
+            data = artifact_store.peek(document_id, kind)
+            if data is None:
+                artifact_store.prefetch(document_id, [kind])
+                return jsonify({"document_id": document_id, "kind": kind,
+                                "status": artifact_store.status(document_id)[kind], "data": None}), 202
+            status = STATUS_READY
+        else:
+            status, data = artifact_store.get(document_id, kind, timeout=ARTIFACT_WAIT_SECONDS)
+            if data is None:
+                # Still generating (here or in another worker): poll with ?wait=0
+                artifact_store.prefetch(document_id, [kind])
+    except (DocumentNotFound, UnknownArtifact):
+        return jsonify({"error": "Document not found"}), 404
+    except Exception as e:
+        logger.error(f"Artifact generation failed for {document_id}/{kind}: {e}")
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"document_id": document_id, "kind": kind, "status": status, "data": data}), \
+        (202 if data is None else 200)
+
+# Blob Endpoints
+@app.route('/blobs/<digest>', methods=['GET'])
+def get_blob(digest):
+    """Serve a stored image. Supports ETag/If-None-Match and Range requests."""
+    path = blob_store.path(digest)
+    if path is None:
+        return jsonify({"error": "Blob not found"}), 404
+    response = send_file(path, mimetype=blob_store.mime_type(digest), conditional=True,
+                         etag=digest, max_age=BLOB_MAX_AGE)
+    # Content never changes for a given hash
+    response.headers['Cache-Control'] = f"public, max-age={BLOB_MAX_AGE}, immutable"
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+@app.route('/blobs/<digest>/thumbnail', methods=['GET'])
+def get_blob_thumbnail(digest):
+    """Serve a JPEG thumbnail of a stored image (?size=128|256|512, default 256)."""
+    size = request.args.get('size', default=256, type=int)
+    if size not in THUMBNAIL_SIZES:
+        return jsonify({"error": f"size must be one of {list(THUMBNAIL_SIZES)}"}), 400
+    try:
+        path = blob_store.thumbnail(digest, size)
+    except Exception as e:
+        logger.warning(f"Thumbnail failed for {digest}: {e}")
+        return jsonify({"error": "Could not render thumbnail"}), 415
+    if path is None:
+        return jsonify({"error": "Blob not found"}), 404
+    response = send_file(path, mimetype='image/jpeg', conditional=True,
+                         etag=f"{digest}-{size}", max_age=BLOB_MAX_AGE)
+    response.headers['Cache-Control'] = f"public, max-age={BLOB_MAX_AGE}, immutable"
+    return response
+
 # Session Management Endpoints
+# Sessions live in an indexed SQLite store; legacy sessions/*.json files are
+# imported on startup (idempotent) and archived as *.json.migrated.
 SESSIONS_DIR = os.path.join(os.path.dirname(__file__), 'sessions')
-os.makedirs(SESSIONS_DIR, exist_ok=True)
+session_store = SessionStore(os.path.join(DB_DIR, 'sessions.db'))
+try:
+    session_store.migrate_json_dir(SESSIONS_DIR)
+except Exception as e:
+    logger.warning(f"Legacy session migration failed: {e}")
+
+# Documents idle for DOCUMENT_MAX_AGE_DAYS are dropped with their artifacts,
+# unless a saved session still refers to them (sessions keep only the id)
+for _document_id in document_store.prune(max_age_days=float(os.getenv("DOCUMENT_MAX_AGE_DAYS", "90")),
+                                         keep=session_store.document_ids()):
+    artifact_store.invalidate(_document_id)
 
 @app.route('/api/sessions', methods=['GET'])
 def list_sessions():
-    """List all saved sessions."""
+    """List saved sessions, most recent first. Supports ?limit=&cursor= pagination."""
     try:
-        sessions = []
-        if os.path.exists(SESSIONS_DIR):
-            for filename in os.listdir(SESSIONS_DIR):
-                if filename.endswith('.json'):
-                    session_path = os.path.join(SESSIONS_DIR, filename)
-                    try:
-                        with open(session_path, 'r', encoding='utf-8') as f:
-                            session_data = json.load(f)
-                            # Get file stats
-                            stat = os.stat(session_path)
-                            sessions.append({
-                                'id': filename.replace('.json', ''),
-                                'name': session_data.get('name', 'Untitled Session'),
-                                'created_at': session_data.get('created_at', ''),
-                                'updated_at': datetime.datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                                'file_count': len(session_data.get('uploadedFiles', [])),
-                                'has_chat': len(session_data.get('chatHistory', [])) > 0
-                            })
-                    except Exception as e:
-                        logger.warning(f"Error reading session {filename}: {e}")
-                        continue
-        
-        # Sort by updated_at descending (most recent first)
-        sessions.sort(key=lambda x: x.get('updated_at', ''), reverse=True)
-        return jsonify({'sessions': sessions})
+        limit = request.args.get('limit', default=100, type=int)
+        sessions, next_cursor = session_store.list(limit=limit, cursor=request.args.get('cursor'))
+        return jsonify({'sessions': sessions, 'next_cursor': next_cursor})
     except Exception as e:
         logger.error(f"Error listing sessions: {e}")
         return jsonify({"error": str(e)}), 500
@@ -1360,22 +2292,9 @@ def save_session():
         session_name = data.get('name', f"Session {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}")
         uploaded_files = data.get('uploadedFiles', [])
         chat_history = data.get('chatHistory', [])
-        
-        # Generate session ID
-        session_id = f"session_{int(time.time())}"
-        
-        session_data = {
-            'id': session_id,
-            'name': session_name,
-            'created_at': datetime.datetime.now().isoformat(),
-            'uploadedFiles': uploaded_files,
-            'chatHistory': chat_history
-        }
-        
-        session_path = os.path.join(SESSIONS_DIR, f"{session_id}.json")
-        with open(session_path, 'w', encoding='utf-8') as f:
-            json.dump(session_data, f, indent=2, ensure_ascii=False)
-        
+
+        session_id = session_store.create(session_name, uploaded_files, chat_history)
+
         logger.info(f"Session saved: {session_id}")
         return jsonify({
             'success': True,
@@ -1388,34 +2307,87 @@ def save_session():
 
 @app.route('/api/sessions/<session_id>', methods=['GET'])
 def get_session(session_id):
-    """Get a specific session by ID."""
+    """
+    Get a specific session by ID. With ?lazy=1 the large per-file fields are
+    omitted (listed in `lazy_fields`) and fetched separately on demand.
+    """
     try:
-        session_path = os.path.join(SESSIONS_DIR, f"{session_id}.json")
-        if not os.path.exists(session_path):
-            return jsonify({"error": "Session not found"}), 404
-        
-        with open(session_path, 'r', encoding='utf-8') as f:
-            session_data = json.load(f)
-        
-        return jsonify(session_data)
+        lazy = request.args.get('lazy', '0').lower() in ('1', 'true', 'yes')
+        return json_stream(session_store.get(session_id, include_blobs=not lazy))
+    except SessionNotFound:
+        return jsonify({"error": "Session not found"}), 404
     except Exception as e:
         logger.error(f"Error loading session: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/sessions/<session_id>', methods=['PATCH'])
+def update_session(session_id):
+    """
+    Incrementally update a saved session instead of re-saving it whole.
+
+    Body (all keys optional):
+        name          - rename the session
+        append_chat   - chat messages to append
+        chatHistory   - replace the chat history
+        files         - {"<position>": {fields}} merged into that file (null
+                        deletes a field); position == file count appends a file
+        file_count    - drop files beyond this count
+    """
+    try:
+        data = request.get_json() or {}
+        files = data.get('files') or {}
+        if not isinstance(files, dict):
+            return jsonify({"error": "files must be an object keyed by position"}), 400
+        file_count = data.get('file_count')
+        if file_count is not None and (type(file_count) is not int or file_count < 0):
+            return jsonify({"error": "file_count must be a non-negative integer"}), 400
+        result = session_store.update(
+            session_id,
+            name=data.get('name'),
+            append_chat=data.get('append_chat'),
+            chat_history=data.get('chatHistory'),
+            files={int(position): fields for position, fields in files.items()},
+            file_count=file_count,
+        )
+        logger.info(f"Session updated: {session_id}")
+        return jsonify({'success': True, 'session_id': session_id, **result})
+    except SessionNotFound:
+        return jsonify({"error": "Session not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error updating session: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/sessions/<session_id>/files/<int:position>/<field>', methods=['GET'])
+def get_session_file_field(session_id, position, field):
+    """Lazily load one large field (raw_text, transcript, ...) of a session file."""
+    try:
+        return jsonify({field: session_store.get_file_field(session_id, position, field)})
+    except KeyError:
+        return jsonify({"error": f"Unknown field: {field}"}), 400
+    except SessionNotFound:
+        return jsonify({"error": "Session file not found"}), 404
+    except Exception as e:
+        logger.error(f"Error loading session field: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/sessions/<session_id>', methods=['DELETE'])
 def delete_session(session_id):
     """Delete a session."""
     try:
-        session_path = os.path.join(SESSIONS_DIR, f"{session_id}.json")
-        if not os.path.exists(session_path):
+        if not session_store.delete(session_id):
             return jsonify({"error": "Session not found"}), 404
-        
-        os.remove(session_path)
         logger.info(f"Session deleted: {session_id}")
         return jsonify({'success': True, 'message': 'Session deleted successfully'})
     except Exception as e:
         logger.error(f"Error deleting session: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/debug/session-store')
+def debug_session_store():
+    """Session count and blob dedup/compression totals."""
+    return jsonify(session_store.stats())
+
 if __name__ == '__main__':
     app.run(host="127.0.0.1", port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,281 @@
+"""
+Ingestion and retrieval benchmark on synthetic PDFs of 10 to 2000 pages.
+
+For each corpus size it measures extract_text_from_pdf, RAGProcessor's
+load_document_parallel and chunk_documents_parallel, embedding throughput,
+process_document end to end (load, chunk, embed, Chroma writes) and
+query_book p50/p99, and records pages/sec, chunks/sec and peak RSS. Each
+size runs in a fresh process, so peak RSS is that size's own.
+
+The PDFs are generated with reportlab (one topic per page, so retrieval has
+something to find) and cached in --corpus-dir. Everything runs offline:
+Hugging Face downloads are disabled, and --embeddings stub swaps MiniLM for
+a hashed bag-of-words embedding on machines without the model cached (stub
+numbers measure the pipeline, not the model). Without the RAG packages only
+extraction is measured.
+
+    cd Backend
+    python -m benchmarks.bench_ingestion [--pages 10,100,500,2000] [--embeddings minilm|stub]
+                                         [--queries 50] [--output results.json] [--baseline old.json]
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TOPICS = (
+    "photosynthesis respiration mitochondria ribosome osmosis diffusion enzyme catalysis "
+    "chromosome mutation transcription translation membrane glycolysis homeostasis "
+    "neuron synapse hormone antibody vaccine ecosystem biome nitrogen carbon evolution"
+).split()
+FACTS = ("role", "location", "products", "inputs", "regulation", "history", "energy", "structure")
+LINES_PER_PAGE = 40
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def make_pdf(path: str, pages: int, seed: int = 7):
+    """`pages` pages of LINES_PER_PAGE sentences, each page about one topic."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    rng = random.Random(seed)
+    pdf = canvas.Canvas(path, pagesize=A4)
+    for page in range(pages):
+        topic = TOPICS[page % len(TOPICS)]
+        text = pdf.beginText(40, 800)
+        text.setFont("Helvetica", 9)
+        text.textLine(f"Chapter {page + 1}: {topic}")
+        for _ in range(LINES_PER_PAGE):
+            text.textLine(f"The {rng.choice(FACTS)} of {topic} relates to {rng.choice(TOPICS)} "
+                          f"and {rng.choice(TOPICS)} in step {rng.randint(1, 99)} of the process.")
+        pdf.drawText(text)
+        pdf.showPage()
+    pdf.save()
+
+
+def corpus_pdf(corpus_dir: str, pages: int) -> str:
+    os.makedirs(corpus_dir, exist_ok=True)
+    path = os.path.join(corpus_dir, f"synthetic_{pages}p.pdf")
+    if not os.path.exists(path):
+        make_pdf(path, pages)
+    return path
+
+
+class StubEmbeddings:
+    """Hashed bag-of-words vectors (384-d, normalized): no model, no network."""
+
+    def __init__(self, dimensions: int = 384):
+        self.dimensions = dimensions
+
+    def _embed(self, text: str):
+        vector = [0.0] * self.dimensions
+        for word in text.lower().split():
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest()
+            vector[int.from_bytes(digest, "little") % self.dimensions] += 1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def _throughput(seconds, count):
+    return round(count / seconds, 1) if seconds else None
+
+
+def run_size(pdf_path: str, pages: int, embeddings: str, queries: int, work_dir: str):
+    """All measurements for one corpus size (run in its own process)."""
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+    from services import metrics
+    from services.extraction import extract_text_from_pdf
+    metrics.show_progress_bars(False)
+
+    results = {"pages": pages, "pdf_bytes": os.path.getsize(pdf_path)}
+    started = time.perf_counter()
+    text = extract_text_from_pdf(pdf_path, max_pages=pages)
+    seconds = time.perf_counter() - started
+    results["extract_text"] = {"seconds": round(seconds, 3), "pages_per_sec": _throughput(seconds, pages),
+                               "chars": len(text or "")}
+
+    try:
+        from rag_processor import RAGProcessor
+    except ImportError as e:
+        results["skipped"] = f"RAG packages not installed: {e}"
+        results["peak_rss_mb"] = _peak_rss_mb()
+        return results
+
+    persist_dir = os.path.join(work_dir, f"vector_store_{pages}")
+    shutil.rmtree(persist_dir, ignore_errors=True)
+    rag = RAGProcessor(persist_directory=persist_dir,
+                       embeddings=StubEmbeddings() if embeddings == "stub" else None)
+
+    started = time.perf_counter()
+    documents = rag.load_document_parallel(pdf_path, max_pages=pages)
+    seconds = time.perf_counter() - started
+    results["load_document"] = {"seconds": round(seconds, 3), "pages_per_sec": _throughput(seconds, pages)}
+
+    started = time.perf_counter()
+    chunks = rag.chunk_documents_parallel(documents)
+    seconds = time.perf_counter() - started
+    results["chunk"] = {"seconds": round(seconds, 3), "chunks": len(chunks),
+                        "chunks_per_sec": _throughput(seconds, len(chunks))}
+
+    texts = [chunk.page_content for chunk in chunks]
+    started = time.perf_counter()
+    for i in range(0, len(texts), 100):  # store_chunks' batch size
+        rag.embeddings.embed_documents(texts[i:i + 100])
+    seconds = time.perf_counter() - started
+    results["embed"] = {"seconds": round(seconds, 3), "chunks_per_sec": _throughput(seconds, len(texts)),
+                        "chars_per_sec": _throughput(seconds, sum(len(t) for t in texts))}
+
+    book_id = f"bench_{pages}"
+    started = time.perf_counter()
+    stored = rag.process_document(pdf_path, book_id, metadata={"filename": os.path.basename(pdf_path)},
+                                  max_pages=pages)
+    seconds = time.perf_counter() - started
+    results["process_document"] = {"seconds": round(seconds, 3), "chunks": stored,
+                                   "pages_per_sec": _throughput(seconds, pages),
+                                   "chunks_per_sec": _throughput(seconds, stored)}
+
+    rng = random.Random(13)
+    latencies, misses = [], 0
+    for _ in range(queries):
+        topic = rng.choice(TOPICS[:min(len(TOPICS), pages)])
+        question = f"What is the {rng.choice(FACTS)} of {topic}?"
+        started = time.perf_counter()
+        hits = rag.query_book(book_id, question, k=3).get("results", [])
+        latencies.append((time.perf_counter() - started) * 1000)
+        misses += 0 if any(topic in hit["content"] for hit in hits) else 1
+    if latencies:
+        results["query_book"] = {"p50_ms": round(statistics.median(latencies), 2),
+                                 "p99_ms": round(_percentile(latencies, 99), 2),
+                                 "queries": queries, "topic_misses": misses}
+
+    shutil.rmtree(persist_dir, ignore_errors=True)
+    results["peak_rss_mb"] = _peak_rss_mb()
+    return results
+
+
+def run(sizes, embeddings, queries, corpus_dir):
+    results = {
+        "benchmark": "ingestion",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "embeddings": embeddings,
+        "sizes": [],
+    }
+    work_dir = tempfile.mkdtemp(prefix="notelooms_bench_")
+    try:
+        for pages in sizes:
+            pdf_path = corpus_pdf(corpus_dir, pages)
+            # A fresh process per size: peak RSS and caches do not carry over
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                results["sizes"].append(pool.submit(run_size, pdf_path, pages, embeddings, queries, work_dir).result())
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+# (stage, metric, higher is better) pairs compared against --baseline
+COMPARED = [
+    ("extract_text", "pages_per_sec", True), ("load_document", "pages_per_sec", True),
+    ("chunk", "chunks_per_sec", True), ("embed", "chunks_per_sec", True),
+    ("process_document", "pages_per_sec", True), ("query_book", "p50_ms", False),
+    ("query_book", "p99_ms", False),
+]
+
+
+def compare(results, baseline):
+    """Lines of percent changes against an earlier results file (positive = better)."""
+    before = {size["pages"]: size for size in baseline.get("sizes", [])}
+    lines = []
+    for size in results["sizes"]:
+        old = before.get(size["pages"])
+        if old is None:
+            continue
+        for stage, metric, higher_is_better in COMPARED:
+            new_value = (size.get(stage) or {}).get(metric)
+            old_value = (old.get(stage) or {}).get(metric)
+            if not new_value or not old_value:
+                continue
+            change = (new_value - old_value) / old_value * 100 * (1 if higher_is_better else -1)
+            lines.append(f"  {size['pages']:>5} pages  {stage + '.' + metric:30} {old_value:>10} -> "
+                         f"{new_value:>10}  {change:+.1f}%")
+        if size.get("peak_rss_mb") and old.get("peak_rss_mb"):
+            lines.append(f"  {size['pages']:>5} pages  {'peak_rss_mb':30} {old['peak_rss_mb']:>10} -> "
+                         f"{size['peak_rss_mb']:>10}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", default="10,100,500,2000", help="comma-separated corpus sizes")
+    parser.add_argument("--embeddings", choices=["minilm", "stub"], default="minilm",
+                        help="stub = hashed bag-of-words, for machines without the model cached")
+    parser.add_argument("--queries", type=int, default=50, help="query_book calls per corpus")
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "notelooms_bench_corpus"))
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="earlier --output file to compare against")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    sizes = [int(p) for p in args.pages.split(",") if p.strip()]
+    results = run(sizes, args.embeddings, args.queries, args.corpus_dir)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"Ingestion on {results['cpu_count']} CPUs, {args.embeddings} embeddings")
+    print(f"{'pages':>6} {'extract p/s':>12} {'load p/s':>9} {'chunk c/s':>10} {'embed c/s':>10} "
+          f"{'e2e p/s':>8} {'query p50':>10} {'p99 ms':>8} {'RSS MB':>7}")
+    for size in results["sizes"]:
+        def value(stage, metric):
+            return (size.get(stage) or {}).get(metric, "-")
+        print(f"{size['pages']:>6} {value('extract_text', 'pages_per_sec'):>12} "
+              f"{value('load_document', 'pages_per_sec'):>9} {value('chunk', 'chunks_per_sec'):>10} "
+              f"{value('embed', 'chunks_per_sec'):>10} {value('process_document', 'pages_per_sec'):>8} "
+              f"{value('query_book', 'p50_ms'):>10} {value('query_book', 'p99_ms'):>8} {size['peak_rss_mb']:>7}")
+        if "skipped" in size:
+            print(f"       {size['skipped']}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            lines = compare(results, json.load(f))
+        print("Against baseline (positive = better):")
+        print("\n".join(lines) or "  no sizes in common")
+
+
+if __name__ == "__main__":
+    main()
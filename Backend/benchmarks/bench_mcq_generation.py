@@ -0,0 +1,143 @@
+"""
+Single-call versus sharded MCQ generation against a simulated model.
+
+The simulated model's latency grows with the number of questions requested
+(output tokens dominate generation time) plus a random tail, and it tends to
+repeat itself within a reply. Reports p50/p99 latency, how much of the
+document the questions cover, and duplicates in the final pool.
+
+    cd Backend
+    python -m benchmarks.bench_mcq_generation [--pages 40] [--questions 40] [--runs 20] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.question_bank import ShardedQuestionGenerator, jaccard  # noqa: E402
+from services.prompt_packer import terms  # noqa: E402
+
+TOPICS = (
+    "photosynthesis respiration mitochondria ribosome osmosis diffusion enzyme catalysis "
+    "chromosome mutation transcription translation membrane glycolysis homeostasis "
+    "neuron synapse hormone antibody vaccine ecosystem biome nitrogen carbon evolution"
+).split()
+
+
+FACTS = ("role", "location", "products", "inputs", "regulation", "history")
+
+
+def make_document(pages: int, seed: int = 3) -> str:
+    """A document whose pages each cover one topic, so coverage is measurable."""
+    rng = random.Random(seed)
+    return "\n\n".join(
+        f"--- Page {p} ---\n" + " ".join(
+            f"The {TOPICS[p % len(TOPICS)]} process has a {rng.choice(FACTS)} worth remembering."
+            for _ in range(30)
+        )
+        for p in range(pages)
+    )
+
+
+class SimulatedModel:
+    """
+    generate(text, n): latency proportional to n with a heavy-tailed factor.
+    Questions only cover topics in the first 8000 characters, and a topic
+    only has a few distinct questions, so long replies repeat themselves.
+    """
+
+    def __init__(self, seconds_per_question: float, seed: int = 11):
+        self.seconds_per_question = seconds_per_question
+        self.rng = random.Random(seed)
+
+    def generate(self, text: str, n: int):
+        topics = [t for t in TOPICS if t in text[:8000]] or ["general"]
+        time.sleep(n * self.seconds_per_question * (1 + self.rng.expovariate(4)))
+        questions = []
+        for i in range(n):
+            topic = self.rng.choice(topics)
+            fact = self.rng.choice(FACTS)
+            stem = "Which statement about the {} of {} is correct?" if self.rng.random() < 0.5 \
+                else "What is true of the {} of {}?"
+            questions.append({
+                "question": stem.format(fact, topic),
+                "options": ["A", "B", "C", "D"],
+                "answer": "A",
+                "topic": topic,
+            })
+        return questions
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _quality(questions, document_topics):
+    covered = {q["topic"] for q in questions if "topic" in q}
+    word_sets = [terms(q["question"]) for q in questions]
+    duplicates = sum(
+        1 for i, a in enumerate(word_sets) if any(jaccard(a, b) >= 0.6 for b in word_sets[:i])
+    )
+    return len(covered & document_topics) / len(document_topics), duplicates
+
+
+def run(pages: int, num_questions: int, runs: int, seconds_per_question: float):
+    document = make_document(pages)
+    document_topics = {t for t in TOPICS if t in document}
+    model = SimulatedModel(seconds_per_question)
+    sharded = ShardedQuestionGenerator(model.generate, max_sections=6, section_chars=3000, max_workers=6)
+
+    results = {}
+    for name, generate in (
+        ("single_call", lambda: model.generate(document[:8000], num_questions)),
+        ("sharded", lambda: sharded.generate(document, num_questions)),
+    ):
+        latencies, coverage, duplicates, sizes = [], [], [], []
+        for _ in range(runs):
+            started = time.perf_counter()
+            questions = generate()
+            latencies.append(time.perf_counter() - started)
+            cov, dup = _quality(questions, document_topics)
+            coverage.append(cov)
+            duplicates.append(dup)
+            sizes.append(len(questions))
+        results[name] = {
+            "p50_seconds": round(statistics.median(latencies), 3),
+            "p99_seconds": round(_percentile(latencies, 99), 3),
+            "topic_coverage": round(statistics.mean(coverage), 3),
+            "near_duplicates": round(statistics.mean(duplicates), 1),
+            "questions": round(statistics.mean(sizes), 1),
+        }
+    results["sharded"]["stats"] = sharded.stats()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--questions", type=int, default=40)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--seconds-per-question", type=float, default=0.04)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    results = run(args.pages, args.questions, args.runs, args.seconds_per_question)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.questions} MCQs from a {args.pages}-page document, {args.runs} runs")
+    print(f"{'':12} {'p50 s':>8} {'p99 s':>8} {'coverage':>9} {'dupes':>6} {'count':>6}")
+    for name in ("single_call", "sharded"):
+        r = results[name]
+        print(f"{name:12} {r['p50_seconds']:>8} {r['p99_seconds']:>8} {r['topic_coverage']:>9} "
+              f"{r['near_duplicates']:>6} {r['questions']:>6}")
+
+
+if __name__ == "__main__":
+    main()
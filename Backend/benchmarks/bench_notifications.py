@@ -0,0 +1,144 @@
+"""
+Notification fan-out benchmark: the old per-user insert_one loop against the
+aggregation + chunked insert_many fan-out, and how long the caller blocks.
+
+Runs against a real mongod when MONGO_URI is set (use a scratch database;
+it is dropped first), otherwise against in-memory mongomock. mongomock's
+$lookup and unique-index checks are quadratic, so there it is a functional
+smoke run only (default 1000 users); measure with a real mongod.
+
+    cd Backend
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.bench_notifications --users 100000
+    python -m benchmarks.bench_notifications                     # mongomock
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import notification_service, quiz_service  # noqa: E402
+
+TOPIC = "cell_biology"
+
+
+def connect():
+    uri = os.getenv("MONGO_URI")
+    if uri:
+        from pymongo import MongoClient
+        return MongoClient(uri)["notelooms_bench"], "mongod"
+    import mongomock
+    return mongomock.MongoClient()["notelooms_bench"], "mongomock"
+
+
+def populate(db, users, questions_per_topic, seed=9):
+    """Every user has answered a question of TOPIC and up to two more of any topic."""
+    rng = random.Random(seed)
+    for name in ("questions", "user_history", "notifications"):
+        db[name].drop()
+    topics = [TOPIC] + [f"topic_{i}" for i in range(9)]
+    question_ids = {
+        topic: db.questions.insert_many([
+            {"topic": topic, "difficulty": "easy", "question": f"{topic} {i}?", "options": ["a", "b"],
+             "correct_answer": "a"}
+            for i in range(questions_per_topic)
+        ]).inserted_ids
+        for topic in topics
+    }
+    batch = []
+    for user in range(users):
+        answered = [TOPIC] + [rng.choice(topics) for _ in range(rng.randint(0, 2))]
+        for topic in answered:
+            batch.append({"user_id": f"user_{user}", "question_id": rng.choice(question_ids[topic]),
+                          "is_correct": rng.random() < 0.6})
+        if len(batch) >= 10000:
+            db.user_history.insert_many(batch)
+            batch = []
+    if batch:
+        db.user_history.insert_many(batch)
+
+
+def old_notify_users(db, topic):
+    """The previous implementation: nested distinct, one insert_one per user."""
+    db.notifications.insert_one({
+        "message": f"New question(s) have been added under {topic}. Come and try them now!",
+        "topic": topic, "created_at": datetime.datetime.utcnow(),
+    })
+    user_ids = db.user_history.distinct(
+        "user_id", {"question_id": {"$in": db.questions.distinct("_id", {"topic": topic})}}
+    )
+    for user_id in user_ids:
+        if user_id != 'guest':
+            db.notifications.insert_one({
+                "user_id": user_id, "message": f"Hey, new content related to {topic} is live — give it a try!",
+                "topic": topic, "created_at": datetime.datetime.utcnow(),
+            })
+    return len(user_ids)
+
+
+def run(users, questions_per_topic, chunk_size):
+    db, backend = connect()
+    started = time.perf_counter()
+    populate(db, users, questions_per_topic)
+    results = {"backend": backend, "users": users, "load_seconds": round(time.perf_counter() - started, 1)}
+
+    started = time.perf_counter()
+    notified = old_notify_users(db, TOPIC)
+    results["old_per_user_inserts"] = {"seconds": round(time.perf_counter() - started, 2), "notified": notified}
+
+    db.notifications.drop()
+    quiz_service.ensure_indexes(db)
+    notification_service.ensure_indexes(db)
+    started = time.perf_counter()
+    notified = notification_service.notify_users(db, TOPIC, chunk_size=chunk_size)
+    results["aggregation_chunked_inserts"] = {"seconds": round(time.perf_counter() - started, 2),
+                                              "notified": notified}
+
+    db.notifications.drop()
+    notification_service.ensure_indexes(db)
+    worker = notification_service.NotificationWorker(db, chunk_size=chunk_size)
+    started = time.perf_counter()
+    worker.submit(TOPIC)
+    blocked = time.perf_counter() - started
+    worker.join()
+    results["background_worker"] = {
+        "caller_blocked_ms": round(blocked * 1000, 3),
+        "seconds": round(time.perf_counter() - started, 2),
+        "notified": worker.stats()["notifications"],
+    }
+    if backend == "mongod":
+        explain = db.command("aggregate", "questions", pipeline=notification_service.topic_user_ids_pipeline(TOPIC),
+                             explain=True)
+        results["plan"] = json.dumps(explain, default=str)[:400]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=None,
+                        help="users to load (default 100000 on mongod, 1000 on mongomock)")
+    parser.add_argument("--questions-per-topic", type=int, default=200)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    users = args.users or (100000 if os.getenv("MONGO_URI") else 1000)
+    results = run(users, args.questions_per_topic, args.chunk_size)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{results['users']} users on {results['backend']} (loaded in {results['load_seconds']}s)")
+    for name in ("old_per_user_inserts", "aggregation_chunked_inserts", "background_worker"):
+        r = results[name]
+        extra = f", caller blocked {r['caller_blocked_ms']} ms" if "caller_blocked_ms" in r else ""
+        print(f"  {name:28} {r['seconds']:>8} s  {r['notified']} notified{extra}")
+    if "plan" in results:
+        print(f"  plan: {results['plan']}")
+
+
+if __name__ == "__main__":
+    main()
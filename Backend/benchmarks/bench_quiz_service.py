@@ -0,0 +1,182 @@
+"""
+Question bank benchmark: the old find().limit(10) and per-answer submission
+against the indexed, projected quiz_service queries and batched submission.
+
+Runs against a real mongod when MONGO_URI is set (use a scratch database;
+it is dropped first), otherwise against in-memory mongomock. mongomock has
+no indexes and scans in Python, so use it for payload sizes and a smoke
+run, and a real mongod for latency (e.g. --questions 1000000).
+
+    cd Backend
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.bench_quiz_service --questions 1000000
+    python -m benchmarks.bench_quiz_service --questions 20000     # mongomock
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import bson
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import quiz_service  # noqa: E402
+
+TOPICS = [f"topic_{i}" for i in range(50)]
+DIFFICULTIES = ["easy", "medium", "hard"]
+WORDS = "cell energy enzyme membrane protein gradient nucleus osmosis reaction ribosome".split()
+
+
+def _text(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+def connect():
+    uri = os.getenv("MONGO_URI")
+    if uri:
+        from pymongo import MongoClient
+        return MongoClient(uri)["notelooms_bench"], "mongod"
+    import mongomock
+    return mongomock.MongoClient()["notelooms_bench"], "mongomock"
+
+
+def populate(db, questions, attempted, seed=5):
+    rng = random.Random(seed)
+    db.questions.drop()
+    db.user_history.drop()
+    batch = []
+    for i in range(questions):
+        options = [_text(rng, 6) for _ in range(4)]
+        batch.append({
+            "topic": TOPICS[i % len(TOPICS)],
+            "difficulty": DIFFICULTIES[(i // len(TOPICS)) % len(DIFFICULTIES)],
+            "question": _text(rng, 25) + "?",
+            "options": options,
+            "correct_answer": options[0],
+            "explanation": _text(rng, 80),
+            "source": {"document": _text(rng, 3), "page": rng.randint(1, 300)},
+        })
+        if len(batch) == 10000:
+            db.questions.insert_many(batch)
+            batch = []
+    if batch:
+        db.questions.insert_many(batch)
+
+    # One user who has already answered `attempted` questions of the benchmarked topic
+    ids = [q["_id"] for q in db.questions.find({"topic": TOPICS[0], "difficulty": "easy"}, {"_id": 1})]
+    db.user_history.insert_many([
+        {"user_id": "bench_user", "question_id": qid, "selected_option": "x", "is_correct": False}
+        for qid in ids[:attempted]
+    ] or [{"user_id": "other", "question_id": None}])
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def measure(fn, runs):
+    latencies, sizes = [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        docs = fn()
+        latencies.append((time.perf_counter() - started) * 1000)
+        sizes.append(sum(len(bson.encode(d if isinstance(d["_id"], str) else dict(d, _id=str(d["_id"]))))
+                         for d in docs))
+    return {
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p99_ms": round(_percentile(latencies, 99), 2),
+        "bytes_per_response": int(statistics.mean(sizes)),
+    }
+
+
+def run(questions, attempted, runs, deep_page):
+    db, backend = connect()
+    started = time.perf_counter()
+    populate(db, questions, attempted)
+    load_seconds = time.perf_counter() - started
+    quiz_service.ensure_indexes(db)
+    topic, difficulty = TOPICS[0], "easy"
+    # Stay within the benchmarked topic's pages on small loads
+    deep_page = max(1, min(deep_page, db.questions.count_documents({"topic": topic, "difficulty": difficulty}) // 10 - 1))
+
+    def cursor_at(page):
+        cursor = None
+        for _ in range(page):
+            _, cursor = quiz_service.list_questions(db, topic, difficulty, limit=10, cursor=cursor)
+        return cursor
+
+    deep_cursor = cursor_at(deep_page)
+    attempted_ids = {str(h["question_id"]) for h in db.user_history.find({"user_id": "bench_user"})}
+    sampled = quiz_service.sample_questions(db, topic, difficulty, "bench_user", size=10)
+
+    results = {
+        "backend": backend,
+        "questions": questions,
+        "load_seconds": round(load_seconds, 1),
+        "old_find_limit_10": measure(
+            lambda: list(db.questions.find({"topic": topic, "difficulty": difficulty}).limit(10)), runs),
+        "sample_10_excluding_attempted": measure(
+            lambda: quiz_service.sample_questions(db, topic, difficulty, "bench_user", size=10), runs),
+        f"skip_page_{deep_page}": measure(
+            lambda: list(db.questions.find({"topic": topic, "difficulty": difficulty})
+                         .sort("_id", 1).skip(deep_page * 10).limit(10)), runs),
+        f"cursor_page_{deep_page}": measure(
+            lambda: quiz_service.list_questions(db, topic, difficulty, limit=10, cursor=deep_cursor)[0], runs),
+        "sampled_already_attempted": sum(1 for q in sampled if q["_id"] in attempted_ids),
+    }
+
+    # Submitting a 30-question quiz: one find_one + insert_one per answer vs one batch
+    quiz = [{"question_id": q["_id"], "selected_option": "x"}
+            for q in quiz_service.list_questions(db, topic, difficulty, limit=30)[0]]
+
+    def per_answer():
+        for answer in quiz:
+            question = db.questions.find_one({"_id": bson.ObjectId(answer["question_id"])})
+            db.user_history.insert_one({"user_id": "submit_user", "question_id": question["_id"],
+                                        "selected_option": answer["selected_option"],
+                                        "is_correct": answer["selected_option"] == question["correct_answer"]})
+        return []
+
+    def batch():
+        quiz_service.submit_attempt(db, "submit_user", quiz)
+        return []
+
+    results["submit_30_per_answer"] = measure(per_answer, runs)
+    results["submit_30_batch"] = measure(batch, runs)
+    if backend == "mongod":
+        plan = db.questions.find({"topic": topic, "difficulty": difficulty}).sort("_id", 1).limit(10).explain()
+        results["list_plan"] = json.dumps(plan.get("queryPlanner", {}).get("winningPlan", {}), default=str)[:300]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--questions", type=int, default=None,
+                        help="questions to load (default 1000000 on mongod, 20000 on mongomock)")
+    parser.add_argument("--attempted", type=int, default=50, help="questions the benchmark user already answered")
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--deep-page", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+    questions = args.questions or (1000000 if os.getenv("MONGO_URI") else 20000)
+
+    results = run(questions, args.attempted, args.runs, args.deep_page)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{results['questions']} questions on {results['backend']} (loaded in {results['load_seconds']}s)")
+    for name, value in results.items():
+        if isinstance(value, dict):
+            print(f"  {name:34} p50 {value['p50_ms']:>8} ms  p99 {value['p99_ms']:>8} ms  "
+                  f"{value['bytes_per_response']:>7} bytes")
+    print(f"  already-attempted questions in a sample: {results['sampled_already_attempted']}")
+    if "list_plan" in results:
+        print(f"  list plan: {results['list_plan']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Serialization and compression benchmark for representative /upload payloads.
+
+Compares stdlib json (Flask's default provider) with orjson, and bytes on the
+wire for identity / gzip / brotli encodings, plus the peak memory of a fully
+buffered response versus the streamed one.
+
+    cd Backend
+    python -m benchmarks.bench_serialization [--pages 100] [--repeat 20] [--json]
+"""
+import argparse
+import base64
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.http_layer import _encode_stream, _json_chunks, brotli, orjson  # noqa: E402
+
+WORDS = (
+    "cell membrane protein energy mitochondria photosynthesis enzyme reaction "
+    "substrate gradient diffusion osmosis nucleus chromosome replication "
+    "transcription translation ribosome lipid carbohydrate glucose"
+).split()
+
+
+def _sentence(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+
+def make_payloads(pages: int, seed: int = 7):
+    """A PDF upload, a YouTube upload and an image upload, shaped like App.py's responses."""
+    rng = random.Random(seed)
+    raw_text = "\n\n".join(
+        f"--- Page {p} ---\n" + " ".join(_sentence(rng, 14) for _ in range(25)) for p in range(1, pages + 1)
+    )
+    mcqs = [
+        {
+            "question": _sentence(rng, 12),
+            "options": [_sentence(rng, 4) for _ in range(4)],
+            "answer": _sentence(rng, 4),
+        }
+        for _ in range(40)
+    ]
+    flashcards = [{"question": _sentence(rng, 10), "answer": _sentence(rng, 20)} for _ in range(20)]
+    pdf = [{
+        "type": "pdf", "filename": "lecture.pdf", "summary": " ".join(_sentence(rng, 16) for _ in range(12)),
+        "short_notes": "\n".join("- " + _sentence(rng, 12) for _ in range(30)),
+        "flashcards": flashcards, "mcqs": mcqs, "raw_text": raw_text, "is_image": False,
+    }]
+    transcript = [
+        {"text": _sentence(rng, 9), "start": round(i * 4.2, 2), "duration": 4.2}
+        for i in range(pages * 20)
+    ]
+    youtube = [dict(pdf[0], type="youtube", filename="https://youtu.be/x",
+                    raw_text=" ".join(t["text"] for t in transcript), transcript=transcript)]
+    image_bytes = bytes(rng.getrandbits(8) for _ in range(300_000))  # Incompressible, like a JPEG
+    image = [{
+        "type": "image", "filename": "diagram.jpg", "image_description": _sentence(rng, 80),
+        "base64_image": "data:image/jpeg;base64," + base64.b64encode(image_bytes).decode("ascii"),
+        "is_image": True,
+    }]
+    return {"pdf": pdf, "youtube": youtube, "image_base64": image}
+
+
+def _time(fn, repeat: int):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), result
+
+
+def _peak_kib(fn) -> float:
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024
+
+
+def bench(payload, repeat: int):
+    results = {}
+    stdlib_ms, body = _time(lambda: json.dumps(payload).encode("utf-8"), repeat)
+    results["stdlib_json_ms"] = round(stdlib_ms, 2)
+    if orjson is not None:
+        orjson_ms, body = _time(lambda: orjson.dumps(payload), repeat)
+        results["orjson_ms"] = round(orjson_ms, 2)
+    results["identity_bytes"] = len(body)
+
+    gzip_ms, gz = _time(lambda: gzip.compress(body, compresslevel=6), repeat)
+    results["gzip_ms"] = round(gzip_ms, 2)
+    results["gzip_bytes"] = len(gz)
+    if brotli is not None:
+        br_ms, br = _time(lambda: brotli.compress(body, quality=5), repeat)
+        results["brotli_ms"] = round(br_ms, 2)
+        results["brotli_bytes"] = len(br)
+
+    def buffered():
+        gzip.compress((orjson.dumps(payload) if orjson else json.dumps(payload).encode()), compresslevel=6)
+
+    def streamed():
+        for _ in _encode_stream(_json_chunks(payload), "gzip"):
+            pass
+
+    results["buffered_gzip_peak_kib"] = round(_peak_kib(buffered))
+    results["streamed_gzip_peak_kib"] = round(_peak_kib(streamed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=100, help="pages of extracted text in the PDF payload")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print machine-readable JSON")
+    args = parser.parse_args()
+
+    report = {name: bench(payload, args.repeat) for name, payload in make_payloads(args.pages).items()}
+    report["_env"] = {"orjson": orjson is not None, "brotli": brotli is not None, "pages": args.pages}
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for name, results in report.items():
+        if name.startswith("_"):
+            continue
+        print(f"\n{name}")
+        for key, value in results.items():
+            print(f"  {key:<24} {value}")
+    print(f"\n{report['_env']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,17 @@
 import os
 import time
 import random
+import hashlib
 from typing import List, Dict, Any, Optional, Generator, Union
 from pathlib import Path
 from contextlib import contextmanager
 import logging
 import concurrent.futures
-from tqdm import tqdm
 import multiprocessing
 from functools import partial
 
+from services import metrics
+
 # LangChain imports - updated for newer versions
 try:
     # Try new langchain-community imports first (for langchain >= 0.1.0)
@@ -38,8 +40,10 @@ try:
     
     try:
         from langchain_core.documents import Document
+        from langchain_core.embeddings import Embeddings
     except ImportError:
         from langchain.schema import Document
+        from langchain.embeddings.base import Embeddings
 except ImportError as e:
     raise ImportError(
         "Required LangChain packages not found. Install with: "
@@ -49,6 +53,28 @@ except ImportError as e:
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class TimedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings object so every embedding call is timed ("embed" and
+    "embed_query" in /metrics), including the ones Chroma makes itself.
+    """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with metrics.timed("embed", nbytes=sum(len(text.encode("utf-8")) for text in texts)):
+            vectors = self.embeddings.embed_documents(texts)
+        metrics.add_items("embed", len(texts))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        with metrics.timed("embed_query", nbytes=len(text.encode("utf-8"))):
+            return self.embeddings.embed_query(text)
+
+    def __getattr__(self, name):
+        return getattr(self.embeddings, name)
+
 def get_removal_delay(filepath: Union[str, Path]) -> float:
     """Calculate delay based on file size. Larger files get longer delays."""
     try:
@@ -136,10 +162,14 @@ class RAGProcessor:
     Uses parallel processing, batch embeddings, and optimized chunking.
     """
     
-    def __init__(self, persist_directory: Optional[str] = None):
-        """Initialize with optimized settings for speed."""
+    def __init__(self, persist_directory: Optional[str] = None, embeddings=None):
+        """
+        Initialize with optimized settings for speed. `embeddings` replaces
+        the MiniLM model with any LangChain-compatible embeddings object
+        (embed_documents/embed_query), e.g. a stub for offline benchmarks.
+        """
         # Use the fastest small model
-        self.embeddings = HuggingFaceEmbeddings(
+        self.embeddings = TimedEmbeddings(embeddings or HuggingFaceEmbeddings(
             model_name="sentence-transformers/all-MiniLM-L6-v2",  # Fastest small model
             model_kwargs={'device': 'cpu'},
             encode_kwargs={
@@ -147,7 +177,7 @@ class RAGProcessor:
                 'batch_size': 128,  # Reduced batch size for stability
                 'show_progress_bar': False  # Reduce overhead
             }
-        )
+        ))
         self.persist_directory = persist_directory or "vector_store"
         os.makedirs(self.persist_directory, exist_ok=True)
         
@@ -176,11 +206,13 @@ class RAGProcessor:
             # Fallback
             return PyPDFLoader(file_path)
     
+    @metrics.timed("load_document")
     def load_document_parallel(self, file_path: Union[str, Path], max_pages: int = 500) -> List[Document]:
         """Load document using parallel processing for PDFs with page limits."""
         file_path = Path(file_path)
         if not file_path.exists():
             raise FileNotFoundError(f"File not found: {file_path}")
+        metrics.add_bytes("load_document", file_path.stat().st_size)
 
         def load_pdf_page(doc_path: Path, page_num: int) -> Optional[Document]:
             """Helper function to load a single PDF page with proper resource management."""
@@ -222,8 +254,9 @@ class RAGProcessor:
                     ]
                     
                     # Process results as they complete
-                    for future in tqdm(
+                    for future in metrics.progress(
                         concurrent.futures.as_completed(futures),
+                        stage="load_document",
                         total=total_pages,
                         desc="Loading pages",
                         unit="page"
@@ -258,12 +291,14 @@ class RAGProcessor:
             if 'temp_' in str(file_path):
                 safe_remove(file_path)
     
+    @metrics.timed("chunk")
     def chunk_documents_parallel(self, documents: List[Document]) -> List[Document]:
         """Split documents into chunks using parallel processing."""
         if not documents:
             return []
             
         logger.info(f"Chunking {len(documents)} documents...")
+        metrics.add_bytes("chunk", sum(len(doc.page_content or "") for doc in documents))
         
         # Split into batches for parallel processing
         batch_size = max(5, len(documents) // self.num_workers)
@@ -276,15 +311,17 @@ class RAGProcessor:
         chunks = []
         with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.num_workers, 4)) as executor:
             futures = [executor.submit(process_batch, batch) for batch in batches if batch]
-            for future in tqdm(concurrent.futures.as_completed(futures), 
-                             total=len(futures), 
-                             desc="Chunking documents"):
+            for future in metrics.progress(concurrent.futures.as_completed(futures),
+                                           stage="chunk_batch",
+                                           total=len(futures),
+                                           desc="Chunking documents"):
                 try:
                     batch_chunks = future.result()
                     chunks.extend(batch_chunks)
                 except Exception as e:
                     logger.error(f"Error chunking batch: {e}")
         
+        metrics.add_items("chunk", len(chunks))
         logger.info(f"Created {len(chunks)} chunks")
         return chunks
     
@@ -314,15 +351,32 @@ class RAGProcessor:
                 chunk.metadata['book_id'] = book_id
             
             # Step 4: Create embeddings and store (batched for speed)
-            logger.info("Generating embeddings and storing in vector database...")
+            self.store_chunks(chunks, book_id)
             
-            # Process in smaller batches for memory efficiency
-            batch_size = 100
-            vectordb = None
+            logger.info(f"✓ Successfully processed {len(chunks)} chunks")
+            return len(chunks)
             
-            for i in tqdm(range(0, len(chunks), batch_size), desc="Creating embeddings"):
-                batch = chunks[i:i + batch_size]
-                
+        except Exception as e:
+            logger.error(f"Error processing document: {str(e)}")
+            raise
+    
+    def store_chunks(self, chunks: List[Document], book_id: str) -> None:
+        """
+        Embed chunks and add them to the book's collection, in batches.
+        "chroma_write" in /metrics times each batch including its embedding,
+        which is also timed on its own as "embed".
+        """
+        logger.info("Generating embeddings and storing in vector database...")
+        
+        # Process in smaller batches for memory efficiency
+        batch_size = 100
+        vectordb = None
+        
+        for i in metrics.progress(range(0, len(chunks), batch_size), stage="embed_batch",
+                                  total=(len(chunks) + batch_size - 1) // batch_size, desc="Creating embeddings"):
+            batch = chunks[i:i + batch_size]
+            
+            with metrics.timed("chroma_write"):
                 if vectordb is None:
                     # Create initial vectordb
                     vectordb = Chroma.from_documents(
@@ -334,32 +388,110 @@ class RAGProcessor:
                 else:
                     # Add to existing vectordb
                     vectordb.add_documents(batch)
-                
-                # Persist after each batch to avoid memory issues
-                # Note: persist() may not exist in newer ChromaDB versions (persistence is automatic)
-                try:
-                    if hasattr(vectordb, 'persist'):
-                        vectordb.persist()
-                except Exception as persist_error:
-                    # Persistence is automatic when persist_directory is set, so this is optional
-                    logger.debug(f"Persist call skipped (may not be needed): {persist_error}")
-                
-                # Memory management
-                if i % 200 == 0:
-                    import gc
-                    gc.collect()
+            metrics.add_items("chroma_write", len(batch))
             
-            logger.info(f"✓ Successfully processed {len(chunks)} chunks")
+            # Persist after each batch to avoid memory issues
+            # Note: persist() may not exist in newer ChromaDB versions (persistence is automatic)
+            try:
+                if hasattr(vectordb, 'persist'):
+                    vectordb.persist()
+            except Exception as persist_error:
+                # Persistence is automatic when persist_directory is set, so this is optional
+                logger.debug(f"Persist call skipped (may not be needed): {persist_error}")
+            
+            # Memory management
+            if i % 200 == 0:
+                import gc
+                gc.collect()
+    
+    @staticmethod
+    def chunk_transcript(segments: List[Dict[str, Any]], window_seconds: float = 60.0,
+                         overlap_seconds: float = 10.0, max_chars: int = 1500) -> List[Document]:
+        """
+        Group transcript segments ({'text', 'start', 'duration'}) into time
+        windows of about `window_seconds`, overlapping by `overlap_seconds`.
+        Each chunk records its `start` and `end` time in seconds.
+        """
+        segments = sorted(
+            (s for s in segments if (s.get('text') or '').strip()),
+            key=lambda s: float(s.get('start', 0.0))
+        )
+        chunks = []
+        i = 0
+        while i < len(segments):
+            window_start = float(segments[i]['start'])
+            j = i
+            chars = 0
+            while j < len(segments) and (j == i or (
+                    float(segments[j]['start']) < window_start + window_seconds and chars < max_chars)):
+                chars += len(segments[j]['text']) + 1
+                j += 1
+            window = segments[i:j]
+            last = window[-1]
+            end = float(last['start']) + float(last.get('duration', 0.0))
+            chunks.append(Document(
+                page_content=" ".join(s['text'].strip() for s in window),
+                metadata={"start": round(window_start, 2), "end": round(end, 2)}
+            ))
+            if j >= len(segments):
+                break
+            # Next window repeats the segments of the last `overlap_seconds`
+            next_i = j
+            while next_i - 1 > i and float(segments[next_i - 1]['start']) >= end - overlap_seconds:
+                next_i -= 1
+            i = max(next_i, i + 1)
+        return chunks
+    
+    def process_transcript(self, segments: List[Dict[str, Any]], book_id: str,
+                           metadata: Optional[Dict] = None, window_seconds: float = 60.0) -> int:
+        """
+        Index a video transcript as time-window chunks with start/end metadata.
+        A transcript that is already indexed under `book_id` is not re-embedded.
+        """
+        try:
+            existing = self.get_stats(book_id).get("chunk_count", 0)
+            if existing:
+                logger.info(f"Transcript {book_id} already indexed ({existing} chunks)")
+                return existing
+            
+            chunks = self.chunk_transcript(segments, window_seconds=window_seconds)
+            if not chunks:
+                logger.warning(f"No chunks created from transcript {book_id}")
+                return 0
+            
+            for chunk in chunks:
+                chunk.metadata.update(metadata or {})
+                chunk.metadata['book_id'] = book_id
+            
+            logger.info(f"Indexing {len(chunks)} transcript windows for {book_id}...")
+            self.store_chunks(chunks, book_id)
+            logger.info(f"✓ Successfully processed {len(chunks)} transcript chunks")
             return len(chunks)
             
         except Exception as e:
-            logger.error(f"Error processing document: {str(e)}")
+            logger.error(f"Error processing transcript: {str(e)}")
             raise
     
-    def query_book(self, book_id: str, question: str, k: int = 3) -> Dict[str, Any]:
+    def embed_query(self, question: str) -> List[float]:
+        """Embed a question with the same (normalized) model used for the chunks."""
+        return self.embeddings.embed_query(question)
+    
+    @staticmethod
+    def chunk_id(doc: Document) -> str:
+        """Stable identifier for a stored chunk (vector-store id when available)."""
+        doc_id = getattr(doc, 'id', None)
+        if doc_id:
+            return str(doc_id)
+        key = f"{doc.metadata.get('source', '')}|{doc.metadata.get('page', '')}|{doc.page_content or ''}"
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+    
+    @metrics.timed("query_book")
+    def query_book(self, book_id: str, question: str, k: int = 3,
+                   query_embedding: Optional[List[float]] = None) -> Dict[str, Any]:
         """
         Retrieve top-k similar chunks for a question.
-        Optimized for fast retrieval.
+        Optimized for fast retrieval. Pass `query_embedding` to reuse an
+        embedding the caller already computed instead of embedding again.
         """
         try:
             vectordb = Chroma(
@@ -369,20 +501,28 @@ class RAGProcessor:
             )
             
             # Use similarity search with score
-            docs_scores = vectordb.similarity_search_with_score(question, k=k)
+            if query_embedding is not None:
+                docs_scores = vectordb.similarity_search_by_vector_with_relevance_scores(query_embedding, k=k)
+            else:
+                docs_scores = vectordb.similarity_search_with_score(question, k=k)
             
             results: List[Dict[str, Any]] = []
             for doc, score in docs_scores:
                 results.append({
+                    "chunk_id": self.chunk_id(doc),
                     "content": (doc.page_content or "")[:500],  # Limited preview
                     "score": float(score),
                     "page": doc.metadata.get('page', 'N/A'),
                     "source": doc.metadata.get('source', 'Unknown')
                 })
+                if 'start' in doc.metadata:
+                    # Transcript chunk: cite its time window instead of a page
+                    results[-1].update(page=None, start=doc.metadata['start'], end=doc.metadata.get('end'))
             
             return {"results": results}
             
         except Exception as e:
+            metrics.STAGE_FAILURES.inc(stage="query_book")
             logger.error(f"Error querying book {book_id}: {str(e)}")
             return {"results": [], "error": str(e)}
     
@@ -0,0 +1,318 @@
+"""
+Lazily generated study artifacts (notes, flashcards, MCQs), memoised per document.
+
+An upload only pays for the summary; the other artifacts are generated the
+first time a client asks for them, or earlier by a low-priority background
+prefetch. Results are stored in SQLite per (document id, kind), so every
+gunicorn worker serves the same memoised artifact, and a re-upload of the
+document invalidates them.
+
+A generation in progress is recorded as a lease: other workers asking for
+the same artifact wait for it instead of generating it a second time, and
+take over if the lease runs out (e.g. the worker died). Within a process,
+callers join the in-flight generation; an on-demand request cancels a
+prefetch that has not started yet and generates at its own priority.
+
+On-demand generation runs on a small pool rather than the request thread,
+so get() can give up waiting after `timeout` (below the server's worker
+timeout) while the generation finishes and is memoised in the background.
+The in-process registry lock is never held across SQLite writes.
+"""
+import concurrent.futures
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from services.codec import compress, decompress
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_READY = "ready"
+STATUS_ERROR = "error"
+
+
+class UnknownArtifact(KeyError):
+    """Raised for an artifact kind without a registered generator."""
+
+
+class _LeaseHeld(Exception):
+    """Another worker holds the generation lease (callers go back to polling)."""
+
+
+class ArtifactStore:
+    """
+    `generators` maps a kind to fn(text) -> data; `text_fn(document_id)`
+    loads the document text. A result for which `is_failure(kind, data)` is
+    true is returned to the caller but stored as an error, so it is retried.
+    `background_context()` wraps prefetch work (e.g. to lower its priority).
+    """
+
+    def __init__(self, db_path: str, generators: Dict[str, Callable[[str], Any]],
+                 text_fn: Callable[[str], str], prefetch_workers: int = 1, lease_seconds: float = 180,
+                 on_demand_workers: int = 4,
+                 is_failure: Optional[Callable[[str, Any], bool]] = None,
+                 background_context: Optional[Callable[[], Any]] = None):
+        self.db_path = db_path
+        self.generators = generators
+        self.text_fn = text_fn
+        self.lease_seconds = lease_seconds
+        self.is_failure = is_failure or (lambda kind, data: not data)
+        self.background_context = background_context or nullcontext
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, prefetch_workers), thread_name_prefix="artifact-prefetch"
+        )
+        self._on_demand = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, on_demand_workers), thread_name_prefix="artifact-generate"
+        )
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._inflight: Dict[Tuple[str, str], concurrent.futures.Future] = {}
+        self._queued: Dict[Tuple[str, str], concurrent.futures.Future] = {}
+        self._stats = {"hits": 0, "generated": 0, "prefetched": 0, "failures": 0, "joined": 0,
+                       "prefetch_cancelled": 0}
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts ("
+                " document_id TEXT NOT NULL,"
+                " kind TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " data BLOB,"
+                " error TEXT,"
+                " lease_until REAL NOT NULL DEFAULT 0,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (document_id, kind))"
+            )
+
+    @contextmanager
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        with conn:
+            yield conn
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _check_kind(self, kind: str):
+        if kind not in self.generators:
+            raise UnknownArtifact(kind)
+
+    def _row(self, document_id: str, kind: str):
+        with self._connection() as conn:
+            return conn.execute(
+                "SELECT status, data, lease_until FROM artifacts WHERE document_id = ? AND kind = ?",
+                (document_id, kind),
+            ).fetchone()
+
+    def status(self, document_id: str) -> Dict[str, str]:
+        """Status of every artifact kind of a document."""
+        with self._connection() as conn:
+            rows = dict(conn.execute(
+                "SELECT kind, status FROM artifacts WHERE document_id = ?", (document_id,)
+            ).fetchall())
+        with self._lock:
+            now_running = {kind for (doc, kind) in self._inflight if doc == document_id}
+        return {
+            kind: STATUS_RUNNING if kind in now_running and rows.get(kind) != STATUS_READY
+            else rows.get(kind, STATUS_PENDING)
+            for kind in self.generators
+        }
+
+    def peek(self, document_id: str, kind: str) -> Optional[Any]:
+        """The memoised artifact, or None if it is not ready."""
+        self._check_kind(kind)
+        row = self._row(document_id, kind)
+        if row and row[0] == STATUS_READY:
+            return json.loads(decompress(row[1]).decode("utf-8"))
+        return None
+
+    def put(self, document_id: str, kind: str, data: Any):
+        """Memoise an artifact generated elsewhere (e.g. by a combined study-pack call)."""
+        self._check_kind(kind)
+        blob = compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO artifacts (document_id, kind, status, data, error, lease_until, updated_at) "
+                "VALUES (?, ?, ?, ?, NULL, 0, ?)",
+                (document_id, kind, STATUS_READY, blob, time.time()),
+            )
+
+    def invalidate(self, document_id: str):
+        """Forget all artifacts of a document (called when it is uploaded again)."""
+        with self._lock:
+            for key in [k for k in self._queued if k[0] == document_id]:
+                self._queued.pop(key).cancel()
+        with self._connection() as conn:
+            conn.execute("DELETE FROM artifacts WHERE document_id = ?", (document_id,))
+
+    def _claim(self, document_id: str, kind: str) -> bool:
+        """Take the generation lease unless the artifact is ready or another worker holds a live lease."""
+        now = time.time()
+        with self._connection() as conn:
+            return conn.execute(
+                "INSERT INTO artifacts (document_id, kind, status, lease_until, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(document_id, kind) DO UPDATE SET status = excluded.status, "
+                "lease_until = excluded.lease_until, updated_at = excluded.updated_at "
+                "WHERE artifacts.status != 'ready' AND (artifacts.status != 'running' OR artifacts.lease_until < ?)",
+                (document_id, kind, STATUS_RUNNING, now + self.lease_seconds, now, now),
+            ).rowcount > 0
+
+    def _generate(self, document_id: str, kind: str) -> Any:
+        try:
+            data = self.generators[kind](self.text_fn(document_id))
+        except Exception as e:
+            self._count("failures")
+            with self._connection() as conn:
+                conn.execute(
+                    "UPDATE artifacts SET status = ?, error = ?, lease_until = 0, updated_at = ? "
+                    "WHERE document_id = ? AND kind = ?",
+                    (STATUS_ERROR, str(e), time.time(), document_id, kind),
+                )
+            raise
+        if self.is_failure(kind, data):
+            self._count("failures")
+            with self._connection() as conn:
+                conn.execute(
+                    "UPDATE artifacts SET status = ?, error = ?, lease_until = 0, updated_at = ? "
+                    "WHERE document_id = ? AND kind = ?",
+                    (STATUS_ERROR, "generation returned no usable result", time.time(), document_id, kind),
+                )
+        else:
+            self.put(document_id, kind, data)
+        return data
+
+    def _register(self, key) -> Tuple[concurrent.futures.Future, bool]:
+        """The in-process future for `key`: (future, True) if the caller created it and must claim."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = self._inflight[key] = concurrent.futures.Future()
+            return future, True
+
+    def _release(self, key, future: concurrent.futures.Future, error: Optional[BaseException] = None):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                self._inflight.pop(key)
+        if error is not None and not future.done():
+            future.set_exception(error)
+
+    def _lead(self, document_id: str, kind: str, future: concurrent.futures.Future):
+        """Generate as the lease holder and publish the result on `future`."""
+        try:
+            data = self._generate(document_id, kind)
+            self._count("generated")
+            future.set_result(data)
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            self._release((document_id, kind), future)
+
+    def get(self, document_id: str, kind: str, timeout: float = 60) -> Tuple[str, Any]:
+        """
+        (status, data) for an artifact, generating it on a miss. Waits up to
+        `timeout` for this or a running generation (here or in another
+        worker); after that (STATUS_RUNNING, None) and the generation goes on.
+        """
+        self._check_kind(kind)
+        key = (document_id, kind)
+        deadline = time.monotonic() + timeout
+        while True:
+            data = self.peek(document_id, kind)
+            if data is not None:
+                self._count("hits")
+                return STATUS_READY, data
+
+            with self._lock:
+                queued = self._queued.pop(key, None)
+                if queued is not None and queued.cancel():
+                    # Not started yet: generate now at the caller's priority instead
+                    self._stats["prefetch_cancelled"] += 1
+            future, leader = self._register(key)
+            if leader:
+                try:
+                    claimed = self._claim(document_id, kind)
+                except BaseException as e:
+                    self._release(key, future, e)
+                    raise
+                if claimed:
+                    # copy_context: the generation keeps the caller's priority scope
+                    self._on_demand.submit(contextvars.copy_context().run, self._lead, document_id, kind, future)
+                else:
+                    self._release(key, future, _LeaseHeld())
+                    future = None
+            else:
+                self._count("joined")
+
+            if future is not None:
+                try:
+                    data = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                    return (STATUS_READY if not self.is_failure(kind, data) else STATUS_ERROR), data
+                except concurrent.futures.TimeoutError:
+                    return STATUS_RUNNING, None
+                except _LeaseHeld:
+                    pass
+
+            # Another worker holds the lease: poll until it finishes or the lease expires
+            if time.monotonic() >= deadline:
+                return STATUS_RUNNING, None
+            time.sleep(0.5)
+
+    def prefetch(self, document_id: str, kinds: Optional[Iterable[str]] = None):
+        """Queue background generation of artifacts that are not ready yet."""
+        for kind in kinds or self.generators:
+            self._check_kind(kind)
+            key = (document_id, kind)
+            with self._lock:
+                if key in self._queued or key in self._inflight:
+                    continue
+                self._queued[key] = self._executor.submit(self._prefetch_one, document_id, kind)
+
+    def _prefetch_one(self, document_id: str, kind: str):
+        key = (document_id, kind)
+        with self._lock:
+            self._queued.pop(key, None)
+            if key in self._inflight:
+                return
+        future, leader = self._register(key)
+        if not leader:
+            return
+        try:
+            claimed = self._claim(document_id, kind)
+        except Exception as e:
+            logger.warning(f"Prefetch of {kind} for {document_id} could not take the lease: {e}")
+            self._release(key, future, e)
+            return
+        if not claimed:
+            self._release(key, future, _LeaseHeld())
+            return
+        try:
+            with self.background_context():
+                data = self._generate(document_id, kind)
+            self._count("prefetched")
+            future.set_result(data)
+        except Exception as e:
+            logger.warning(f"Prefetch of {kind} for {document_id} failed: {e}")
+            future.set_exception(e)
+        finally:
+            self._release(key, future)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._connection() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM artifacts GROUP BY status").fetchall()
+        with self._lock:
+            return dict(self._stats, queued=len(self._queued), in_flight=len(self._inflight),
+                        artifacts={status: count for status, count in rows})
@@ -0,0 +1,135 @@
+"""
+Content-addressed blob directory for uploaded images.
+
+Images are stored once under their SHA-256 (`<root>/ab/abcdef...`) and served
+by URL instead of being inlined as base64 data URIs in upload responses and
+saved sessions. Since a blob's content never changes for a given hash, the
+hash doubles as a strong ETag and responses can be cached indefinitely.
+Thumbnails are rendered lazily with Pillow and cached next to the originals.
+"""
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Thumbnail edges the server will render; anything else is rejected so
+# clients cannot fill the disk with arbitrary sizes.
+THUMBNAIL_SIZES = (128, 256, 512)
+
+_MAGIC = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"%PDF", "application/pdf"),
+)
+
+
+def sniff_mime_type(head: bytes) -> str:
+    """Content type from a file's first bytes (the upload's extension is not trusted)."""
+    for magic, mime_type in _MAGIC:
+        if head.startswith(magic):
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+def is_blob_hash(value: str) -> bool:
+    return bool(value) and bool(_HASH_RE.match(value))
+
+
+class BlobStore:
+    """Write-once files addressed by SHA-256 of their content."""
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        self._thumb_lock = threading.Lock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root_dir, digest[:2], digest)
+
+    def put_file(self, src_path: str) -> str:
+        """Copy a file into the store (if not already present) and return its hash."""
+        sha = hashlib.sha256()
+        with open(src_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        digest = sha.hexdigest()
+        dest = self._path(digest)
+        if not os.path.exists(dest):
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            # Copy to a temp name and rename so readers never see a partial blob
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as out, open(src_path, "rb") as f:
+                    shutil.copyfileobj(f, out, 1 << 20)
+                os.replace(tmp_path, dest)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        return digest
+
+    def path(self, digest: str) -> Optional[str]:
+        """Filesystem path of a stored blob, or None if the hash is unknown."""
+        if not is_blob_hash(digest):
+            return None
+        path = self._path(digest)
+        return path if os.path.exists(path) else None
+
+    def mime_type(self, digest: str) -> str:
+        path = self.path(digest)
+        if path is None:
+            return "application/octet-stream"
+        with open(path, "rb") as f:
+            return sniff_mime_type(f.read(16))
+
+    def thumbnail(self, digest: str, edge: int = 256) -> Optional[str]:
+        """Path of a JPEG thumbnail no larger than `edge` pixels, rendered on first use."""
+        if edge not in THUMBNAIL_SIZES:
+            raise ValueError(f"Unsupported thumbnail size {edge}")
+        source = self.path(digest)
+        if source is None:
+            return None
+        thumb_path = os.path.join(self.root_dir, "thumbs", digest[:2], f"{digest}_{edge}.jpg")
+        if os.path.exists(thumb_path):
+            return thumb_path
+
+        from PIL import Image
+
+        with self._thumb_lock:
+            if os.path.exists(thumb_path):
+                return thumb_path
+            os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+            with Image.open(source) as image:
+                image.draft("RGB", (edge, edge))  # Cheap JPEG downscale while decoding
+                image.thumbnail((edge, edge))
+                if image.mode not in ("RGB", "L"):
+                    image = image.convert("RGB")
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(thumb_path), prefix=".tmp-")
+                with os.fdopen(fd, "wb") as out:
+                    image.save(out, "JPEG", quality=80, optimize=True)
+                os.replace(tmp_path, thumb_path)
+        return thumb_path
+
+    def stats(self) -> Dict[str, int]:
+        blobs = 0
+        total_bytes = 0
+        for entry in os.scandir(self.root_dir):
+            if not entry.is_dir() or entry.name == "thumbs":
+                continue
+            for blob in os.scandir(entry.path):
+                if is_blob_hash(blob.name):
+                    blobs += 1
+                    total_bytes += blob.stat().st_size
+        return {"blobs": blobs, "bytes": total_bytes}
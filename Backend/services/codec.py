@@ -0,0 +1,41 @@
+"""
+Compression for payloads stored in SQLite (sessions, transcripts, artifacts).
+
+Each blob starts with a one-byte codec marker, so rows written with gzip
+stay readable after zstandard is installed (and the other way round, as
+long as zstandard is still installed). Tiny payloads are stored raw.
+"""
+import gzip
+
+try:
+    import zstandard
+except ImportError:  # Optional; gzip is used instead
+    zstandard = None
+
+# Codec used for new payloads
+CODEC = "zstd" if zstandard is not None else "gzip"
+
+# Payloads smaller than this are not worth compressing
+_COMPRESS_MIN_BYTES = 256
+
+
+def compress(data: bytes) -> bytes:
+    """Compress with a one-byte codec marker: Z=zstd, G=gzip, R=raw."""
+    if len(data) < _COMPRESS_MIN_BYTES:
+        return b"R" + data
+    if zstandard is not None:
+        return b"Z" + zstandard.ZstdCompressor(level=3).compress(data)
+    return b"G" + gzip.compress(data, compresslevel=6)
+
+
+def decompress(blob: bytes) -> bytes:
+    codec, body = blob[:1], bytes(blob[1:])
+    if codec == b"R":
+        return body
+    if codec == b"G":
+        return gzip.decompress(body)
+    if codec == b"Z":
+        if zstandard is None:
+            raise RuntimeError("Payload is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(body)
+    raise ValueError(f"Unknown payload codec: {codec!r}")
@@ -0,0 +1,176 @@
+"""
+Server-side chat history with a cached rolling summary per conversation.
+
+Clients send a conversation_id instead of re-posting the whole history on
+every turn. Recent messages are kept verbatim; older ones are folded into a
+summary (produced by the caller's summarizer) and then deleted, so storage
+and prompt size stay bounded no matter how long the conversation runs.
+Summaries run in batches: only once more than `summarize_after` messages
+have piled up, folding all but the last `keep_recent`, so a summarizer call
+(an LLM call) happens every few turns rather than on every turn.
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class ConversationStore:
+    """SQLite-backed conversation log shared by all workers."""
+
+    def __init__(self, db_path: str, keep_recent: int = 6, summarize_after: Optional[int] = None):
+        self.db_path = db_path
+        self.keep_recent = keep_recent
+        self.summarize_after = max(summarize_after or 2 * keep_recent, keep_recent + 1)
+        self._local = threading.local()
+        self._summarizing = set()
+        self._summarizing_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                " id TEXT PRIMARY KEY,"
+                " summary TEXT NOT NULL DEFAULT '',"
+                " summarized_upto INTEGER NOT NULL DEFAULT 0,"
+                " updated_at REAL NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " conversation_id TEXT NOT NULL,"
+                " seq INTEGER NOT NULL,"
+                " sender TEXT NOT NULL,"
+                " text TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " PRIMARY KEY (conversation_id, seq));"
+                "CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations(updated_at);"
+            )
+
+    @contextmanager
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        with conn:
+            yield conn
+
+    def ensure(self, conversation_id: Optional[str] = None) -> str:
+        """Return an existing conversation id, or create a new conversation."""
+        conversation_id = conversation_id or uuid.uuid4().hex
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO conversations (id, updated_at) VALUES (?, ?)",
+                (conversation_id, time.time()),
+            )
+        return conversation_id
+
+    def append(self, conversation_id: str, messages: List[Dict[str, str]]):
+        """Append messages ({sender, text}) to a conversation."""
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM messages WHERE conversation_id = ?",
+                (conversation_id,),
+            ).fetchone()
+            seq = max(row[0], self._summarized_upto(conn, conversation_id))
+            for message in messages:
+                seq += 1
+                conn.execute(
+                    "INSERT INTO messages (conversation_id, seq, sender, text, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (conversation_id, seq, message.get("sender", "user"), message.get("text", "") or "", now),
+                )
+            conn.execute("UPDATE conversations SET updated_at = ? WHERE id = ?", (now, conversation_id))
+
+    def _summarized_upto(self, conn, conversation_id: str) -> int:
+        row = conn.execute(
+            "SELECT summarized_upto FROM conversations WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def history(self, conversation_id: str) -> Tuple[str, List[Dict[str, str]]]:
+        """Return (rolling summary, unsummarized messages oldest-first)."""
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT summary FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+            messages = conn.execute(
+                "SELECT sender, text FROM messages WHERE conversation_id = ? ORDER BY seq",
+                (conversation_id,),
+            ).fetchall()
+        summary = row[0] if row else ""
+        return summary, [{"sender": sender, "text": text} for sender, text in messages]
+
+    def needs_summary(self, conversation_id: str) -> bool:
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+        return row[0] > self.summarize_after
+
+    def summarize(self, conversation_id: str, summarizer: Callable[[str, List[Dict[str, str]]], Optional[str]]) -> bool:
+        """
+        Fold all but the most recent `keep_recent` messages into the rolling summary.
+        `summarizer(previous_summary, messages)` returns the new summary, or None to skip.
+        Only one summarization per conversation runs at a time in this process.
+        """
+        with self._summarizing_lock:
+            if conversation_id in self._summarizing:
+                return False
+            self._summarizing.add(conversation_id)
+        try:
+            return self._summarize(conversation_id, summarizer)
+        finally:
+            with self._summarizing_lock:
+                self._summarizing.discard(conversation_id)
+
+    def _summarize(self, conversation_id: str, summarizer) -> bool:
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT summary, summarized_upto FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+            rows = conn.execute(
+                "SELECT seq, sender, text FROM messages WHERE conversation_id = ? ORDER BY seq",
+                (conversation_id,),
+            ).fetchall()
+        if not row or len(rows) <= self.keep_recent:
+            return False
+
+        previous_summary, summarized_upto = row
+        to_fold = rows[:-self.keep_recent]
+        new_summary = summarizer(previous_summary, [{"sender": s, "text": t} for _, s, t in to_fold])
+        if not new_summary:
+            return False
+
+        upto = to_fold[-1][0]
+        with self._connection() as conn:
+            # Another worker may have summarized concurrently; only move forward
+            updated = conn.execute(
+                "UPDATE conversations SET summary = ?, summarized_upto = ?, updated_at = ? "
+                "WHERE id = ? AND summarized_upto = ?",
+                (new_summary, upto, time.time(), conversation_id, summarized_upto),
+            ).rowcount
+            if updated:
+                conn.execute(
+                    "DELETE FROM messages WHERE conversation_id = ? AND seq <= ?",
+                    (conversation_id, upto),
+                )
+        return bool(updated)
+
+    def delete(self, conversation_id: str):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+
+    def prune(self, max_age_days: float = 30) -> int:
+        """Drop conversations idle for longer than `max_age_days`."""
+        cutoff = time.time() - max_age_days * 86400
+        with self._connection() as conn:
+            stale = [r[0] for r in conn.execute(
+                "SELECT id FROM conversations WHERE updated_at < ?", (cutoff,)
+            ).fetchall()]
+            for conversation_id in stale:
+                conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+                conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+        return len(stale)
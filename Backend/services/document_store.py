@@ -0,0 +1,190 @@
+"""
+Server-side store for extracted document text, indexed by page.
+
+Uploads persist the text they extract (PDF pages, OCR pages, YouTube
+transcripts) under a content-derived document id. Clients then refer to
+the document by id, and generation endpoints read the pages they need here,
+instead of the full raw text travelling back and forth with every request.
+
+PDF text keeps its "--- Page N ---" markers as page boundaries; text without
+markers (e.g. transcripts) is split into pages of roughly PAGE_CHARS.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+PAGE_CHARS = 3000
+
+_PAGE_MARKER_RE = re.compile(r"^--- Page (\d+) ---\n", re.MULTILINE)
+
+
+class DocumentNotFound(Exception):
+    """Raised when a document id does not exist."""
+
+
+def split_pages(text: str, page_chars: int = PAGE_CHARS) -> List[Tuple[int, str]]:
+    """Split extracted text into (page number, text) pairs."""
+    markers = list(_PAGE_MARKER_RE.finditer(text))
+    if markers:
+        pages = []
+        for i, marker in enumerate(markers):
+            end = markers[i + 1].start() if i + 1 < len(markers) else len(text)
+            pages.append((int(marker.group(1)), text[marker.end():end].strip()))
+        return pages
+
+    pages = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + page_chars)
+        if end < len(text):
+            space = text.rfind(" ", start + page_chars // 2, end)
+            if space > start:
+                end = space
+        pages.append((len(pages) + 1, text[start:end].strip()))
+        start = end
+    return pages
+
+
+def document_id_for(text: str) -> str:
+    """Identical text always maps to the same document id."""
+    return "doc_" + hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+class DocumentStore:
+    """SQLite-backed page store shared by all workers."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                " id TEXT PRIMARY KEY,"
+                " filename TEXT NOT NULL,"
+                " type TEXT NOT NULL,"
+                " paged INTEGER NOT NULL,"
+                " page_count INTEGER NOT NULL,"
+                " char_count INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS document_pages ("
+                " document_id TEXT NOT NULL,"
+                " page INTEGER NOT NULL,"
+                " text TEXT NOT NULL,"
+                " PRIMARY KEY (document_id, page));"
+                "CREATE INDEX IF NOT EXISTS idx_documents_accessed ON documents(accessed_at);"
+            )
+
+    @contextmanager
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        with conn:
+            yield conn
+
+    def put(self, text: str, filename: str, doc_type: str) -> Dict[str, Any]:
+        """Store extracted text (idempotent) and return the document metadata."""
+        document_id = document_id_for(text)
+        pages = split_pages(text)
+        paged = bool(_PAGE_MARKER_RE.search(text))
+        now = time.time()
+        with self._connection() as conn:
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO documents (id, filename, type, paged, page_count, char_count, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (document_id, filename, doc_type, int(paged), len(pages), len(text), now, now),
+            ).rowcount
+            if inserted:
+                conn.executemany(
+                    "INSERT INTO document_pages (document_id, page, text) VALUES (?, ?, ?)",
+                    [(document_id, page, page_text) for page, page_text in pages],
+                )
+            else:
+                conn.execute("UPDATE documents SET accessed_at = ? WHERE id = ?", (now, document_id))
+        return self.metadata(document_id)
+
+    def metadata(self, document_id: str) -> Dict[str, Any]:
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT id, filename, type, page_count, char_count, created_at FROM documents WHERE id = ?",
+                (document_id,),
+            ).fetchone()
+            if row is None:
+                raise DocumentNotFound(document_id)
+            first, last = conn.execute(
+                "SELECT MIN(page), MAX(page) FROM document_pages WHERE document_id = ?", (document_id,)
+            ).fetchone()
+        return {
+            "document_id": row[0],
+            "filename": row[1],
+            "type": row[2],
+            "page_count": row[3],
+            "char_count": row[4],
+            "created_at": row[5],
+            "first_page": first,
+            "last_page": last,
+        }
+
+    def pages(self, document_id: str, start_page: Optional[int] = None, end_page: Optional[int] = None,
+              limit: Optional[int] = None) -> List[Tuple[int, str]]:
+        """(page, text) pairs for an inclusive page range, in page order."""
+        query = "SELECT page, text FROM document_pages WHERE document_id = ?"
+        params: List[Any] = [document_id]
+        if start_page is not None:
+            query += " AND page >= ?"
+            params.append(start_page)
+        if end_page is not None:
+            query += " AND page <= ?"
+            params.append(end_page)
+        query += " ORDER BY page"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._connection() as conn:
+            paged = conn.execute("SELECT paged FROM documents WHERE id = ?", (document_id,)).fetchone()
+            if paged is None:
+                raise DocumentNotFound(document_id)
+            rows = conn.execute(query, params).fetchall()
+            conn.execute("UPDATE documents SET accessed_at = ? WHERE id = ?", (time.time(), document_id))
+        return rows
+
+    def text(self, document_id: str, start_page: Optional[int] = None, end_page: Optional[int] = None) -> str:
+        """Text of a page range, in the same layout the extractor produced."""
+        with self._connection() as conn:
+            row = conn.execute("SELECT paged FROM documents WHERE id = ?", (document_id,)).fetchone()
+        if row is None:
+            raise DocumentNotFound(document_id)
+        pages = self.pages(document_id, start_page, end_page)
+        if row[0]:
+            return "\n\n".join(f"--- Page {page} ---\n{page_text}" for page, page_text in pages)
+        return " ".join(page_text for _, page_text in pages)
+
+    def delete(self, document_id: str):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM document_pages WHERE document_id = ?", (document_id,))
+            conn.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+
+    def prune(self, max_age_days: float = 90, keep: Iterable[str] = ()) -> List[str]:
+        """
+        Drop documents not accessed for longer than `max_age_days`, except
+        those in `keep` (e.g. referenced by saved sessions). Returns their ids.
+        """
+        cutoff = time.time() - max_age_days * 86400
+        keep = set(keep)
+        with self._connection() as conn:
+            stale = [r[0] for r in conn.execute(
+                "SELECT id FROM documents WHERE accessed_at < ?", (cutoff,)
+            ).fetchall() if r[0] not in keep]
+            for document_id in stale:
+                conn.execute("DELETE FROM document_pages WHERE document_id = ?", (document_id,))
+                conn.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+        return stale
@@ -0,0 +1,376 @@
+"""
+Rendering of study artifacts to PDF / TXT / DOCX, with a render cache and
+streamed ZIP export.
+
+Rendered files are cached on disk under a hash of (renderer version,
+artifact type, format, content), so downloading the same summary or MCQ set
+again, alone or inside a course pack, does not re-run reportlab/python-docx.
+stream_zip() writes a ZIP archive incrementally from cached files: only one
+small chunk of the archive is in memory at a time, however large the pack.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from io import BytesIO
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from docx import Document
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of rendered files changes, so cached renders are not reused
+RENDER_VERSION = 1
+
+TEXT_TYPES = ("summary", "short_notes", "image_description")
+ARTIFACT_TYPES = TEXT_TYPES + ("flashcards", "mcqs", "transcript")
+FORMATS = ("pdf", "txt", "docx")
+
+MIME_TYPES = {
+    "pdf": "application/pdf",
+    "txt": "text/plain",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+_ZIP_CHUNK = 64 * 1024
+
+
+class UnsupportedExport(ValueError):
+    """Raised for an artifact type / format combination that cannot be rendered."""
+
+
+def _card_sides(card: Dict[str, Any]) -> Tuple[str, str]:
+    """Flashcards come as front/back (client) or question/answer."""
+    return card.get("front", card.get("question", "")), card.get("back", card.get("answer", ""))
+
+
+def _mcq_parts(mcq: Dict[str, Any]):
+    """(options as (letter, text) pairs, correct answer) for either MCQ shape."""
+    options = []
+    for i, option in enumerate(mcq.get("options") or []):
+        if isinstance(option, dict):
+            options.append((option.get("letter", "ABCDEFGH"[i % 8]), option.get("text", "")))
+        else:
+            options.append(("ABCDEFGH"[i % 8], str(option)))
+    return options, mcq.get("correct_answer") or mcq.get("answer", "")
+
+
+def _timestamp(seconds) -> str:
+    return f"[{int(seconds // 60)}:{int(seconds % 60):02d}]"
+
+
+def _render_pdf(content_type: str, content: Any) -> bytes:
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    styles = getSampleStyleSheet()
+    custom_style = ParagraphStyle(
+        'CustomStyle',
+        parent=styles['Normal'],
+        fontSize=12,
+        leading=14,
+        spaceAfter=12,
+        alignment=1
+    )
+    story = []
+    if content_type in TEXT_TYPES:
+        story.append(Paragraph(content_type.replace('_', ' ').title(), styles['Title']))
+        for paragraph in content.split('\n\n'):
+            story.append(Paragraph(paragraph, custom_style))
+            story.append(Spacer(1, 12))
+    elif content_type == 'flashcards':
+        story.append(Paragraph("Flashcards", styles['Title']))
+        for i, card in enumerate(content, 1):
+            front, back = _card_sides(card)
+            story.append(Paragraph(f"Card {i}", styles['Heading2']))
+            story.append(Paragraph(f"Question: {front}", custom_style))
+            story.append(Paragraph(f"Answer: {back}", custom_style))
+            story.append(Spacer(1, 12))
+    elif content_type == 'mcqs':
+        story.append(Paragraph("Multiple Choice Questions", styles['Title']))
+        for i, mcq in enumerate(content, 1):
+            options, correct = _mcq_parts(mcq)
+            story.append(Paragraph(f"Question {i}: {mcq['question']}", styles['Heading2']))
+            for letter_, text in options:
+                story.append(Paragraph(f"{letter_}) {text}", custom_style))
+            story.append(Paragraph(f"Correct Answer: {correct}", custom_style))
+            story.append(Paragraph(f"Explanation: {mcq.get('explanation', 'No explanation available')}", custom_style))
+            story.append(Spacer(1, 12))
+    elif content_type == 'transcript':
+        story.append(Paragraph("YouTube Video Transcript", styles['Title']))
+        for segment in content:
+            story.append(Paragraph(f"{_timestamp(segment['start'])} {segment['text']}", styles['Normal']))
+    doc.build(story)
+    return buffer.getvalue()
+
+
+def _render_txt(content_type: str, content: Any) -> bytes:
+    buffer = BytesIO()
+    if content_type in TEXT_TYPES:
+        buffer.write(content.encode('utf-8'))
+    elif content_type == 'flashcards':
+        buffer.write(b"Flashcards\n\n")
+        for i, card in enumerate(content, 1):
+            front, back = _card_sides(card)
+            buffer.write(f"Card {i}\n".encode('utf-8'))
+            buffer.write(f"  Question: {front}\n".encode('utf-8'))
+            buffer.write(f"  Answer: {back}\n".encode('utf-8'))
+            buffer.write(b"\n")
+    elif content_type == 'mcqs':
+        buffer.write(b"Multiple Choice Questions\n\n")
+        for i, mcq in enumerate(content, 1):
+            options, correct = _mcq_parts(mcq)
+            buffer.write(f"Question {i}: {mcq['question']}\n".encode('utf-8'))
+            for letter_, text in options:
+                buffer.write(f"  {letter_}) {text}\n".encode('utf-8'))
+            buffer.write(f"Correct Answer: {correct}\n".encode('utf-8'))
+            buffer.write(f"Explanation: {mcq.get('explanation', 'No explanation available')}\n".encode('utf-8'))
+            buffer.write(b"\n")
+    elif content_type == 'transcript':
+        buffer.write(b"YouTube Video Transcript\n\n")
+        for segment in content:
+            buffer.write(f"{_timestamp(segment['start'])} {segment['text']}\n".encode('utf-8'))
+    return buffer.getvalue()
+
+
+def _render_docx(content_type: str, content: Any) -> bytes:
+    buffer = BytesIO()
+    doc = Document()
+    doc.add_heading(content_type.replace('_', ' ').title(), level=1).alignment = WD_ALIGN_PARAGRAPH.CENTER
+    if content_type in TEXT_TYPES:
+        for paragraph in content.split('\n\n'):
+            p = doc.add_paragraph(paragraph)
+            p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+    elif content_type == 'flashcards':
+        for i, card in enumerate(content, 1):
+            front, back = _card_sides(card)
+            doc.add_paragraph(f"Card {i}", style='Heading 2')
+            doc.add_paragraph(f"Question: {front}")
+            doc.add_paragraph(f"Answer: {back}", style='Normal').runs[0].italic = True
+    elif content_type == 'mcqs':
+        for i, mcq in enumerate(content, 1):
+            options, correct = _mcq_parts(mcq)
+            doc.add_paragraph(f"Question {i}: {mcq['question']}", style='Heading 2')
+            for letter_, text in options:
+                doc.add_paragraph(f"{letter_}) {text}")
+            doc.add_paragraph(f"Correct Answer: {correct}", style='Normal').runs[0].bold = True
+            doc.add_paragraph(f"Explanation: {mcq.get('explanation', 'No explanation available')}", style='Normal')
+    elif content_type == 'transcript':
+        for segment in content:
+            doc.add_paragraph(f"{_timestamp(segment['start'])} {segment['text']}")
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+_RENDERERS = {"pdf": _render_pdf, "txt": _render_txt, "docx": _render_docx}
+
+
+def render_artifact(content_type: str, format_type: str, content: Any) -> bytes:
+    """Render one artifact to bytes in the given format."""
+    if content_type not in ARTIFACT_TYPES:
+        raise UnsupportedExport(f"Unsupported content type: {content_type}")
+    if format_type not in _RENDERERS:
+        raise UnsupportedExport(f"Unsupported format: {format_type}")
+    return _RENDERERS[format_type](content_type, content)
+
+
+def render_key(content_type: str, format_type: str, content: Any) -> str:
+    canonical = json.dumps([RENDER_VERSION, content_type, format_type, content],
+                           sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """
+    Rendered files on disk, keyed by content hash, pruned oldest-first past
+    `max_bytes`. A render prunes once the bytes written since the last prune
+    may exceed `max_bytes`, and at least every `prune_every` renders (other
+    workers write to the same directory), so scans of the directory stay rare.
+    """
+
+    def __init__(self, root_dir: str, max_bytes: int = 256 * 1024 * 1024, prune_every: int = 50):
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self.prune_every = prune_every
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "render_ms_total": 0.0, "pruned": 0}
+        # Cache size at the last prune plus what this process has written since
+        self._tracked_bytes = 0
+        self._renders_since_prune = 0
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _path(self, key: str, format_type: str) -> str:
+        return os.path.join(self.root_dir, key[:2], f"{key}.{format_type}")
+
+    def render(self, content_type: str, format_type: str, content: Any) -> str:
+        """Path of the rendered file, rendering it on a cache miss."""
+        key = render_key(content_type, format_type, content)
+        path = self._path(key, format_type)
+        if os.path.exists(path):
+            try:
+                os.utime(path)  # Recently used files survive pruning
+            except OSError:
+                pass
+            with self._lock:
+                self._stats["hits"] += 1
+            return path
+
+        started = time.perf_counter()
+        data = render_artifact(content_type, format_type, content)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp name and rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            self._stats["misses"] += 1
+            self._stats["render_ms_total"] += (time.perf_counter() - started) * 1000
+            self._tracked_bytes += len(data)
+            self._renders_since_prune += 1
+            due = self._tracked_bytes > self.max_bytes or self._renders_since_prune >= self.prune_every
+        # Skipped if another thread is already pruning
+        if due and self._prune_lock.acquire(blocking=False):
+            try:
+                self._prune()
+            except OSError as e:
+                logger.warning(f"Could not prune the render cache: {e}")
+            finally:
+                self._prune_lock.release()
+        return path
+
+    def _files(self) -> List[os.DirEntry]:
+        entries = []
+        for directory in os.scandir(self.root_dir):
+            if directory.is_dir():
+                entries.extend(e for e in os.scandir(directory.path) if e.is_file() and not e.name.startswith("."))
+        return entries
+
+    def prune(self) -> int:
+        """Delete least recently used renders until the cache fits in max_bytes."""
+        with self._prune_lock:
+            return self._prune()
+
+    def _prune(self) -> int:
+        entries = sorted(self._files(), key=lambda e: e.stat().st_mtime)
+        total = sum(e.stat().st_size for e in entries)
+        removed = 0
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        with self._lock:
+            self._stats["pruned"] += removed
+            self._tracked_bytes = total
+            self._renders_since_prune = 0
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        files = self._files()
+        with self._lock:
+            return dict(self._stats, files=len(files), bytes=sum(e.stat().st_size for e in files),
+                        max_bytes=self.max_bytes)
+
+
+class _ChunkSink:
+    """Write-only, non-seekable file object that hands written bytes to a generator."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries: Iterable[Tuple[str, str]]) -> Iterator[bytes]:
+    """
+    Yield a ZIP archive of (archive name, file path) entries as it is written.
+    Already-compressed formats (PDF, DOCX) are stored, text is deflated.
+    """
+    sink = _ChunkSink()
+    # A non-seekable sink makes zipfile write data descriptors after each file
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+        for arcname, path in entries:
+            compress_type = zipfile.ZIP_STORED if path.endswith((".pdf", ".docx")) else zipfile.ZIP_DEFLATED
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime(os.path.getmtime(path))[:6])
+            info.compress_type = compress_type
+            with open(path, "rb") as src, archive.open(info, "w") as dest:
+                for block in iter(lambda: src.read(_ZIP_CHUNK), b""):
+                    dest.write(block)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+
+def safe_folder_name(name: str, used: set) -> str:
+    """A unique, filesystem-friendly folder name for a source file inside the archive."""
+    stem = os.path.splitext(os.path.basename((name or "").rstrip("/")))[0] or "content"
+    stem = "".join(c if c.isalnum() or c in "-_ ." else "_" for c in stem).strip(" .")[:60] or "content"
+    candidate, n = stem, 2
+    while candidate.lower() in used:
+        candidate = f"{stem}-{n}"
+        n += 1
+    used.add(candidate.lower())
+    return candidate
+
+
+def plan_bulk_export(files: List[Dict[str, Any]], formats: List[str],
+                     types: Optional[List[str]] = None) -> List[Tuple[str, str, str, Any]]:
+    """
+    (archive name, content type, format, content) for every non-empty artifact
+    of every file, in every requested format.
+    """
+    for format_type in formats:
+        if format_type not in FORMATS:
+            raise UnsupportedExport(f"Unsupported format: {format_type}")
+    wanted = types or list(ARTIFACT_TYPES)
+    for content_type in wanted:
+        if content_type not in ARTIFACT_TYPES:
+            raise UnsupportedExport(f"Unsupported content type: {content_type}")
+
+    plan = []
+    used = set()
+    for file_data in files:
+        if not isinstance(file_data, dict):
+            continue
+        folder = safe_folder_name(str(file_data.get("filename") or ""), used)
+        for content_type in wanted:
+            content = file_data.get(content_type)
+            if not content or (content_type in TEXT_TYPES and not isinstance(content, str)):
+                continue
+            for format_type in formats:
+                plan.append((f"{folder}/{content_type}.{format_type}", content_type, format_type, content))
+    return plan
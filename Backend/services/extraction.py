@@ -0,0 +1,113 @@
+"""
+Text extraction from PDFs (PyMuPDF, with an OCR fallback for scanned PDFs).
+
+These functions are CPU-bound and only depend on their arguments, so App.py
+can run them in a process pool; keep this module free of Flask/App imports
+so worker processes start quickly.
+"""
+import gc
+import logging
+from contextlib import contextmanager
+from typing import Optional
+
+import pymupdf as fitz
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def open_pdf(pdf_path: str):
+    """Context manager for safely opening PDF files."""
+    doc = None
+    try:
+        doc = fitz.open(pdf_path)
+        yield doc
+    finally:
+        if doc:
+            doc.close()
+
+
+def extract_text_from_pdf(pdf_path: str, max_pages: int = 100) -> Optional[str]:
+    """Extract text from PDF using PyMuPDF with memory optimization."""
+    try:
+        text_chunks = []
+        with open_pdf(pdf_path) as doc:
+            total_pages = len(doc)
+            pages_to_process = min(total_pages, max_pages)
+            
+            for page_num in range(pages_to_process):
+                try:
+                    page = doc[page_num]
+                    page_text = page.get_text("text")
+                    if page_text and page_text.strip():
+                        text_chunks.append(f"--- Page {page_num + 1} ---\n{page_text.strip()}")
+                    
+                    # Memory management: Clear references periodically
+                    if page_num % 50 == 0:
+                        gc.collect()
+                        
+                except Exception as page_error:
+                    logger.warning(f"Error processing page {page_num}: {page_error}")
+                    continue
+        
+        if text_chunks:
+            return "\n\n".join(text_chunks)
+        return None
+        
+    except Exception as e:
+        logger.error(f"Error extracting text from PDF: {e}")
+        return None
+
+
+def extract_text_from_scanned_pdf(pdf_path: str, max_pages: int = 20, dpi: int = 200) -> Optional[str]:
+    """Extract text from scanned PDF using OCR with memory optimization."""
+    # Lazy-import heavy OCR stack so startup stays fast when OCR is not used
+    from pdf2image import convert_from_path
+    import cv2
+    import numpy as np
+    import pytesseract
+
+    try:
+        logger.info(f"Starting OCR processing for {pdf_path} (max {max_pages} pages)")
+        
+        # Convert limited number of pages to images
+        images = convert_from_path(pdf_path, first_page=1, last_page=max_pages, dpi=dpi)
+        extracted_text = []
+        
+        for i, image in enumerate(images):
+            if i >= max_pages:
+                break
+                
+            try:
+                # Convert PIL image to OpenCV format
+                img = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+                
+                # Apply preprocessing for better OCR
+                denoised = cv2.medianBlur(gray, 3)
+                _, binary = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+                
+                # OCR with optimized config
+                custom_config = r'--oem 3 --psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789.,!?;:()[]{}@#$%^&*+-= '
+                text = pytesseract.image_to_string(binary, config=custom_config)
+                
+                if text.strip():
+                    extracted_text.append(f"--- Page {i + 1} ---\n{text.strip()}")
+                
+                # Memory management
+                if i % 5 == 0:
+                    gc.collect()
+                    
+            except Exception as img_e:
+                logger.error(f"Error processing page {i}: {img_e}")
+                continue
+        
+        if extracted_text:
+            result = "\n\n".join(extracted_text)
+            logger.info(f"OCR extracted {len(extracted_text)} pages of text")
+            return result
+        return None
+        
+    except Exception as e:
+        logger.error(f"Error processing scanned PDF: {e}")
+        return None
@@ -0,0 +1,116 @@
+"""
+Thread-safe pool of ready Gemini model handles, one per (api key, model).
+
+genai.configure() mutates process-global state, so switching keys per call
+lets concurrent requests in the same worker run on the wrong key. Instead,
+each pooled GenerativeModel gets its own GenerativeServiceClient bound to a
+single API key, and nothing is reconfigured after startup.
+"""
+import hashlib
+import logging
+import threading
+import time
+from typing import Dict, Iterator, Tuple
+
+import google.generativeai as genai
+from google.ai import generativelanguage as glm
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+
+
+def _key_fingerprint(api_key: str) -> str:
+    """Short, non-reversible label for logs and cache keys."""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+
+
+class _StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class StubGenerativeModel:
+    """
+    Offline stand-in for GenerativeModel, for tests and local development.
+    Replies with a canned answer; with stream=True it yields it word by word,
+    sleeping `token_delay` seconds between chunks to mimic generation latency.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL, reply: str = None, token_delay: float = 0.0):
+        self.model_name = model_name
+        self.reply = reply or "This is a stub response from the local Gemini model."
+        self.token_delay = token_delay
+        self.calls = []
+
+    def _chunks(self) -> Iterator[_StubResponse]:
+        words = self.reply.split(" ")
+        for i, word in enumerate(words):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            yield _StubResponse(word if i == len(words) - 1 else word + " ")
+
+    def generate_content(self, contents, stream: bool = False, **kwargs):
+        self.calls.append(contents)
+        if stream:
+            return self._chunks()
+        return _StubResponse(self.reply)
+
+
+class GeminiClientPool:
+    """
+    Hands out GenerativeModel instances pinned to a specific API key.
+
+    Models are created once and shared: the underlying gRPC clients are
+    thread-safe, so concurrent threads can call generate_content on the same
+    handle. Async code should run calls via asyncio.to_thread() rather than
+    binding gRPC asyncio channels to short-lived event loops.
+    """
+
+    def __init__(self, transport: str = None, stub_model: StubGenerativeModel = None):
+        self.transport = transport
+        # When set, every get_model() call returns this stub (no network access)
+        self.stub_model = stub_model
+        self._lock = threading.Lock()
+        self._clients: Dict[str, glm.GenerativeServiceClient] = {}
+        self._models: Dict[Tuple[str, str], genai.GenerativeModel] = {}
+
+    def _make_client(self, api_key: str) -> glm.GenerativeServiceClient:
+        kwargs = {"client_options": {"api_key": api_key}}
+        if self.transport:
+            kwargs["transport"] = self.transport
+        return glm.GenerativeServiceClient(**kwargs)
+
+    def get_model(self, api_key: str, model_name: str = DEFAULT_MODEL) -> genai.GenerativeModel:
+        """Return the shared model handle for this key, creating it on first use."""
+        if self.stub_model is not None:
+            return self.stub_model
+        if not api_key:
+            raise ValueError("A Gemini API key is required")
+        fingerprint = _key_fingerprint(api_key)
+        cache_key = (fingerprint, model_name)
+        model = self._models.get(cache_key)
+        if model is not None:
+            return model
+
+        with self._lock:
+            model = self._models.get(cache_key)
+            if model is None:
+                client = self._clients.get(fingerprint)
+                if client is None:
+                    client = self._make_client(api_key)
+                    self._clients[fingerprint] = client
+                model = genai.GenerativeModel(model_name)
+                # Pin the model to this key's client so generate_content never
+                # falls back to the globally configured default client.
+                model._client = client
+                self._models[cache_key] = model
+                logger.info(f"Created Gemini model handle {model_name} for key {fingerprint}")
+        return model
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "models": len(self._models),
+            }
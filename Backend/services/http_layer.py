@@ -0,0 +1,200 @@
+"""
+Response layer: fast JSON serialization and negotiated compression.
+
+- OrjsonProvider replaces Flask's stdlib JSON provider when orjson is
+  installed (several times faster on large upload/session payloads).
+- compress_response() is an after_request hook that gzip/brotli-encodes
+  compressible bodies above a size threshold, chosen by Accept-Encoding.
+- stream_json() serializes a large payload element by element and
+  compresses incrementally, so neither the full JSON text nor its
+  compressed copy has to be held in memory at once.
+"""
+import gzip
+import json
+import zlib
+from typing import Any, Iterator, Optional
+
+from flask import Response
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Optional; the stdlib provider is used instead
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # Optional; gzip is used instead
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    "text/",
+)
+
+_ORJSON_OPTIONS = 0
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, falling back to stdlib for odd types."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return self._dumps_bytes(obj).decode("utf-8")
+
+    def _dumps_bytes(self, obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, default=self.default, option=_ORJSON_OPTIONS)
+        except TypeError:
+            return json.dumps(obj, default=self.default, ensure_ascii=False).encode("utf-8")
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps_bytes(obj), mimetype=self.mimetype)
+
+
+def install_json_provider(app) -> bool:
+    """Use orjson for jsonify()/request.get_json() when it is installed."""
+    if orjson is None:
+        return False
+    app.json = OrjsonProvider(app)
+    return True
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Serialize with orjson when available (used by streaming helpers)."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8")
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick br or gzip from an Accept-Encoding header (respecting q=0)."""
+    accepted = {}
+    for part in (accept_encoding or "").lower().split(","):
+        token, _, params = part.strip().partition(";")
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def _compressible(mimetype: Optional[str]) -> bool:
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def compress_response(response: Response, accept_encoding: Optional[str], min_size: int = 1024,
+                      gzip_level: int = 6, brotli_quality: int = 5) -> Response:
+    """after_request hook body: encode the response if it is worth it and the client allows it."""
+    response.vary.add("Accept-Encoding")
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or "Content-Encoding" in response.headers
+        or not _compressible(response.mimetype)
+    ):
+        return response
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < min_size:
+        return response
+
+    if encoding == "br":
+        encoded = brotli.compress(body, quality=brotli_quality)
+    else:
+        encoded = gzip.compress(body, compresslevel=gzip_level)
+    response.set_data(encoded)
+    response.headers["Content-Encoding"] = encoding
+    if response.headers.get("ETag") and not response.headers["ETag"].startswith("W/"):
+        response.headers["ETag"] = "W/" + response.headers["ETag"]
+    return response
+
+
+STREAM_STRING_PIECE = 64 * 1024
+
+
+def _json_chunks(data: Any, depth: int = 0) -> Iterator[bytes]:
+    """
+    Serialize `data` as a sequence of chunks: containers (down to a few
+    levels) element by element, and long strings in fixed-size pieces.
+    """
+    if isinstance(data, str) and len(data) > STREAM_STRING_PIECE:
+        yield b'"'
+        for start in range(0, len(data), STREAM_STRING_PIECE):
+            # Escaped body of each piece, without its surrounding quotes
+            yield dumps_bytes(data[start:start + STREAM_STRING_PIECE])[1:-1]
+        yield b'"'
+    elif isinstance(data, list) and depth < 3:
+        yield b"["
+        for i, item in enumerate(data):
+            if i:
+                yield b","
+            yield from _json_chunks(item, depth + 1)
+        yield b"]"
+    elif isinstance(data, dict) and depth < 3:
+        yield b"{"
+        for i, (key, value) in enumerate(data.items()):
+            yield (b"," if i else b"") + dumps_bytes(str(key)) + b":"
+            yield from _json_chunks(value, depth + 1)
+        yield b"}"
+    else:
+        yield dumps_bytes(data)
+
+
+def _encode_stream(chunks: Iterator[bytes], encoding: Optional[str]) -> Iterator[bytes]:
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=5)
+        for chunk in chunks:
+            out = compressor.process(chunk)
+            if out:
+                yield out
+        yield compressor.finish()
+    elif encoding == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+        for chunk in chunks:
+            out = compressor.compress(chunk)
+            if out:
+                yield out
+        yield compressor.flush()
+    else:
+        yield from chunks
+
+
+def stream_json(data: Any, accept_encoding: Optional[str] = None, status: int = 200) -> Response:
+    """
+    Stream a large JSON payload. Element-wise serialization keeps peak memory
+    near the largest single element; compression (if negotiated) is applied
+    incrementally rather than to a fully built body.
+    """
+    encoding = choose_encoding(accept_encoding)
+    response = Response(_encode_stream(_json_chunks(data), encoding),
+                        status=status, mimetype="application/json")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
@@ -0,0 +1,264 @@
+"""
+Image preparation and description caching for Gemini image prompts.
+
+Each uploaded image is decoded once with Pillow, EXIF-rotated, downscaled so
+its longest edge is at most `max_edge`, and re-encoded compactly with the
+correct mime type (the original bytes are sent when they are already small
+enough). Descriptions are cached by content hash, and by a 64-bit difference
+hash (dHash) so that re-encoded or resized copies of the same picture also
+hit. Near matches are found through four indexed 16-bit bands of the dHash:
+two hashes within MAX_HAMMING (< 4) bits always share at least one band.
+
+A dHash alone cannot tell text slides apart (different slides on the same
+white background often hash identically), so a near match is only reused
+after a pixel check: the same aspect ratio and no pixel of a 64x64
+grayscale thumbnail differing by more than MAX_PIXEL_DIFF.
+"""
+import hashlib
+import io
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+MAX_HAMMING = 3
+THUMB_SIZE = 64
+# Re-encoded or resized copies stay well under this; different text does not
+MAX_PIXEL_DIFF = 24
+MAX_ASPECT_DIFF = 0.02
+
+_FORMAT_MIME = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+
+class PreparedImage:
+    """Model-ready image bytes plus the hashes used for caching."""
+
+    def __init__(self, data: bytes, mime_type: str, content_hash: str, dhash: int,
+                 original_bytes: int, size, thumb: bytes = b""):
+        self.data = data
+        self.mime_type = mime_type
+        self.content_hash = content_hash
+        self.dhash = dhash
+        self.thumb = thumb
+        self.original_bytes = original_bytes
+        self.size = size
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """Difference hash: compares adjacent pixels of a tiny grayscale copy."""
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def thumbnail(image: Image.Image) -> bytes:
+    """THUMB_SIZE x THUMB_SIZE grayscale pixels (box-averaged), for confirming near matches."""
+    return image.convert("L").resize((THUMB_SIZE, THUMB_SIZE), Image.BOX).tobytes()
+
+
+def same_picture(width: int, height: int, thumb: bytes, other: "PreparedImage") -> bool:
+    """Pixel check of a dHash near match: same aspect ratio and nearly identical thumbnails."""
+    if not thumb or len(thumb) != len(other.thumb) or not height or not other.size[1]:
+        return False
+    if abs(width / height - other.size[0] / other.size[1]) > MAX_ASPECT_DIFF * (width / height):
+        return False
+    return max(abs(a - b) for a, b in zip(thumb, other.thumb)) <= MAX_PIXEL_DIFF
+
+
+def prepare_image(path: str, max_edge: int = 1536, jpeg_quality: int = 85) -> PreparedImage:
+    with open(path, "rb") as f:
+        original = f.read()
+    return prepare_image_bytes(original, max_edge, jpeg_quality)
+
+
+def prepare_image_bytes(original: bytes, max_edge: int = 1536, jpeg_quality: int = 85,
+                        content_hash: Optional[str] = None) -> PreparedImage:
+    """Decode once, normalize orientation, downscale and encode for the model."""
+    content_hash = content_hash or hashlib.sha256(original).hexdigest()
+
+    with Image.open(io.BytesIO(original)) as opened:
+        source_format = opened.format
+        rotated = opened.getexif().get(0x0112, 1) != 1  # EXIF Orientation
+        image = ImageOps.exif_transpose(opened) if rotated else opened.copy()
+    fingerprint = dhash(image)
+    thumb = thumbnail(image)
+
+    needs_resize = max(image.size) > max_edge
+    if not needs_resize and not rotated and source_format in ("JPEG", "PNG", "WEBP"):
+        # Already small enough: send the original bytes untouched
+        return PreparedImage(original, _FORMAT_MIME[source_format], content_hash, fingerprint,
+                             len(original), image.size, thumb)
+
+    if needs_resize:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    if image.mode in ("RGBA", "LA", "P"):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.split()[-1])
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=jpeg_quality, optimize=True)
+    data, mime_type = out.getvalue(), "image/jpeg"
+    if source_format == "PNG":
+        # Diagrams and screenshots are often smaller (and sharper) as a
+        # 256-colour palette PNG, which is plenty for describing them
+        png = io.BytesIO()
+        image.quantize(256).save(png, "PNG", optimize=True)
+        if png.tell() < len(data):
+            data, mime_type = png.getvalue(), "image/png"
+    return PreparedImage(data, mime_type, content_hash, fingerprint, len(original), image.size, thumb)
+
+
+def _bands(value: int):
+    return [(value >> shift) & 0xFFFF for shift in (48, 32, 16, 0)]
+
+
+def _to_signed(value: int) -> int:
+    """SQLite integers are signed 64-bit."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+class ImageDescriber:
+    """
+    describe(path) -> description, using `describe_fn(data, mime_type)` on a
+    cache miss. `namespace` (e.g. the model name) keeps caches for different
+    models or prompts apart. Thread-safe; the caller controls concurrency.
+    """
+
+    def __init__(self, describe_fn: Callable[[bytes, str], str], db_path: str, namespace: str = "",
+                 max_edge: int = 1536, jpeg_quality: int = 85, ttl_seconds: float = 30 * 24 * 3600):
+        self.describe_fn = describe_fn
+        self.db_path = db_path
+        self.namespace = namespace
+        self.max_edge = max_edge
+        self.jpeg_quality = jpeg_quality
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "exact_hits": 0, "perceptual_hits": 0, "misses": 0,
+                       "bytes_original": 0, "bytes_sent": 0}
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(
+                "CREATE TABLE IF NOT EXISTS image_descriptions ("
+                " namespace TEXT NOT NULL,"
+                " content_hash TEXT NOT NULL,"
+                " dhash INTEGER NOT NULL,"
+                " band0 INTEGER NOT NULL, band1 INTEGER NOT NULL,"
+                " band2 INTEGER NOT NULL, band3 INTEGER NOT NULL,"
+                " width INTEGER NOT NULL, height INTEGER NOT NULL,"
+                " thumb BLOB NOT NULL,"
+                " description TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, content_hash));"
+                "CREATE INDEX IF NOT EXISTS idx_image_band0 ON image_descriptions(namespace, band0);"
+                "CREATE INDEX IF NOT EXISTS idx_image_band1 ON image_descriptions(namespace, band1);"
+                "CREATE INDEX IF NOT EXISTS idx_image_band2 ON image_descriptions(namespace, band2);"
+                "CREATE INDEX IF NOT EXISTS idx_image_band3 ON image_descriptions(namespace, band3);"
+            )
+
+    @contextmanager
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        with conn:
+            yield conn
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def lookup_exact(self, content_hash: str) -> Optional[str]:
+        cutoff = time.time() - self.ttl_seconds
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT description FROM image_descriptions "
+                "WHERE namespace = ? AND content_hash = ? AND created_at >= ?",
+                (self.namespace, content_hash, cutoff),
+            ).fetchone()
+        if row:
+            self._count("exact_hits")
+            return row[0]
+        return None
+
+    def lookup_similar(self, image: PreparedImage) -> Optional[str]:
+        cutoff = time.time() - self.ttl_seconds
+        with self._connection() as conn:
+            bands = _bands(image.dhash)
+            candidates = conn.execute(
+                "SELECT dhash, width, height, thumb, description FROM image_descriptions "
+                "WHERE namespace = ? AND created_at >= ? "
+                "AND (band0 = ? OR band1 = ? OR band2 = ? OR band3 = ?)",
+                (self.namespace, cutoff, *bands),
+            ).fetchall()
+        best = None
+        for stored, width, height, thumb, description in candidates:
+            distance = bin((stored & 0xFFFFFFFFFFFFFFFF) ^ image.dhash).count("1")
+            if distance > MAX_HAMMING or (best is not None and distance >= best[0]):
+                continue
+            if same_picture(width, height, thumb, image):
+                best = (distance, description)
+        if best:
+            self._count("perceptual_hits")
+            return best[1]
+        return None
+
+    def store(self, image: PreparedImage, description: str):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO image_descriptions "
+                "(namespace, content_hash, dhash, band0, band1, band2, band3, width, height, thumb, "
+                "description, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.namespace, image.content_hash, _to_signed(image.dhash), *_bands(image.dhash),
+                 image.size[0], image.size[1], image.thumb, description, time.time()),
+            )
+
+    def describe(self, path: str) -> str:
+        """Cached description of the image at `path`; model errors propagate."""
+        self._count("requests")
+        with open(path, "rb") as f:
+            original = f.read()
+        content_hash = hashlib.sha256(original).hexdigest()
+        # Exact repeats skip decoding entirely
+        cached = self.lookup_exact(content_hash)
+        if cached is not None:
+            return cached
+        image = prepare_image_bytes(original, self.max_edge, self.jpeg_quality, content_hash)
+        cached = self.lookup_similar(image)
+        if cached is not None:
+            return cached
+
+        self._count("misses")
+        self._count("bytes_original", image.original_bytes)
+        self._count("bytes_sent", len(image.data))
+        logger.info(
+            f"Describing image {image.content_hash[:12]} ({image.size[0]}x{image.size[1]} {image.mime_type}, "
+            f"{image.original_bytes} -> {len(image.data)} bytes)"
+        )
+        description = self.describe_fn(image.data, image.mime_type)
+        if description:
+            self.store(image, description)
+        return description
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats, max_edge=self.max_edge)
@@ -0,0 +1,438 @@
+"""
+Per-stage timers and counters, exported in the Prometheus text format.
+
+Hot stages (PDF extraction, OCR, page loading, chunking, embedding, Chroma
+writes, retrieval, Gemini calls, export rendering) run inside timed(stage),
+which records a latency histogram, an in-flight gauge and failures per
+stage; add_bytes()/add_items() count the input each stage processed.
+Components that already keep their own counters (caches, the rate limiter)
+are read through register_collector(), so they pay nothing per request.
+
+    with metrics.timed("chunk", nbytes=len(text)):
+        chunks = splitter.split_documents(documents)
+
+progress() replaces tqdm progress bars: in the server it only counts items
+(bars written to stderr from request threads are noise in the logs); CLI
+tools can turn the bars back on with show_progress_bars(True).
+
+The server runs several worker processes and a scrape reaches any one of
+them, so after enable_multiprocess(directory) every process writes a
+snapshot of its metrics to <directory>/<pid>-<id>.json every few seconds
+and /metrics adds up the snapshots of all processes: counters and
+histograms from every process that has run (processes that have been gone
+a while are folded into retired.json), gauges only from live ones. Other
+processes' values are at most one write interval old. Ratios are computed
+after the sum (register_ratio). Stdlib only.
+"""
+import atexit
+import bisect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: snapshots are read without locking and never retired
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "notelooms"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds; stages range from a cached lookup (ms) to OCR of a long scan (minutes)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+RETIRED_FILE = "retired.json"
+
+Sample = Tuple[Dict[str, str], float]
+# {name: {"kind", "help", "samples": [[[[label, value], ...], value], ...], "buckets" (histograms)}}
+Families = Dict[str, Dict[str, Any]]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _copy(self, value):
+        return value
+
+    def family(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = [[[list(pair) for pair in zip(self.labelnames, key)], self._copy(value)]
+                       for key, value in self._values.items()]
+        return {"kind": self.kind, "help": self.documentation, "samples": samples}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = STAGE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, +Inf last; then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _copy(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+    def family(self) -> Dict[str, Any]:
+        return dict(super().family(), buckets=list(self.buckets))
+
+
+def _merge(snapshots: Iterable[Tuple[Families, bool]]) -> Dict[str, Dict[str, Any]]:
+    """Sum (families, live) snapshots; gauges only count from live ones. Samples become {label pairs: value}."""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for families, live in snapshots:
+        for name, family in families.items():
+            if family["kind"] == "gauge" and not live:
+                continue
+            target = merged.setdefault(name, dict(family, samples={}))
+            for labels, value in family["samples"]:
+                key = tuple(tuple(pair) for pair in labels)
+                current = target["samples"].get(key)
+                if family["kind"] != "histogram":
+                    target["samples"][key] = (current or 0) + value
+                elif current is None:
+                    target["samples"][key] = [list(value[0]), value[1], value[2]]
+                elif len(current[0]) == len(value[0]):  # skip snapshots written with other buckets
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+                    current[2] += value[2]
+    return merged
+
+
+def _unmerge(merged: Dict[str, Dict[str, Any]]) -> Families:
+    return {name: dict(family, samples=[[[list(pair) for pair in key], value]
+                                        for key, value in family["samples"].items()])
+            for name, family in merged.items()}
+
+
+def _format(merged: Dict[str, Dict[str, Any]]) -> str:
+    lines: List[str] = []
+    for name, family in merged.items():
+        lines += [f"# HELP {name} {family['help']}", f"# TYPE {name} {family['kind']}"]
+        for key, value in sorted(family["samples"].items()):
+            names, values = [pair[0] for pair in key], [pair[1] for pair in key]
+            if family["kind"] != "histogram":
+                lines.append(f"{name}{_labels(names, values)} {_number(value)}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for upper, n in zip(list(family["buckets"]) + [float("inf")], counts):
+                cumulative += n
+                le = f'le="{_number(upper)}"'
+                lines.append(f"{name}_bucket{_labels(names, values, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(names, values)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(names, values)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsRegistry:
+    """Named metrics plus collectors, summed over all server processes and rendered as Prometheus text."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]] = []
+        self._ratios: Dict[str, Tuple[str, str, str]] = {}
+        self.directory: Optional[str] = None
+        self.interval = 5.0
+        self.retire_after = 600.0
+        self._path: Optional[str] = None
+        self._stop = threading.Event()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        name = f"{PREFIX}_{name}"
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = STAGE_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]):
+        """
+        `collector()` is called on every snapshot and yields (name, type, help,
+        [(labels, value), ...]) for counters/gauges it reads from elsewhere.
+        Values are per process; they are summed like the other metrics.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def register_ratio(self, name: str, documentation: str, numerator: str, denominator: str):
+        """Gauge `name` = numerator / denominator per label set, computed from the summed counters."""
+        with self._lock:
+            self._ratios[f"{PREFIX}_{name}"] = (documentation, f"{PREFIX}_{numerator}", f"{PREFIX}_{denominator}")
+
+    def collect(self) -> Families:
+        """This process's metrics and collector values."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        families = {metric.name: metric.family() for metric in metrics}
+        for collector in collectors:
+            try:
+                collected = list(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+                continue
+            for name, kind, documentation, samples in collected:
+                families[f"{PREFIX}_{name}"] = {
+                    "kind": kind, "help": documentation,
+                    "samples": [[[[k, str(v)] for k, v in labels.items()], value]
+                                for labels, value in samples if value is not None],
+                }
+        return families
+
+    def enable_multiprocess(self, directory: str, interval: float = 5.0, retire_after: float = 600.0):
+        """
+        Share this process's metrics through `directory` (one per deployment,
+        all worker processes) every `interval` seconds. Snapshots not updated
+        for `retire_after` seconds belong to exited processes and are folded
+        into retired.json.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.interval = interval
+        self.retire_after = max(retire_after, interval * 10)
+        self._path = os.path.join(directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+        self.write_snapshot()
+        threading.Thread(target=self._run, name="metrics-writer", daemon=True).start()
+        atexit.register(self.write_snapshot)
+        logger.info(f"✓ Metrics shared across processes through {directory}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write_snapshot()
+
+    def write_snapshot(self, families: Optional[Families] = None):
+        if self._path is None:
+            return
+        try:
+            self._write(self._path, {"pid": os.getpid(), "written": time.time(),
+                                     "families": families if families is not None else self.collect()})
+        except Exception as e:
+            logger.warning(f"Could not write metrics snapshot {self._path}: {e}")
+
+    @staticmethod
+    def _write(path: str, payload: Dict[str, Any]):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @contextmanager
+    def _locked(self, operation):
+        """Shared lock for reading snapshots, exclusive for retiring them (so nothing is counted twice)."""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, ".lock"), "a") as f:
+            fcntl.flock(f, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_snapshots(self) -> Tuple[List[Tuple[Families, bool]], List[str]]:
+        """Other processes' (families, live) snapshots, and the paths of long-gone ones."""
+        now = time.time()
+        snapshots, retired = [], []
+        with self._locked(fcntl.LOCK_SH if fcntl else None):
+            with os.scandir(self.directory) as it:
+                paths = [e.path for e in it if e.name.endswith(".json") and e.path != self._path]
+            for path in paths:
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        payload = json.load(f)
+                except (OSError, ValueError):
+                    continue  # retired or replaced meanwhile
+                age = now - payload.get("written", 0)
+                snapshots.append((payload["families"], age < self.interval * 3 and "pid" in payload))
+                if "pid" in payload and age > self.retire_after:
+                    retired.append(path)
+        return snapshots, retired
+
+    def _retire(self, paths: List[str]):
+        """Fold the counters and histograms of exited processes into retired.json."""
+        if fcntl is None:
+            return
+        retired_path = os.path.join(self.directory, RETIRED_FILE)
+        with self._locked(fcntl.LOCK_EX):
+            snapshots, removed = [], []
+            for path in [retired_path] + paths:
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        snapshots.append((json.load(f)["families"], False))
+                except (OSError, ValueError):
+                    continue  # no retired.json yet, or already retired by another process
+                if path != retired_path:
+                    removed.append(path)
+            if not removed:
+                return
+            self._write(retired_path, {"written": time.time(), "families": _unmerge(_merge(snapshots))})
+            for path in removed:
+                os.remove(path)
+        logger.info(f"✓ Folded {len(removed)} exited process(es) into {RETIRED_FILE}")
+
+    def render(self) -> str:
+        own = self.collect()
+        snapshots = [(own, True)]
+        retired: List[str] = []
+        if self.directory:
+            self.write_snapshot(own)
+            others, retired = self._read_snapshots()
+            snapshots += others
+        merged = _merge(snapshots)
+        with self._lock:
+            ratios = dict(self._ratios)
+        for name, (documentation, numerator, denominator) in ratios.items():
+            hits = merged.get(numerator, {}).get("samples", {})
+            totals = merged.get(denominator, {}).get("samples", {})
+            merged[name] = {"kind": "gauge", "help": documentation,
+                            "samples": {key: hits.get(key, 0) / total if total else 0.0
+                                        for key, total in totals.items()}}
+        if retired:
+            try:
+                self._retire(retired)
+            except OSError as e:
+                logger.warning(f"Could not retire metrics snapshots: {e}")
+        return _format(merged)
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram("stage_duration_seconds", "Time spent in each processing stage.", ["stage"])
+STAGE_IN_FLIGHT = REGISTRY.gauge("stage_in_flight", "Operations currently running in each stage.", ["stage"])
+STAGE_FAILURES = REGISTRY.counter("stage_failures_total", "Stage runs that raised.", ["stage"])
+STAGE_BYTES = REGISTRY.counter("stage_bytes_total", "Bytes of input processed by each stage.", ["stage"])
+STAGE_ITEMS = REGISTRY.counter("stage_items_total", "Pages, chunks or batches processed by each stage.", ["stage"])
+
+
+@contextmanager
+def timed(stage: str, nbytes: Optional[int] = None):
+    """Time a stage: latency histogram, in-flight gauge, failures and (optionally) input bytes."""
+    STAGE_IN_FLIGHT.inc(stage=stage)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+        STAGE_IN_FLIGHT.dec(stage=stage)
+        if nbytes:
+            STAGE_BYTES.inc(nbytes, stage=stage)
+
+
+def add_bytes(stage: str, nbytes: int):
+    if nbytes:
+        STAGE_BYTES.inc(nbytes, stage=stage)
+
+
+def add_items(stage: str, count: int = 1):
+    if count:
+        STAGE_ITEMS.inc(count, stage=stage)
+
+
+_progress_bars = True
+
+
+def show_progress_bars(enabled: bool):
+    """Turn tqdm bars in progress() on (CLI, benchmarks) or off (server)."""
+    global _progress_bars
+    _progress_bars = enabled
+
+
+def progress(iterable, stage: str, total: Optional[int] = None, desc: Optional[str] = None, unit: str = "it"):
+    """Iterate, counting items under `stage`; shows a tqdm bar only when enabled and on a terminal."""
+    if _progress_bars and sys.stderr.isatty():
+        try:
+            from tqdm import tqdm
+            iterable = tqdm(iterable, total=total, desc=desc or stage, unit=unit)
+        except ImportError:
+            pass
+    for item in iterable:
+        STAGE_ITEMS.inc(stage=stage)
+        yield item
+
+
+def enable_multiprocess(directory: str, interval: float = 5.0):
+    REGISTRY.enable_multiprocess(directory, interval)
+
+
+def render() -> str:
+    return REGISTRY.render()
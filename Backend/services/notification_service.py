@@ -1,26 +1,172 @@
-from pymongo import MongoClient
+"""
+Topic notifications (MongoDB), fanned out in the background.
+
+When questions are added to a topic, everyone gets a broadcast and every
+user who has answered a question of that topic gets a targeted
+notification. The recipients come from one aggregation: questions of the
+topic (index on questions.topic) joined to user_history (index on
+user_history.question_id) and grouped by user. Notifications are written
+with unordered insert_many in fixed-size chunks while the aggregation
+cursor is read, so memory stays flat for any number of users.
+
+NotificationWorker runs fan-outs on a background thread and retries failed
+ones with backoff. Every fan-out has an id, and a unique index on
+(fanout_id, user_id) makes a retry skip the notifications an earlier
+attempt already wrote.
+
+Index plan (ensure_indexes):
+  questions     {topic: 1, difficulty: 1, _id: 1}   (quiz_service; its topic prefix serves the $match)
+  user_history  {question_id: 1, user_id: 1}        ($lookup by question_id, user_id read from the index)
+  notifications {user_id: 1, created_at: -1}        (a user's latest notifications)
+  notifications {fanout_id: 1, user_id: 1} unique   (idempotent retries)
+"""
 import datetime
+import logging
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Dict
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+def ensure_indexes(db):
+    """Create the indexes the fan-out relies on (see the module docstring)."""
+    db.user_history.create_index(
+        [("question_id", ASCENDING), ("user_id", ASCENDING)], name="question_user",
+    )
+    db.notifications.create_index(
+        [("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_created",
+    )
+    db.notifications.create_index(
+        [("fanout_id", ASCENDING), ("user_id", ASCENDING)], name="fanout_user", unique=True,
+        partialFilterExpression={"fanout_id": {"$exists": True}},
+    )
+
+
+def topic_user_ids_pipeline(topic):
+    """Distinct users who answered a question of `topic` (guests excluded)."""
+    return [
+        {"$match": {"topic": topic}},
+        {"$project": {"_id": 1}},
+        {"$lookup": {"from": "user_history", "localField": "_id", "foreignField": "question_id",
+                     "as": "attempt"}},
+        # Directly after $lookup, $unwind is folded into it: no per-question array is built
+        {"$unwind": "$attempt"},
+        {"$group": {"_id": "$attempt.user_id"}},
+        {"$match": {"_id": {"$nin": [None, "guest"]}}},
+    ]
+
 
-def notify_users(db, topic):
+def _insert_chunk(db, documents):
+    """Unordered insert; notifications already written by an earlier attempt are skipped."""
     try:
-        # Broadcast notification
-        broadcast_message = f"New question(s) have been added under {topic}. Come and try them now!"
-        db.notifications.insert_one({
-            "message": broadcast_message,
+        db.notifications.insert_many(documents, ordered=False)
+        return len(documents)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != DUPLICATE_KEY for error in errors):
+            raise
+        return len(documents) - len(errors)
+
+
+def notify_users(db, topic, fanout_id=None, chunk_size=1000):
+    """
+    Broadcast + targeted notifications for new questions in `topic`.
+    Returns the number of targeted notifications written. Raises on failure
+    (NotificationWorker retries); re-running with the same fanout_id is safe.
+    """
+    fanout_id = fanout_id or uuid.uuid4().hex
+    created_at = datetime.datetime.utcnow()
+    _insert_chunk(db, [{
+        "fanout_id": fanout_id,
+        "message": f"New question(s) have been added under {topic}. Come and try them now!",
+        "topic": topic,
+        "created_at": created_at,
+    }])
+
+    targeted_message = f"Hey, new content related to {topic} is live — give it a try!"
+    written, chunk = 0, []
+    cursor = db.questions.aggregate(topic_user_ids_pipeline(topic), allowDiskUse=True, batchSize=chunk_size)
+    for row in cursor:
+        chunk.append({
+            "fanout_id": fanout_id,
+            "user_id": row["_id"],
+            "message": targeted_message,
             "topic": topic,
-            "created_at": datetime.datetime.utcnow()
+            "created_at": created_at,
         })
+        if len(chunk) >= chunk_size:
+            written += _insert_chunk(db, chunk)
+            chunk = []
+    if chunk:
+        written += _insert_chunk(db, chunk)
+    return written
+
+
+class NotificationWorker:
+    """submit(topic) queues a fan-out and returns at once; a daemon thread runs it with retries."""
+
+    def __init__(self, db, chunk_size: int = 1000, max_attempts: int = 4, retry_delay: float = 2.0):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {"queued": 0, "completed": 0, "failed": 0, "retries": 0, "notifications": 0,
+                       "last_duration_seconds": None}
+        self._thread = threading.Thread(target=self._run, name="notification-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, topic) -> str:
+        fanout_id = uuid.uuid4().hex
+        with self._lock:
+            self._stats["queued"] += 1
+        self._queue.put((topic, fanout_id))
+        return fanout_id
+
+    def join(self):
+        """Block until every queued fan-out has finished (for tests and benchmarks)."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            topic, fanout_id = self._queue.get()
+            try:
+                self._fan_out(topic, fanout_id)
+            finally:
+                self._queue.task_done()
+
+    def _fan_out(self, topic, fanout_id):
+        started = time.perf_counter()
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                written = notify_users(self.db, topic, fanout_id, self.chunk_size)
+                with self._lock:
+                    self._stats["completed"] += 1
+                    self._stats["notifications"] += written
+                    self._stats["last_duration_seconds"] = round(time.perf_counter() - started, 3)
+                logger.info(f"✓ Notified {written} users about {topic}")
+                return
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    with self._lock:
+                        self._stats["failed"] += 1
+                    logger.error(f"Failed to send notifications for {topic} after {attempt} attempts: {e}")
+                    return
+                with self._lock:
+                    self._stats["retries"] += 1
+                delay = self.retry_delay * 2 ** (attempt - 1)
+                logger.warning(f"Notification fan-out for {topic} failed ({e}); retrying in {delay:.0f}s")
+                time.sleep(delay)
 
-        # Targeted notifications for users who attempted this topic
-        user_ids = db.user_history.distinct("user_id", {"question_id": {"$in": db.questions.distinct("_id", {"topic": topic})}})
-        for user_id in user_ids:
-            if user_id != 'guest':
-                targeted_message = f"Hey, new content related to {topic} is live — give it a try!"
-                db.notifications.insert_one({
-                    "user_id": user_id,
-                    "message": targeted_message,
-                    "topic": topic,
-                    "created_at": datetime.datetime.utcnow()
-                })
-    except Exception as e:
-        print(f"Failed to send notifications: {str(e)}")
\ No newline at end of file
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, pending=self._queue.unfinished_tasks)
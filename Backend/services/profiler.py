@@ -0,0 +1,252 @@
+"""
+On-demand request profiling and continuous low-rate sampling (stdlib only).
+
+StackSampler is a wall-clock sampling profiler: a daemon thread reads every
+thread's stack with sys._current_frames() at a fixed interval and counts
+"thread;outer;...;inner" stacks in the folded format that flamegraph.pl,
+speedscope and inferno read directly. It sees the threads a request fans out
+to (upload workers, chat retrieval, MCQ shards) as well as the request
+thread, so it attributes time to PyMuPDF, the splitter, the embedding model
+or a Gemini call wherever it runs. Idle pool threads (blocked in a queue or
+condition wait) are left out. It samples the whole process: requests that
+run at the same time show up in the profile too.
+
+A deterministic (cProfile) profile of just the request thread is available
+as well; it is stored in pstats format (snakeviz, `python -m pstats`).
+
+ProfilingMiddleware wraps the WSGI app, so a profile covers the whole
+response including after_request hooks (compression) and streamed bodies.
+ProfileStore keeps the most recent profiles as files in one directory.
+Nothing here runs unless App.py enables it (PROFILE_TOKEN set, plus
+PROFILE_SAMPLE_HZ > 0), so a disabled profiler costs nothing.
+"""
+import cProfile
+import hmac
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+MODE_SAMPLE = "sample"
+MODE_CPROFILE = "cprofile"
+EXTENSIONS = {MODE_SAMPLE: ".folded", MODE_CPROFILE: ".prof"}
+
+# Innermost frames of a thread that is parked waiting for work
+_IDLE_LEAVES = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("queue.py", "get"),
+    ("selectors.py", "select"), ("socket.py", "accept"), ("socketserver.py", "serve_forever"),
+}
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Counts folded stacks of all threads, sampled every `interval` seconds while running."""
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 128, max_stacks: int = 20000):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        # Sampled even while blocked, e.g. the request thread waiting on its workers
+        self.keep_idle_thread: Optional[int] = None
+        self.samples = 0
+        self.dropped = 0
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, keep_idle_thread: Optional[int] = None) -> "StackSampler":
+        self.keep_idle_thread = keep_idle_thread
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Dict[str, int]:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.snapshot()
+
+    def snapshot(self, reset: bool = False) -> Dict[str, int]:
+        with self._lock:
+            counts = dict(self._counts)
+            if reset:
+                self._counts.clear()
+        return counts
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.sample(skip=own)
+
+    def sample(self, skip: Optional[int] = None):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == skip:
+                continue
+            leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+            if leaf in _IDLE_LEAVES and ident != self.keep_idle_thread:
+                continue
+            frames = []
+            while frame is not None and len(frames) < self.max_depth:
+                frames.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            frames.append(names.get(ident, f"thread-{ident}"))
+            stacks.append(";".join(reversed(frames)))
+        with self._lock:
+            self.samples += 1
+            for stack in stacks:
+                if stack in self._counts or len(self._counts) < self.max_stacks:
+                    self._counts[stack] += 1
+                else:
+                    self.dropped += 1
+
+
+def folded(counts: Dict[str, int]) -> str:
+    """Folded-stack text, hottest stacks first."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items(), key=lambda item: -item[1]))
+
+
+class RequestProfile:
+    """Profiles one request: start() before it runs, finish() once its response is closed."""
+
+    def __init__(self, mode: str = MODE_SAMPLE, interval: float = 0.005):
+        self.mode = mode if mode in EXTENSIONS else MODE_SAMPLE
+        self.interval = interval
+        self._sampler: Optional[StackSampler] = None
+        self._profile: Optional[cProfile.Profile] = None
+
+    def start(self) -> "RequestProfile":
+        if self.mode == MODE_CPROFILE:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = StackSampler(self.interval).start(keep_idle_thread=threading.get_ident())
+        return self
+
+    def finish(self, store: "ProfileStore", profile_id: str):
+        """Stop profiling and store the result under `profile_id` (from store.new_id)."""
+        if self._profile is not None:
+            self._profile.disable()
+            store.save_pstats(profile_id, self._profile)
+        else:
+            store.save_folded(profile_id, self._sampler.stop())
+
+
+class ProfileStore:
+    """The `keep` most recent profiles, one file each, named <time>-<label>-<id>.<ext>."""
+
+    def __init__(self, root_dir: str, keep: int = 50):
+        self.root_dir = root_dir
+        self.keep = keep
+        self._lock = threading.Lock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    def new_id(self, label: str) -> str:
+        label = re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_")[:60] or "request"
+        return f"{time.strftime('%Y%m%dT%H%M%S')}-{label}-{uuid.uuid4().hex[:8]}"
+
+    def save_folded(self, profile_id: str, counts: Dict[str, int]):
+        with open(os.path.join(self.root_dir, profile_id + EXTENSIONS[MODE_SAMPLE]), "w", encoding="utf-8") as f:
+            f.write(folded(counts))
+        self._prune()
+
+    def save_pstats(self, profile_id: str, profile: cProfile.Profile):
+        profile.dump_stats(os.path.join(self.root_dir, profile_id + EXTENSIONS[MODE_CPROFILE]))
+        self._prune()
+
+    def path(self, profile_id: str) -> Optional[str]:
+        """File of a stored profile, or None (ids are never treated as paths)."""
+        for entry in self._entries():
+            if os.path.splitext(entry.name)[0] == profile_id:
+                return entry.path
+        return None
+
+    def _entries(self) -> List[os.DirEntry]:
+        with os.scandir(self.root_dir) as it:
+            entries = [e for e in it if e.is_file() and os.path.splitext(e.name)[1] in EXTENSIONS.values()]
+        return sorted(entries, key=lambda e: e.stat().st_mtime, reverse=True)
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [{"id": os.path.splitext(e.name)[0],
+                 "format": "folded" if e.name.endswith(EXTENSIONS[MODE_SAMPLE]) else "pstats",
+                 "bytes": e.stat().st_size} for e in self._entries()]
+
+    def _prune(self):
+        with self._lock:
+            for entry in self._entries()[self.keep:]:
+                try:
+                    os.remove(entry.path)
+                except OSError as e:
+                    logger.warning(f"Could not remove old profile {entry.name}: {e}")
+
+
+def token_matches(given: Optional[str], token: str) -> bool:
+    return bool(token) and hmac.compare_digest((given or "").encode(), token.encode())
+
+
+class ProfilingMiddleware:
+    """
+    WSGI middleware: a request with "X-Profile: sample|cprofile" (or
+    ?profile=...) and the admin token in X-Profile-Token (or ?profile_token=)
+    is profiled until its response is closed. The id of the stored profile is
+    returned in X-Profile-Id. Other requests pass straight through.
+    """
+
+    def __init__(self, app, store: ProfileStore, token: str, interval: float = 0.005):
+        self.app = app
+        self.store = store
+        self.token = token
+        self.interval = interval
+
+    def _requested_mode(self, environ) -> Optional[str]:
+        query = parse_qs(environ.get("QUERY_STRING", "")) if "profile" in environ.get("QUERY_STRING", "") else {}
+        mode = environ.get("HTTP_X_PROFILE") or (query.get("profile") or [None])[0]
+        if not mode:
+            return None
+        given = environ.get("HTTP_X_PROFILE_TOKEN") or (query.get("profile_token") or [None])[0]
+        if not token_matches(given, self.token):
+            return None
+        mode = mode.lower()
+        return mode if mode in EXTENSIONS else MODE_SAMPLE
+
+    def __call__(self, environ, start_response):
+        mode = self._requested_mode(environ)
+        if mode is None:
+            return self.app(environ, start_response)
+
+        profile_id = self.store.new_id(environ.get("PATH_INFO", ""))
+        profile = RequestProfile(mode, self.interval).start()
+
+        def start_profiled_response(status, headers, exc_info=None):
+            return start_response(status, list(headers) + [("X-Profile-Id", profile_id)], exc_info)
+
+        try:
+            result = self.app(environ, start_profiled_response)
+        except Exception:
+            profile.finish(self.store, profile_id)
+            raise
+        return self._close_after(result, lambda: profile.finish(self.store, profile_id))
+
+    @staticmethod
+    def _close_after(result, callback):
+        try:
+            yield from result
+        finally:
+            try:
+                if hasattr(result, "close"):
+                    result.close()
+            finally:
+                callback()
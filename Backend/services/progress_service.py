@@ -0,0 +1,199 @@
+"""
+Per-user quiz progress, maintained incrementally (MongoDB).
+
+One document per (user, topic) plus one per user across all topics
+(topic "_all"), in `user_progress`, keyed by "<user_id>|<topic>". Each
+submitted attempt updates them atomically with $inc (attempts, questions,
+correct, score total), $max (best score) and $push/$slice (a window of
+recent scores), in one bulk_write. Reading progress is a lookup by user_id
+on an index, never a scan of user_history.
+
+rebuild() recomputes the documents from user_history, e.g. after changing
+how progress is computed or restoring history from a backup:
+
+    cd Backend
+    MONGO_URI=mongodb://localhost:27017 python -m services.progress_service rebuild [--user USER_ID]
+"""
+import argparse
+import datetime
+import logging
+import os
+from typing import Any, Dict, Iterable, Optional
+
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+ALL_TOPICS = "_all"
+RECENT_WINDOW = 10
+
+
+def ensure_indexes(db):
+    db.user_progress.create_index([("user_id", ASCENDING)], name="user")
+
+
+def _key(user_id, topic):
+    return f"{user_id}|{topic}"
+
+
+def _update(user_id, topic, questions, correct, now):
+    score = round(correct / questions * 100, 1)
+    return UpdateOne(
+        {"_id": _key(user_id, topic)},
+        {
+            "$inc": {"attempts": 1, "questions": questions, "correct": correct, "score_total": score},
+            "$max": {"best_score": score},
+            "$push": {"recent_scores": {"$each": [score], "$slice": -RECENT_WINDOW}},
+            "$set": {"updated_at": now},
+            "$setOnInsert": {"user_id": user_id, "topic": topic},
+        },
+        upsert=True,
+    )
+
+
+def record_attempt(db, user_id, results: Iterable[Dict[str, Any]]):
+    """
+    Fold one graded attempt into the user's aggregates. `results` are
+    per-question {"is_correct", "topic"} entries as returned by
+    quiz_service.submit_attempt (entries with "error" are ignored).
+    """
+    if not user_id or user_id == 'guest':
+        return
+    per_topic: Dict[Optional[str], list] = {}
+    for result in results:
+        if "error" in result:
+            continue
+        counts = per_topic.setdefault(result.get("topic"), [0, 0])
+        counts[0] += 1
+        counts[1] += 1 if result.get("is_correct") else 0
+    if not per_topic:
+        return
+    now = datetime.datetime.utcnow()
+    total = sum(n for n, _ in per_topic.values())
+    correct = sum(c for _, c in per_topic.values())
+    operations = [_update(user_id, ALL_TOPICS, total, correct, now)]
+    operations += [_update(user_id, topic, n, c, now) for topic, (n, c) in per_topic.items() if topic]
+    db.user_progress.bulk_write(operations, ordered=False)
+
+
+def trend(recent_scores):
+    """beginner (under 3 attempts), improving, declining or steady, from the recent window."""
+    if len(recent_scores) < 3:
+        return "beginner"
+    half = len(recent_scores) // 2
+    earlier = sum(recent_scores[:half]) / half
+    later = sum(recent_scores[-half:]) / half
+    if later - earlier >= 5:
+        return "improving"
+    if earlier - later >= 5:
+        return "declining"
+    return "steady"
+
+
+def _summary(doc):
+    attempts = doc.get("attempts", 0)
+    recent = doc.get("recent_scores", [])
+    return {
+        "attempts": attempts,
+        "questions": doc.get("questions", 0),
+        "correct": doc.get("correct", 0),
+        "best_score": doc.get("best_score", 0),
+        "average_score": round(doc.get("score_total", 0) / attempts, 1) if attempts else 0,
+        "recent_scores": recent,
+        "trend": trend(recent),
+    }
+
+
+def get_progress(db, user_id) -> Dict[str, Any]:
+    """Overall and per-topic progress of a user (one indexed query)."""
+    docs = {doc["topic"]: doc for doc in db.user_progress.find({"user_id": user_id})}
+    overall = _summary(docs.pop(ALL_TOPICS, {}))
+    return {
+        "user_id": user_id,
+        "total_quizzes_taken": overall["attempts"],
+        "quizzes_completed": overall["attempts"],
+        "average_score": overall["average_score"],
+        "best_score": overall["best_score"],
+        "improvement_trend": overall["trend"],
+        "overall": overall,
+        "topics": {topic: _summary(doc) for topic, doc in sorted(docs.items())},
+    }
+
+
+def rebuild(db, user_id=None, batch_size=1000) -> int:
+    """
+    Recompute progress from user_history (all users, or one). Answers saved
+    together share an attempt_id; older answers without one count as
+    single-question attempts. Returns the number of documents written.
+    """
+    match = {"user_id": user_id} if user_id else {"user_id": {"$nin": [None, "guest"]}}
+    pipeline = [
+        {"$match": match},
+        # History written before topics were stored on it: take the question's topic
+        {"$lookup": {"from": "questions", "localField": "question_id", "foreignField": "_id", "as": "question"}},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "attempt": {"$ifNull": ["$attempt_id", "$_id"]},
+                "topic": {"$ifNull": ["$topic", {"$arrayElemAt": ["$question.topic", 0]}]},
+            },
+            "questions": {"$sum": 1},
+            "correct": {"$sum": {"$cond": ["$is_correct", 1, 0]}},
+            "attempted_at": {"$min": "$attempted_at"},
+        }},
+        {"$sort": {"attempted_at": 1}},
+    ]
+    docs: Dict[str, Dict[str, Any]] = {}
+    overall: Dict[tuple, list] = {}
+
+    def fold(user, topic, questions, correct, at):
+        score = round(correct / questions * 100, 1)
+        doc = docs.setdefault(_key(user, topic), {
+            "_id": _key(user, topic), "user_id": user, "topic": topic, "attempts": 0, "questions": 0,
+            "correct": 0, "score_total": 0, "best_score": 0, "recent_scores": [], "updated_at": at,
+        })
+        doc["attempts"] += 1
+        doc["questions"] += questions
+        doc["correct"] += correct
+        doc["score_total"] += score
+        doc["best_score"] = max(doc["best_score"], score)
+        doc["recent_scores"] = (doc["recent_scores"] + [score])[-RECENT_WINDOW:]
+        doc["updated_at"] = at or doc["updated_at"]
+
+    for row in db.user_history.aggregate(pipeline, allowDiskUse=True):
+        key = row["_id"]
+        if key["topic"]:
+            fold(key["user_id"], key["topic"], row["questions"], row["correct"], row["attempted_at"])
+        attempt = overall.setdefault((key["user_id"], key["attempt"]), [0, 0, row["attempted_at"]])
+        attempt[0] += row["questions"]
+        attempt[1] += row["correct"]
+    attempts_in_order = sorted(overall.items(), key=lambda item: item[1][2] or datetime.datetime.min)
+    for (user, _), (questions, correct, at) in attempts_in_order:
+        fold(user, ALL_TOPICS, questions, correct, at)
+
+    db.user_progress.delete_many({"user_id": user_id} if user_id else {})
+    operations = [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs.values()]
+    for start in range(0, len(operations), batch_size):
+        db.user_progress.bulk_write(operations[start:start + batch_size], ordered=False)
+    logger.info(f"Rebuilt {len(operations)} progress documents")
+    return len(operations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quiz progress maintenance")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--user", help="only rebuild this user's progress")
+    args = parser.parse_args()
+    uri = os.getenv("MONGO_URI")
+    if not uri:
+        parser.error("MONGO_URI is not set")
+
+    from pymongo import MongoClient
+    db = MongoClient(uri)[os.getenv("MONGO_DB", "notelooms")]
+    ensure_indexes(db)
+    print(f"Rebuilt {rebuild(db, args.user)} progress documents")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,111 @@
+"""
+Token-budgeted prompt assembly.
+
+Candidate sections (RAG chunks, uploaded-content sections, history turns) are
+scored, then packed greedily by score until the token budget is spent. The
+lowest-ranked section that only partly fits is trimmed at a word boundary.
+Token counts are estimated (~4 characters per token), which is close enough
+for Gemini budgeting without a tokenizer dependency.
+"""
+import math
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+CHARS_PER_TOKEN = 4
+
+_STOPWORDS = {
+    "the", "and", "for", "are", "but", "not", "you", "all", "any", "can", "had", "her",
+    "was", "one", "our", "out", "has", "have", "his", "how", "its", "may", "who", "what",
+    "when", "where", "which", "why", "with", "this", "that", "from", "they", "will",
+    "would", "there", "their", "been", "were", "does", "did", "about", "into", "than",
+    "then", "them", "these", "those", "some", "such", "also", "just", "more", "most",
+    "please", "explain", "tell",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate for budgeting."""
+    if not text:
+        return 0
+    return int(math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def terms(text: str) -> Set[str]:
+    """Lower-cased content words used for lexical relevance."""
+    return {
+        word for word in re.findall(r"[a-z0-9]+", (text or "").lower())
+        if len(word) > 2 and word not in _STOPWORDS
+    }
+
+
+def relevance(query_terms: Set[str], text: str) -> float:
+    """Fraction of query terms present in `text` (0..1)."""
+    if not query_terms or not text:
+        return 0.0
+    return len(query_terms & terms(text)) / len(query_terms)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Trim text to roughly `max_tokens`, cutting at a word boundary."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    space = cut.rfind(" ")
+    if space > max_chars * 0.6:
+        cut = cut[:space]
+    return cut.rstrip() + "…"
+
+
+class PromptPacker:
+    """
+    Greedy packer for scored prompt sections.
+
+        packer = PromptPacker(budget_tokens=1500)
+        packer.add("rag", chunk_text, score=0.9, label="Page 4")
+        packed = packer.pack()   # {"rag": [("Page 4", "...")], ...}
+
+    Within a group, packed sections keep the order in which they were added,
+    so callers can add history oldest-first and get it back in that order.
+    """
+
+    def __init__(self, budget_tokens: int, min_section_tokens: int = 24):
+        self.budget_tokens = max(0, budget_tokens)
+        self.min_section_tokens = min_section_tokens
+        self.used_tokens = 0
+        self._candidates: List[Tuple[float, int, str, Optional[str], str, Optional[int]]] = []
+
+    def reserve(self, text: str) -> int:
+        """Account for text that is always included (instructions, user message)."""
+        tokens = estimate_tokens(text)
+        self.used_tokens += tokens
+        return tokens
+
+    def add(self, group: str, text: str, score: float, label: Optional[str] = None,
+            max_tokens: Optional[int] = None):
+        """Offer a section for packing. Empty text is ignored."""
+        if not isinstance(text, str) or not text.strip():
+            return
+        self._candidates.append((score, len(self._candidates), group, label, text.strip(), max_tokens))
+
+    def pack(self) -> Dict[str, List[Tuple[Optional[str], str]]]:
+        """Select sections by descending score until the budget is exhausted."""
+        remaining = self.budget_tokens - self.used_tokens
+        chosen = []
+        for score, order, group, label, text, max_tokens in sorted(
+            self._candidates, key=lambda c: (-c[0], c[1])
+        ):
+            if remaining < self.min_section_tokens:
+                break
+            limit = remaining if max_tokens is None else min(max_tokens, remaining)
+            packed_text = truncate_to_tokens(text, limit)
+            cost = estimate_tokens(packed_text)
+            remaining -= cost
+            self.used_tokens += cost
+            chosen.append((order, group, label, packed_text))
+
+        packed: Dict[str, List[Tuple[Optional[str], str]]] = OrderedDict()
+        for order, group, label, packed_text in sorted(chosen):
+            packed.setdefault(group, []).append((label, packed_text))
+        return packed
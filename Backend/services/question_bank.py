@@ -0,0 +1,194 @@
+"""
+Sharded MCQ generation with near-duplicate removal.
+
+Instead of one long Gemini call for the whole pool over the first pages, the
+document is split into sections spread over its full length and each
+section gets a small request of its own; the requests run concurrently, so
+the pool arrives in roughly the time of the slowest small call. The merged
+questions are taken round-robin across sections (an even spread, and every
+section contributes before any contributes twice) and a question is dropped
+when it is too similar to one already kept: cosine similarity of question
+embeddings when an embedding function is available (the RAG MiniLM model),
+word-set Jaccard similarity otherwise.
+"""
+import concurrent.futures
+import contextvars
+import logging
+import math
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from services.prompt_packer import terms
+
+logger = logging.getLogger(__name__)
+
+
+def split_sections(text: str, max_sections: int, section_chars: int) -> List[str]:
+    """
+    Up to `max_sections` sections of at most `section_chars` characters,
+    evenly spaced over the whole text and cut at paragraph or sentence ends.
+    """
+    text = (text or "").strip()
+    if not text:
+        return []
+    count = max(1, min(max_sections, math.ceil(len(text) / section_chars)))
+    span = len(text) / count
+    sections = []
+    for i in range(count):
+        start = int(i * span)
+        if i:
+            # Start at the next paragraph/sentence boundary rather than mid-word
+            lookback = max(0, start - 200)
+            boundary = max(text.rfind("\n", lookback, start), text.rfind(". ", lookback, start))
+            if boundary != -1:
+                start = boundary + 1
+        end = min(len(text), start + section_chars, int((i + 1) * span) if i < count - 1 else len(text))
+        if end < len(text):
+            boundary = max(text.rfind("\n", start, end), text.rfind(". ", start, end))
+            if boundary > start + section_chars // 2:
+                end = boundary + 1
+        section = text[start:end].strip()
+        if section:
+            sections.append(section)
+    return sections
+
+
+def _normalized(question: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", question.lower()).strip()
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def interleave(groups: Sequence[Sequence[Any]]) -> List[Any]:
+    """Round-robin merge: first item of every group, then the second, ..."""
+    merged = []
+    for i in range(max((len(g) for g in groups), default=0)):
+        merged.extend(g[i] for g in groups if i < len(g))
+    return merged
+
+
+def dedupe_questions(questions: List[Dict[str, Any]], limit: int,
+                     embed_fn: Optional[Callable[[List[str]], List[List[float]]]] = None,
+                     similarity_threshold: float = 0.88, jaccard_threshold: float = 0.6):
+    """
+    Keep questions in order, skipping near-duplicates of ones already kept,
+    until `limit` are kept. Returns (kept, method, removed): method is
+    "embedding" or "jaccard" (the fallback when embedding is unavailable) and
+    removed the number of duplicates skipped.
+    """
+    vectors = None
+    if embed_fn is not None and questions:
+        try:
+            vectors = np.asarray(embed_fn([q["question"] for q in questions]), dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+        except Exception as e:
+            logger.warning(f"Question embedding failed, falling back to word overlap: {e}")
+            vectors = None
+
+    kept, kept_vectors, kept_terms, seen = [], [], [], set()
+    removed = 0
+    for i, question in enumerate(questions):
+        if len(kept) >= limit:
+            break
+        key = _normalized(question["question"])
+        if key in seen:
+            removed += 1
+            continue
+        if vectors is not None:
+            if kept_vectors and float(np.max(np.stack(kept_vectors) @ vectors[i])) >= similarity_threshold:
+                removed += 1
+                continue
+            kept_vectors.append(vectors[i])
+        else:
+            words = terms(question["question"])
+            if any(jaccard(words, other) >= jaccard_threshold for other in kept_terms):
+                removed += 1
+                continue
+            kept_terms.append(words)
+        seen.add(key)
+        kept.append(question)
+    return kept, ("embedding" if vectors is not None else "jaccard"), removed
+
+
+class ShardedQuestionGenerator:
+    """
+    generate(text, num_questions) -> list of MCQ dicts, or a single
+    [{"error": ...}] entry when no section produced any question.
+
+    `generate_fn(section_text, n)` is the per-section generator (returning MCQ
+    dicts and/or {"error"} entries); `embed_fn(texts)` is optional.
+    """
+
+    def __init__(self, generate_fn: Callable[[str, int], List[Dict[str, Any]]],
+                 embed_fn: Optional[Callable[[List[str]], List[List[float]]]] = None,
+                 max_sections: int = 6, section_chars: int = 3000, oversample: float = 1.3,
+                 min_per_section: int = 3, similarity_threshold: float = 0.88, max_workers: int = 4):
+        self.generate_fn = generate_fn
+        self.embed_fn = embed_fn
+        self.max_sections = max(1, max_sections)
+        self.section_chars = max(500, section_chars)
+        self.oversample = max(1.0, oversample)
+        self.min_per_section = max(1, min_per_section)
+        self.similarity_threshold = similarity_threshold
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix="mcq-shard"
+        )
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "sections": 0, "section_failures": 0, "generated": 0,
+                       "duplicates_removed": 0, "dedupe": {}}
+
+    def _generate_section(self, section: str, count: int) -> List[Dict[str, Any]]:
+        try:
+            items = self.generate_fn(section, count)
+        except Exception as e:
+            return [{"error": str(e)}]
+        return items if isinstance(items, list) else []
+
+    def generate(self, text: str, num_questions: int) -> List[Dict[str, Any]]:
+        # Small pools use fewer sections rather than many tiny requests
+        max_sections = min(self.max_sections, max(1, num_questions // self.min_per_section))
+        sections = split_sections(text, max_sections, self.section_chars)
+        if not sections:
+            return [{"error": "No content to generate MCQs from."}]
+        per_section = max(self.min_per_section, math.ceil(num_questions * self.oversample / len(sections)))
+
+        # Each task runs in a copy of the caller's context (keeps e.g. its rate-limit priority)
+        futures = [
+            self._executor.submit(contextvars.copy_context().run, self._generate_section, section, per_section)
+            for section in sections
+        ]
+        groups, errors = [], []
+        for future in futures:
+            items = future.result()
+            valid = [q for q in items if isinstance(q, dict) and "error" not in q and q.get("question")]
+            errors.extend(q["error"] for q in items if isinstance(q, dict) and "error" in q)
+            groups.append(valid)
+
+        merged = interleave(groups)
+        kept, method, removed = dedupe_questions(merged, num_questions, self.embed_fn, self.similarity_threshold)
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["sections"] += len(sections)
+            self._stats["section_failures"] += sum(1 for g in groups if not g)
+            self._stats["generated"] += len(merged)
+            self._stats["duplicates_removed"] += removed
+            self._stats["dedupe"][method] = self._stats["dedupe"].get(method, 0) + 1
+        logger.info(f"✓ {len(kept)} MCQs from {len(sections)} sections "
+                    f"({len(merged)} generated, {removed} duplicates removed by {method})")
+
+        if not kept:
+            return [{"error": errors[0] if errors else "No valid MCQs could be generated from the AI response."}]
+        return kept
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, dedupe=dict(self._stats["dedupe"]), max_sections=self.max_sections,
+                        section_chars=self.section_chars)
@@ -1,18 +1,114 @@
-from pymongo import MongoClient
+"""
+Question bank queries for quizzes (MongoDB).
+
+Questions are read through the compound index (topic, difficulty, _id):
+browsing pages through a topic with an _id cursor (no skip(), so a page deep
+in the bank costs the same as the first), and quizzes draw a random set with
+$sample, leaving out questions the user has already attempted. Only the
+fields a quiz needs are returned; the correct answer stays on the server,
+which grades submitted attempts itself (submit_attempt).
+
+Call ensure_indexes(db) once at startup; it is idempotent.
+"""
 import datetime
+import logging
+import uuid
+
+from bson import ObjectId
+from pymongo import ASCENDING
+
+logger = logging.getLogger(__name__)
+
+# What a client sees of a question (never correct_answer / explanation)
+QUESTION_PROJECTION = {"question": 1, "options": 1, "topic": 1, "difficulty": 1}
+
+MAX_PAGE_SIZE = 100
+MAX_SAMPLE_SIZE = 50
+
+
+def ensure_indexes(db):
+    """Create the indexes the quiz queries rely on."""
+    db.questions.create_index(
+        [("topic", ASCENDING), ("difficulty", ASCENDING), ("_id", ASCENDING)],
+        name="topic_difficulty_id",
+    )
+    db.user_history.create_index(
+        [("user_id", ASCENDING), ("question_id", ASCENDING)],
+        name="user_question",
+    )
+
 
-def fetch_questions(db, topic, difficulty, user_id):
+def _object_id(value):
+    """ObjectId for a 24-hex string id, else the value unchanged (string ids)."""
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+
+def _serialize(question):
+    question['_id'] = str(question['_id'])  # Convert ObjectId to string for JSON serialization
+    return question
+
+
+def attempted_question_ids(db, user_id):
+    """Ids of every question the user has answered (none for guests)."""
+    if not user_id or user_id == 'guest':
+        return []
+    ids = db.user_history.distinct("question_id", {"user_id": user_id})
+    return [_object_id(question_id) for question_id in ids]
+
+
+def list_questions(db, topic, difficulty, limit=20, cursor=None):
+    """
+    One page of questions in _id order. Returns (questions, next_cursor);
+    pass next_cursor back to get the following page (None on the last page).
+    """
     try:
-        questions = list(db.questions.find({
-            "topic": topic,
-            "difficulty": difficulty
-        }).limit(10))  # Limit to 10 questions for now
-        for q in questions:
-            q['_id'] = str(q['_id'])  # Convert ObjectId to string for JSON serialization
-        return questions
+        limit = min(max(1, int(limit)), MAX_PAGE_SIZE)
+        query = {"topic": topic, "difficulty": difficulty}
+        if cursor:
+            query["_id"] = {"$gt": _object_id(cursor)}
+        questions = list(
+            db.questions.find(query, QUESTION_PROJECTION).sort("_id", ASCENDING).limit(limit + 1)
+        )
+        next_cursor = str(questions[limit - 1]["_id"]) if len(questions) > limit else None
+        return [_serialize(q) for q in questions[:limit]], next_cursor
+    except Exception as e:
+        raise Exception(f"Failed to list questions: {str(e)}")
+
+
+def sample_questions(db, topic, difficulty, user_id, size=10):
+    """
+    `size` random questions the user has not attempted yet. When fewer than
+    `size` unattempted questions remain, the rest are drawn from attempted ones.
+    """
+    try:
+        size = min(max(1, int(size)), MAX_SAMPLE_SIZE)
+        match = {"topic": topic, "difficulty": difficulty}
+        attempted = attempted_question_ids(db, user_id)
+        fresh_match = dict(match, _id={"$nin": attempted}) if attempted else match
+        questions = list(db.questions.aggregate([
+            {"$match": fresh_match},
+            {"$sample": {"size": size}},
+            {"$project": QUESTION_PROJECTION},
+        ]))
+        if len(questions) < size and attempted:
+            seen = [q["_id"] for q in questions]
+            questions += list(db.questions.aggregate([
+                {"$match": dict(match, _id={"$nin": seen})},
+                {"$sample": {"size": size - len(questions)}},
+                {"$project": QUESTION_PROJECTION},
+            ]))
+        return [_serialize(q) for q in questions]
     except Exception as e:
         raise Exception(f"Failed to fetch questions: {str(e)}")
 
+
+def fetch_questions(db, topic, difficulty, user_id, size=10):
+    """Questions for a quiz: a random, preferably unseen, set without answers."""
+    return sample_questions(db, topic, difficulty, user_id, size)
+
+
 def save_question(db, question_data):
     try:
         result = db.questions.insert_one(question_data)
@@ -20,19 +116,81 @@ def save_question(db, question_data):
     except Exception as e:
         raise Exception(f"Failed to save question: {str(e)}")
 
+
+def save_questions(db, questions):
+    """Insert many questions with one unordered insert_many; returns their ids."""
+    try:
+        result = db.questions.insert_many(questions, ordered=False)
+        return [str(question_id) for question_id in result.inserted_ids]
+    except Exception as e:
+        raise Exception(f"Failed to save questions: {str(e)}")
+
+
+def submit_attempt(db, user_id, answers):
+    """
+    Grade a whole quiz attempt on the server and record it.
+
+    `answers` is a list of {"question_id", "selected_option"}. The referenced
+    questions are fetched with one $in query and graded in memory; history
+    is written with one unordered insert_many. Returns {"results": [...] in
+    answer order, "correct", "total", "score"}; answers to unknown questions
+    are reported with "error" and not counted.
+    """
+    try:
+        question_ids = list({_object_id(a.get("question_id")) for a in answers if a.get("question_id")})
+        questions = {
+            q["_id"]: q for q in db.questions.find(
+                {"_id": {"$in": question_ids}}, {"correct_answer": 1, "topic": 1, "difficulty": 1}
+            )
+        }
+        attempted_at = datetime.datetime.utcnow()
+        attempt_id = uuid.uuid4().hex
+        results, history = [], []
+        for answer in answers:
+            question_id = _object_id(answer.get("question_id"))
+            question = questions.get(question_id)
+            if question is None:
+                results.append({"question_id": str(question_id), "error": "Question not found"})
+                continue
+            selected = answer.get("selected_option")
+            is_correct = selected == question["correct_answer"]
+            results.append({
+                "question_id": str(question_id),
+                "is_correct": is_correct,
+                "correct_answer": question["correct_answer"],
+                "topic": question.get("topic"),
+            })
+            history.append({
+                "user_id": user_id,
+                "attempt_id": attempt_id,
+                "question_id": question_id,
+                "topic": question.get("topic"),
+                "difficulty": question.get("difficulty"),
+                "selected_option": selected,
+                "is_correct": is_correct,
+                "attempted_at": attempted_at,
+            })
+        if history:
+            db.user_history.insert_many(history, ordered=False)
+
+        total = len(history)
+        correct = sum(1 for h in history if h["is_correct"])
+        return {
+            "results": results,
+            "correct": correct,
+            "total": total,
+            "score": round(correct / total * 100, 1) if total else 0,
+        }
+    except Exception as e:
+        raise Exception(f"Failed to save quiz attempt: {str(e)}")
+
+
 def save_user_answer(db, user_id, question_id, selected_option):
+    """Grade and record a single answer (see submit_attempt for whole quizzes)."""
     try:
-        question = db.questions.find_one({"_id": question_id})
-        if not question:
+        result = submit_attempt(db, user_id, [{"question_id": question_id, "selected_option": selected_option}])
+        if "error" in result["results"][0]:
             raise Exception("Question not found")
-        is_correct = selected_option == question['correct_answer']
-        db.user_history.insert_one({
-            "user_id": user_id,
-            "question_id": question_id,
-            "selected_option": selected_option,
-            "is_correct": is_correct,
-            "attempted_at": datetime.datetime.utcnow()
-        })
-        return is_correct
+        return result["results"][0]["is_correct"]
     except Exception as e:
-        raise Exception(f"Failed to save user answer: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Failed to save user answer: {str(e)}")
@@ -0,0 +1,336 @@
+"""
+Token-bucket rate limiting and concurrency governance for Gemini calls.
+
+Bucket state lives in a small SQLite database so every gunicorn worker draws
+from the same per-key budget. Inside a process, callers queue per bucket and
+are served in priority order (interactive chat before bulk generation), with
+a cap on in-flight calls. 429 replies block the bucket for the server-advised
+retry delay so all workers back off together, then retry with jitter.
+"""
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Lower value = served first
+PRIORITY_CHAT = 0
+PRIORITY_BULK = 1
+PRIORITY_PREFETCH = 2  # Speculative background work, served after everything else
+
+# Upper bounds (seconds) for the queue-wait histogram
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+
+# A context variable rather than a thread-local, so work handed to other
+# threads with contextvars.copy_context() keeps its caller's priority
+_scope: contextvars.ContextVar = contextvars.ContextVar("llm_priority", default=None)
+
+
+@contextmanager
+def priority_scope(priority: int):
+    """Run calls made in this context without an explicit priority at `priority`."""
+    token = _scope.set(priority)
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def scoped_priority(default: int = PRIORITY_BULK) -> int:
+    """The priority set by an enclosing priority_scope(), else `default`."""
+    priority = _scope.get()
+    return default if priority is None else priority
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a caller could not get a slot within its queue timeout."""
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Best-effort detection of quota / 429 errors from the Gemini SDK."""
+    text = str(error)
+    return (
+        "429" in text
+        or "ResourceExhausted" in type(error).__name__
+        or "quota" in text.lower()
+    )
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Extract the server-advised retry delay from a 429 error, if any."""
+    value = getattr(error, "retry_after", None)
+    if value:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            pass
+
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if headers.get("Retry-After"):
+        try:
+            return float(headers["Retry-After"])
+        except (TypeError, ValueError):
+            pass
+
+    text = str(error)
+    for pattern in (
+        r"retry in ([\d.]+)\s*s",
+        r"retry_delay\s*\{\s*seconds:\s*(\d+)",
+        r"retry[- ]after[:\s]+([\d.]+)",
+    ):
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class _Bucket:
+    """Static budget for one API key plus in-process queue state."""
+
+    def __init__(self, name: str, requests_per_minute: float, burst: int, max_concurrency: int):
+        self.name = name
+        self.rate = max(requests_per_minute, 0.001) / 60.0  # tokens per second
+        self.capacity = max(1, burst)
+        self.max_concurrency = max(1, max_concurrency)
+        self.waiters = []  # heap of (priority, seq)
+        self.in_flight = 0
+        self.taking = False  # the head waiter is taking a token from SQLite
+        self.stats = {
+            "acquired": 0,
+            "timeouts": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "wait_histogram": [0] * (len(WAIT_BUCKETS) + 1),
+        }
+
+
+class TokenBucketLimiter:
+    """
+    Cross-worker token bucket with a per-process priority queue.
+
+    Usage:
+        limiter.register("gemini", requests_per_minute=20, burst=5)
+        limiter.call("gemini", lambda: model.generate_content(prompt), priority=PRIORITY_BULK)
+    """
+
+    def __init__(self, db_path: str, queue_timeout: float = 60.0, max_retries: int = 2):
+        self.db_path = db_path
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self._cond = threading.Condition(threading.Lock())
+        self._buckets: Dict[str, _Bucket] = {}
+        self._seq = itertools.count()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " name TEXT PRIMARY KEY,"
+                " tokens REAL NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " blocked_until REAL NOT NULL DEFAULT 0)"
+            )
+
+    def register(self, name: str, requests_per_minute: float, burst: int = 5, max_concurrency: int = 4):
+        """Declare the budget for a key. Re-registering replaces the budget."""
+        with self._cond:
+            self._buckets[name] = _Bucket(name, requests_per_minute, burst, max_concurrency)
+
+    @contextmanager
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        yield conn
+
+    def _try_take(self, bucket: _Bucket) -> float:
+        """Take one token if available. Returns 0 on success, else seconds to wait."""
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT tokens, updated_at, blocked_until FROM buckets WHERE name = ?",
+                    (bucket.name,),
+                ).fetchone()
+                if row is None:
+                    tokens, blocked_until = float(bucket.capacity), 0.0
+                else:
+                    tokens = min(bucket.capacity, row[0] + max(0.0, now - row[1]) * bucket.rate)
+                    blocked_until = row[2]
+
+                if now < blocked_until:
+                    wait = blocked_until - now
+                elif tokens >= 1.0:
+                    tokens -= 1.0
+                    wait = 0.0
+                else:
+                    wait = (1.0 - tokens) / bucket.rate
+
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets (name, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?)",
+                    (bucket.name, tokens, now, blocked_until),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def penalize(self, name: str, seconds: float):
+        """Block a bucket for every worker, e.g. after a 429 with retry-after."""
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO buckets (name, tokens, updated_at, blocked_until) VALUES (?, 0, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET tokens = 0, updated_at = excluded.updated_at, "
+                    "blocked_until = MAX(blocked_until, excluded.blocked_until)",
+                    (name, now, now + seconds),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    @contextmanager
+    def slot(self, name: str, priority: int = PRIORITY_BULK, timeout: Optional[float] = None):
+        """Wait for a token and a concurrency slot, releasing the slot on exit."""
+        bucket = self._buckets.get(name)
+        if bucket is None:
+            raise KeyError(f"Unknown rate limit bucket: {name}")
+
+        timeout = self.queue_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        entry = (priority, next(self._seq))
+
+        with self._cond:
+            heapq.heappush(bucket.waiters, entry)
+            try:
+                while True:
+                    wait = None
+                    if (bucket.waiters[0] == entry and not bucket.taking
+                            and bucket.in_flight < bucket.max_concurrency):
+                        # The SQLite take can wait on another worker's write lock:
+                        # do it without holding the condition other buckets use
+                        bucket.taking = True
+                        self._cond.release()
+                        try:
+                            wait = self._try_take(bucket)
+                        finally:
+                            self._cond.acquire()
+                            bucket.taking = False
+                        if wait <= 0:
+                            self._remove_waiter(bucket, entry)
+                            bucket.in_flight += 1
+                            break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        bucket.stats["timeouts"] += 1
+                        raise RateLimitTimeout(
+                            f"Timed out after {timeout:.0f}s waiting for the '{name}' rate limit"
+                        )
+                    self._cond.wait(remaining if wait is None else min(wait, remaining))
+            except BaseException:
+                # Timeout or a failed take (e.g. "database is locked"): leave the queue
+                self._remove_waiter(bucket, entry)
+                raise
+            finally:
+                # Let the next waiter re-check whether it is now at the head
+                self._cond.notify_all()
+
+            waited = time.monotonic() - started
+            self._record_wait(bucket, waited)
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                bucket.in_flight -= 1
+                self._cond.notify_all()
+
+    @staticmethod
+    def _remove_waiter(bucket: _Bucket, entry):
+        # Higher-priority callers may have queued ahead while the token was taken
+        if bucket.waiters and bucket.waiters[0] == entry:
+            heapq.heappop(bucket.waiters)
+        elif entry in bucket.waiters:
+            bucket.waiters.remove(entry)
+            heapq.heapify(bucket.waiters)
+
+    def _record_wait(self, bucket: _Bucket, waited: float):
+        stats = bucket.stats
+        stats["acquired"] += 1
+        stats["wait_seconds_total"] += waited
+        stats["wait_seconds_max"] = max(stats["wait_seconds_max"], waited)
+        for i, upper in enumerate(WAIT_BUCKETS):
+            if waited <= upper:
+                stats["wait_histogram"][i] += 1
+                break
+        else:
+            stats["wait_histogram"][-1] += 1
+
+    def call(self, name: str, fn: Callable[[], Any], priority: int = PRIORITY_BULK,
+             timeout: Optional[float] = None, max_retries: Optional[int] = None) -> Any:
+        """
+        Run `fn` under the bucket's budget. On 429 the bucket is blocked for the
+        advised delay (or exponential backoff) and the call is retried after a
+        jittered pause, up to `max_retries` times.
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        for attempt in range(max_retries + 1):
+            with self.slot(name, priority, timeout):
+                try:
+                    return fn()
+                except Exception as e:
+                    if not is_rate_limit_error(e) or attempt >= max_retries:
+                        raise
+                    delay = retry_after_seconds(e) or min(2.0 * (2 ** attempt), 30.0)
+                    bucket = self._buckets[name]
+                    with self._cond:
+                        bucket.stats["rate_limited"] += 1
+                        bucket.stats["retries"] += 1
+                    logger.warning(f"Gemini rate limited on '{name}', backing off {delay:.1f}s (attempt {attempt + 1})")
+                    self.penalize(name, delay)
+            # Jitter so workers released at the same moment do not stampede
+            time.sleep(random.uniform(0, min(delay * 0.25, 5.0)))
+
+    def metrics(self) -> Dict[str, Any]:
+        """Snapshot of queue depth, in-flight calls and queue-wait statistics per bucket."""
+        with self._cond:
+            snapshot = {}
+            for name, bucket in self._buckets.items():
+                stats = dict(bucket.stats)
+                stats["wait_histogram"] = dict(
+                    zip([str(b) for b in WAIT_BUCKETS] + ["+Inf"], bucket.stats["wait_histogram"])
+                )
+                stats["wait_seconds_avg"] = (
+                    stats["wait_seconds_total"] / stats["acquired"] if stats["acquired"] else 0.0
+                )
+                stats.update({
+                    "queue_depth": len(bucket.waiters),
+                    "in_flight": bucket.in_flight,
+                    "requests_per_minute": bucket.rate * 60.0,
+                    "burst": bucket.capacity,
+                    "max_concurrency": bucket.max_concurrency,
+                })
+                snapshot[name] = stats
+            return snapshot
@@ -0,0 +1,139 @@
+"""
+Semantic answer cache for book-grounded chat questions.
+
+Near-duplicate questions about the same book ("what is photosynthesis" /
+"explain photosynthesis") reuse an earlier answer instead of paying for
+another Gemini call. An entry is a hit when the cosine similarity of the
+question embeddings is above the threshold and retrieval returned the same
+chunks, so the cached answer was grounded in the same material.
+
+Each book keeps a fixed-capacity matrix of normalized embeddings, and a
+lookup is a single matrix-vector product. Entries expire after a TTL and the
+least recently used entry is evicted when a book's slots are full. The cache
+is per process.
+"""
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+import numpy as np
+
+
+class _BookCache:
+    def __init__(self, capacity: int, dim: int):
+        self.embeddings = np.zeros((capacity, dim), dtype=np.float32)
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.created_at = np.zeros(capacity, dtype=np.float64)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.chunk_keys = [None] * capacity
+        self.answers = [None] * capacity
+
+
+class SemanticAnswerCache:
+    """Per-book cache of (question embedding, retrieved chunk ids) -> answer."""
+
+    def __init__(self, threshold: float = 0.92, capacity_per_book: int = 256,
+                 ttl_seconds: float = 24 * 3600, max_books: int = 512):
+        self.threshold = threshold
+        self.capacity_per_book = capacity_per_book
+        self.ttl_seconds = ttl_seconds
+        self.max_books = max_books
+        self._books: Dict[str, _BookCache] = {}
+        self._book_last_used: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0}
+
+    @staticmethod
+    def _normalize(embedding: Iterable[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _chunk_key(chunk_ids: Iterable[str]) -> frozenset:
+        return frozenset(str(c) for c in chunk_ids if c)
+
+    def _expire(self, book: _BookCache, now: float):
+        expired = book.valid & (book.created_at < now - self.ttl_seconds)
+        count = int(expired.sum())
+        if count:
+            book.valid[expired] = False
+            for i in np.flatnonzero(expired):
+                book.answers[i] = None
+                book.chunk_keys[i] = None
+            self._stats["expirations"] += count
+
+    def lookup(self, book_id: str, embedding: Iterable[float], chunk_ids: Iterable[str]) -> Optional[str]:
+        """Return a cached answer for a near-identical question with the same chunks, else None."""
+        query = self._normalize(embedding)
+        key = self._chunk_key(chunk_ids)
+        now = time.time()
+        with self._lock:
+            self._stats["lookups"] += 1
+            book = self._books.get(book_id)
+            if book is None or book.embeddings.shape[1] != query.shape[0]:
+                self._stats["misses"] += 1
+                return None
+            self._expire(book, now)
+
+            similarities = book.embeddings @ query
+            similarities[~book.valid] = -1.0
+            # Best-first among candidates above the threshold
+            for index in np.argsort(-similarities):
+                if similarities[index] < self.threshold:
+                    break
+                if book.chunk_keys[index] == key:
+                    book.last_used[index] = now
+                    self._book_last_used[book_id] = now
+                    self._stats["hits"] += 1
+                    return book.answers[index]
+            self._stats["misses"] += 1
+            return None
+
+    def store(self, book_id: str, embedding: Iterable[float], chunk_ids: Iterable[str], answer: str):
+        """Cache an answer, evicting the least recently used entry when the book is full."""
+        if not answer:
+            return
+        vector = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            book = self._books.get(book_id)
+            if book is None or book.embeddings.shape[1] != vector.shape[0]:
+                if len(self._books) >= self.max_books:
+                    oldest = min(self._book_last_used, key=self._book_last_used.get)
+                    self._books.pop(oldest, None)
+                    self._book_last_used.pop(oldest, None)
+                book = _BookCache(self.capacity_per_book, vector.shape[0])
+                self._books[book_id] = book
+            self._expire(book, now)
+
+            free = np.flatnonzero(~book.valid)
+            if free.size:
+                slot = int(free[0])
+            else:
+                slot = int(np.argmin(book.last_used))
+                self._stats["evictions"] += 1
+
+            book.embeddings[slot] = vector
+            book.valid[slot] = True
+            book.created_at[slot] = now
+            book.last_used[slot] = now
+            book.chunk_keys[slot] = self._chunk_key(chunk_ids)
+            book.answers[slot] = answer
+            self._book_last_used[book_id] = now
+            self._stats["stores"] += 1
+
+    def invalidate(self, book_id: str):
+        """Drop all cached answers for a book (e.g. after it is re-ingested)."""
+        with self._lock:
+            self._books.pop(book_id, None)
+            self._book_last_used.pop(book_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+            stats["books"] = len(self._books)
+            stats["entries"] = int(sum(book.valid.sum() for book in self._books.values()))
+            stats["threshold"] = self.threshold
+            return stats
@@ -0,0 +1,427 @@
+"""
+Indexed SQLite session store.
+
+Session metadata (name, timestamps, file count, chat flag) lives in its own
+table indexed by updated_at, so listing sessions never touches the large
+payloads. Each uploaded file is stored as a row with its light fields
+(summary, notes, flashcards, ...) separated from the heavy ones (raw text,
+transcripts, base64 images), which are only read when asked for.
+
+Payloads are stored compressed (services.codec: zstd when installed, else
+gzip). Heavy fields are content-addressed: each distinct value is stored
+once in the `blobs` table with a reference count, so re-saving a session or
+saving the same document in several sessions does not duplicate its
+extracted text.
+Sessions can be updated in place (rename, append chat messages, replace
+one file's artifacts) instead of being re-saved as a whole.
+
+Migrate legacy `sessions/*.json` files with:
+    python -m services.session_store migrate sessions db/sessions.db
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from services.codec import CODEC, compress, decompress
+
+logger = logging.getLogger(__name__)
+
+# Per-file fields that can be large; loaded lazily and deduplicated
+HEAVY_FIELDS = ("raw_text", "extracted_text", "transcript", "base64_image")
+
+
+def _now_iso() -> str:
+    return datetime.datetime.now().isoformat()
+
+
+def _pack_json(value: Any) -> bytes:
+    return compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def _unpack_json(blob) -> Any:
+    return json.loads(decompress(blob).decode("utf-8"))
+
+
+class SessionNotFound(Exception):
+    """Raised when a session id does not exist."""
+
+
+class SessionStore:
+    """Sessions with metadata indexed by updated_at and lazily loaded, deduplicated blobs."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " id TEXT PRIMARY KEY,"
+                " name TEXT NOT NULL,"
+                " created_at TEXT NOT NULL,"
+                " updated_at TEXT NOT NULL,"
+                " file_count INTEGER NOT NULL DEFAULT 0,"
+                " has_chat INTEGER NOT NULL DEFAULT 0);"
+                "CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at DESC, id DESC);"
+                # meta: compressed JSON of light fields; heavy: JSON {field: blob hash};
+                # document_id: the server-side document the file was uploaded as
+                "CREATE TABLE IF NOT EXISTS session_files ("
+                " session_id TEXT NOT NULL,"
+                " position INTEGER NOT NULL,"
+                " meta BLOB NOT NULL,"
+                " heavy TEXT NOT NULL,"
+                " document_id TEXT,"
+                " PRIMARY KEY (session_id, position));"
+                "CREATE INDEX IF NOT EXISTS idx_session_files_document ON session_files(document_id);"
+                "CREATE TABLE IF NOT EXISTS session_chat ("
+                " session_id TEXT PRIMARY KEY,"
+                " chat_history BLOB NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                " hash TEXT PRIMARY KEY,"
+                " data BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " refcount INTEGER NOT NULL DEFAULT 0);"
+            )
+
+    @contextmanager
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        with conn:
+            yield conn
+
+    # Blobs -----------------------------------------------------------------
+
+    @staticmethod
+    def _retain(conn, value: Any) -> str:
+        """Store a heavy value once (by content hash) and take a reference to it."""
+        raw = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        updated = conn.execute(
+            "UPDATE blobs SET refcount = refcount + 1 WHERE hash = ?", (digest,)
+        ).rowcount
+        if not updated:
+            conn.execute(
+                "INSERT INTO blobs (hash, data, size, refcount) VALUES (?, ?, ?, 1)",
+                (digest, compress(raw), len(raw)),
+            )
+        return digest
+
+    @staticmethod
+    def _release(conn, hashes: Iterable[str]):
+        for digest in hashes:
+            conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE hash = ?", (digest,))
+            conn.execute("DELETE FROM blobs WHERE hash = ? AND refcount <= 0", (digest,))
+
+    @staticmethod
+    def _load_blob(conn, digest: str) -> Any:
+        row = conn.execute("SELECT data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        return _unpack_json(row[0]) if row else None
+
+    # Files -----------------------------------------------------------------
+
+    def _write_file(self, conn, session_id: str, position: int, file_data: Dict[str, Any],
+                    meta: Optional[Dict[str, Any]] = None, heavy: Optional[Dict[str, str]] = None):
+        """
+        Insert or update one file. Fields in `file_data` are merged over the
+        existing `meta`/`heavy` (None values delete a field).
+        """
+        meta = dict(meta or {})
+        heavy = dict(heavy or {})
+        released = []
+        for key, value in file_data.items():
+            if key in HEAVY_FIELDS:
+                if key in heavy:
+                    released.append(heavy.pop(key))
+                if value is not None:
+                    heavy[key] = self._retain(conn, value)
+            elif value is None:
+                meta.pop(key, None)
+            else:
+                meta[key] = value
+        # Release after retaining so an unchanged value is never dropped in between
+        self._release(conn, released)
+        conn.execute(
+            "INSERT OR REPLACE INTO session_files (session_id, position, meta, heavy, document_id) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (session_id, position, _pack_json(meta), json.dumps(heavy), meta.get("document_id")),
+        )
+
+    def _read_file_row(self, conn, session_id: str, position: int) -> Optional[Tuple[Dict[str, Any], Dict[str, str]]]:
+        row = conn.execute(
+            "SELECT meta, heavy FROM session_files WHERE session_id = ? AND position = ?",
+            (session_id, position),
+        ).fetchone()
+        if row is None:
+            return None
+        return _unpack_json(row[0]), json.loads(row[1])
+
+    def _delete_files(self, conn, session_id: str, from_position: int = 0):
+        for (heavy,) in conn.execute(
+            "SELECT heavy FROM session_files WHERE session_id = ? AND position >= ?",
+            (session_id, from_position),
+        ).fetchall():
+            self._release(conn, json.loads(heavy).values())
+        conn.execute(
+            "DELETE FROM session_files WHERE session_id = ? AND position >= ?", (session_id, from_position)
+        )
+
+    # Sessions --------------------------------------------------------------
+
+    def create(self, name: str, uploaded_files: List[Dict[str, Any]], chat_history: List[Dict[str, Any]],
+               session_id: Optional[str] = None, created_at: Optional[str] = None,
+               updated_at: Optional[str] = None) -> str:
+        """Store a new session and return its id."""
+        session_id = session_id or f"session_{int(time.time())}_{uuid.uuid4().hex[:6]}"
+        created_at = created_at or _now_iso()
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO sessions (id, name, created_at, updated_at, file_count, has_chat) VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, name, created_at, updated_at or created_at,
+                 len(uploaded_files), 1 if chat_history else 0),
+            )
+            for position, file_data in enumerate(uploaded_files):
+                self._write_file(conn, session_id, position, file_data if isinstance(file_data, dict) else {})
+            conn.execute(
+                "INSERT INTO session_chat (session_id, chat_history) VALUES (?, ?)",
+                (session_id, _pack_json(chat_history)),
+            )
+        return session_id
+
+    def update(self, session_id: str, name: Optional[str] = None,
+               append_chat: Optional[List[Dict[str, Any]]] = None,
+               chat_history: Optional[List[Dict[str, Any]]] = None,
+               files: Optional[Dict[int, Dict[str, Any]]] = None,
+               file_count: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Apply an incremental update and return the new metadata.
+
+        - name: rename the session
+        - append_chat: messages appended to the chat history
+        - chat_history: replace the chat history outright
+        - files: {position: fields}; fields are merged into that file (None
+          deletes a field). A position equal to the current file count appends.
+        - file_count: drop files at positions >= file_count
+        """
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT file_count FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                raise SessionNotFound(session_id)
+            count = row[0]
+
+            if file_count is not None and 0 <= file_count < count:
+                self._delete_files(conn, session_id, file_count)
+                count = file_count
+
+            for position in sorted(files or {}):
+                fields = files[position]
+                if not isinstance(fields, dict) or position < 0 or position > count:
+                    raise ValueError(f"Invalid file position {position}")
+                existing = self._read_file_row(conn, session_id, position)
+                meta, heavy = existing if existing else ({}, {})
+                self._write_file(conn, session_id, position, fields, meta, heavy)
+                if position == count:
+                    count += 1
+
+            if chat_history is not None or append_chat:
+                chat = chat_history
+                if chat is None:
+                    chat_row = conn.execute(
+                        "SELECT chat_history FROM session_chat WHERE session_id = ?", (session_id,)
+                    ).fetchone()
+                    chat = _unpack_json(chat_row[0]) if chat_row else []
+                chat = list(chat) + list(append_chat or [])
+                conn.execute(
+                    "INSERT OR REPLACE INTO session_chat (session_id, chat_history) VALUES (?, ?)",
+                    (session_id, _pack_json(chat)),
+                )
+                conn.execute("UPDATE sessions SET has_chat = ? WHERE id = ?", (1 if chat else 0, session_id))
+
+            updated_at = _now_iso()
+            conn.execute(
+                "UPDATE sessions SET name = COALESCE(?, name), file_count = ?, updated_at = ? WHERE id = ?",
+                (name, count, updated_at, session_id),
+            )
+        return {"id": session_id, "file_count": count, "updated_at": updated_at}
+
+    def list(self, limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Most recently updated sessions first. `cursor` is the opaque value
+        returned as next_cursor by the previous page.
+        """
+        limit = max(1, min(limit, 500))
+        query = "SELECT id, name, created_at, updated_at, file_count, has_chat FROM sessions"
+        params: List[Any] = []
+        if cursor:
+            updated_at, _, last_id = cursor.partition("|")
+            query += " WHERE (updated_at < ? OR (updated_at = ? AND id < ?))"
+            params += [updated_at, updated_at, last_id]
+        query += " ORDER BY updated_at DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        with self._connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        sessions = [
+            {
+                "id": row[0],
+                "name": row[1],
+                "created_at": row[2],
+                "updated_at": row[3],
+                "file_count": row[4],
+                "has_chat": bool(row[5]),
+            }
+            for row in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            last = sessions[-1]
+            next_cursor = f"{last['updated_at']}|{last['id']}"
+        return sessions, next_cursor
+
+    def get(self, session_id: str, include_blobs: bool = True) -> Dict[str, Any]:
+        """
+        Load a session. With include_blobs=False, heavy per-file fields are left
+        out and listed under `lazy_fields` so the client can fetch them on demand.
+        """
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT id, name, created_at, updated_at FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                raise SessionNotFound(session_id)
+            files = conn.execute(
+                "SELECT meta, heavy FROM session_files WHERE session_id = ? ORDER BY position",
+                (session_id,),
+            ).fetchall()
+            chat = conn.execute(
+                "SELECT chat_history FROM session_chat WHERE session_id = ?", (session_id,)
+            ).fetchone()
+
+            uploaded_files = []
+            for meta, heavy in files:
+                file_data = _unpack_json(meta)
+                hashes = json.loads(heavy)
+                if include_blobs:
+                    for field, digest in hashes.items():
+                        file_data[field] = self._load_blob(conn, digest)
+                else:
+                    file_data["lazy_fields"] = list(hashes)
+                uploaded_files.append(file_data)
+
+        return {
+            "id": row[0],
+            "name": row[1],
+            "created_at": row[2],
+            "updated_at": row[3],
+            "uploadedFiles": uploaded_files,
+            "chatHistory": _unpack_json(chat[0]) if chat else [],
+        }
+
+    def get_file_field(self, session_id: str, position: int, field: str) -> Any:
+        """Fetch one heavy field of one file (lazy loading)."""
+        if field not in HEAVY_FIELDS:
+            raise KeyError(field)
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT heavy FROM session_files WHERE session_id = ? AND position = ?",
+                (session_id, position),
+            ).fetchone()
+            if row is None:
+                raise SessionNotFound(session_id)
+            digest = json.loads(row[0]).get(field)
+            return self._load_blob(conn, digest) if digest else None
+
+    def document_ids(self) -> Set[str]:
+        """Documents that saved sessions refer to (their text must outlive DocumentStore.prune)."""
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT document_id FROM session_files WHERE document_id IS NOT NULL"
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def delete(self, session_id: str) -> bool:
+        with self._connection() as conn:
+            deleted = conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount
+            self._delete_files(conn, session_id)
+            conn.execute("DELETE FROM session_chat WHERE session_id = ?", (session_id,))
+        return bool(deleted)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._connection() as conn:
+            sessions = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            blobs, raw_bytes, stored_bytes, refs = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0), "
+                "COALESCE(SUM(refcount), 0) FROM blobs"
+            ).fetchone()
+        return {
+            "sessions": sessions,
+            "blobs": blobs,
+            "blob_references": refs,
+            "blob_bytes_raw": raw_bytes,
+            "blob_bytes_stored": stored_bytes,
+            "codec": CODEC,
+        }
+
+    def migrate_json_dir(self, sessions_dir: str, archive: bool = True) -> int:
+        """
+        Import legacy `<id>.json` session files. Already-imported ids are skipped,
+        so this is safe to run repeatedly (and from several workers at once).
+        Imported files are renamed to `<id>.json.migrated` when `archive` is set.
+        """
+        if not os.path.isdir(sessions_dir):
+            return 0
+        imported = 0
+        for filename in sorted(os.listdir(sessions_dir)):
+            if not filename.endswith(".json"):
+                continue
+            path = os.path.join(sessions_dir, filename)
+            session_id = filename[:-len(".json")]
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                updated_at = datetime.datetime.fromtimestamp(os.stat(path).st_mtime).isoformat()
+                self.create(
+                    name=data.get("name", "Untitled Session"),
+                    uploaded_files=data.get("uploadedFiles", []),
+                    chat_history=data.get("chatHistory", []),
+                    session_id=session_id,
+                    created_at=data.get("created_at") or updated_at,
+                    updated_at=updated_at,
+                )
+                imported += 1
+            except sqlite3.IntegrityError:
+                pass  # Already migrated
+            except Exception as e:
+                logger.warning(f"Could not migrate session {filename}: {e}")
+                continue
+            if archive:
+                try:
+                    os.replace(path, path + ".migrated")
+                except OSError:
+                    pass
+        if imported:
+            logger.info(f"Migrated {imported} JSON sessions from {sessions_dir}")
+        return imported
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 4 or sys.argv[1] != "migrate":
+        print("Usage: python -m services.session_store migrate <sessions_dir> <db_path>")
+        sys.exit(1)
+    count = SessionStore(sys.argv[3]).migrate_json_dir(sys.argv[2])
+    print(f"Migrated {count} sessions into {sys.argv[3]}")
@@ -0,0 +1,307 @@
+"""
+Persistent YouTube transcript cache with concurrent fallback fetching.
+
+Transcripts are cached in SQLite by (video id, language) with a TTL, so
+popular lecture videos are fetched from YouTube once rather than on every
+/upload and /api/youtube/transcript request. "Transcripts disabled" and "no
+transcript" outcomes are cached too (negative caching, shorter TTL);
+transient network errors are not cached.
+
+On a miss the fallback strategies (direct fetch, manually created
+transcript, auto-generated transcript) run concurrently and the first
+success wins, except that an auto-generated transcript is only used once
+the manual lookups have failed. Concurrent misses for the same video share
+one fetch.
+
+All network access goes through a transport object, so tests can swap in
+StubTranscriptTransport and run offline.
+"""
+import concurrent.futures
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from youtube_transcript_api import YouTubeTranscriptApi, NoTranscriptFound, TranscriptsDisabled
+
+from services.codec import compress, decompress
+
+logger = logging.getLogger(__name__)
+
+STATUS_OK = "ok"
+STATUS_DISABLED = "disabled"
+STATUS_NOT_FOUND = "not_found"
+
+
+def normalize_segments(entries) -> List[Dict[str, Any]]:
+    """Segments as {'text', 'start', 'duration'} dicts (0.6 dicts or 1.x snippet objects)."""
+    segments = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            text, start, duration = entry["text"], entry["start"], entry["duration"]
+        else:
+            text, start, duration = entry.text, entry.start, entry.duration
+        segments.append({"text": text.strip(), "start": float(start), "duration": float(duration)})
+    return segments
+
+
+class YouTubeTranscriptTransport:
+    """Network layer over youtube-transcript-api (0.6 class methods or the 1.x instance API)."""
+
+    _legacy = hasattr(YouTubeTranscriptApi, "list_transcripts")
+
+    def fetch(self, video_id: str, languages: List[str]):
+        if self._legacy:
+            return YouTubeTranscriptApi.get_transcript(video_id, languages=languages)
+        return YouTubeTranscriptApi().fetch(video_id, languages=languages)
+
+    def list(self, video_id: str):
+        if self._legacy:
+            return YouTubeTranscriptApi.list_transcripts(video_id)
+        return YouTubeTranscriptApi().list(video_id)
+
+
+class _StubTranscript:
+    def __init__(self, segments):
+        self._segments = segments
+
+    def fetch(self):
+        return list(self._segments)
+
+
+class _StubTranscriptList:
+    def __init__(self, video_id: str, segments, generated_only: bool):
+        self.video_id = video_id
+        self._segments = segments
+        self._generated_only = generated_only
+
+    def find_manually_created_transcript(self, languages):
+        if self._generated_only:
+            raise NoTranscriptFound(self.video_id, languages, None)
+        return _StubTranscript(self._segments)
+
+    def find_generated_transcript(self, languages):
+        return _StubTranscript(self._segments)
+
+
+class StubTranscriptTransport:
+    """
+    Offline stand-in for YouTubeTranscriptTransport. Every video has a canned
+    transcript except those in `disabled`; videos in `generated_only` fail
+    the direct and manual lookups. `delay` mimics network latency.
+    """
+
+    def __init__(self, segments=None, disabled=(), generated_only=(), delay: float = 0.0):
+        self.segments = segments or [
+            {"text": f"This is stub transcript segment {i}.", "start": i * 5.0, "duration": 5.0}
+            for i in range(12)
+        ]
+        self.disabled = set(disabled)
+        self.generated_only = set(generated_only)
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _call(self, name: str, video_id: str):
+        with self._lock:
+            self.calls.append((name, video_id))
+        if self.delay:
+            time.sleep(self.delay)
+        if video_id in self.disabled:
+            raise TranscriptsDisabled(video_id)
+
+    def fetch(self, video_id: str, languages: List[str]):
+        self._call("fetch", video_id)
+        if video_id in self.generated_only:
+            raise NoTranscriptFound(video_id, languages, None)
+        return list(self.segments)
+
+    def list(self, video_id: str):
+        self._call("list", video_id)
+        return _StubTranscriptList(video_id, self.segments, video_id in self.generated_only)
+
+
+class TranscriptCache:
+    """get(video_id, language) -> segments or None; thread-safe."""
+
+    def __init__(self, transport, db_path: str, ttl_seconds: float = 30 * 24 * 3600,
+                 negative_ttl_seconds: float = 6 * 3600, max_workers: int = 6):
+        self.transport = transport
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="transcript-fetch"
+        )
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._inflight: Dict[tuple, concurrent.futures.Future] = {}
+        self._stats = {"requests": 0, "hits": 0, "negative_hits": 0, "misses": 0, "coalesced": 0,
+                       "errors": 0, "wins": {}}
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS transcripts ("
+                " video_id TEXT NOT NULL,"
+                " language TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " segments BLOB,"
+                " fetched_at REAL NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " PRIMARY KEY (video_id, language))"
+            )
+            conn.execute("DELETE FROM transcripts WHERE expires_at < ?", (time.time(),))
+
+    @contextmanager
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        with conn:
+            yield conn
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _count_win(self, strategy: str):
+        with self._lock:
+            self._stats["wins"][strategy] = self._stats["wins"].get(strategy, 0) + 1
+
+    def lookup(self, video_id: str, language: str = "en"):
+        """(status, segments) of a fresh cache entry, or None."""
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT status, segments FROM transcripts WHERE video_id = ? AND language = ? AND expires_at >= ?",
+                (video_id, language, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        status, blob = row
+        return status, (json.loads(decompress(blob).decode("utf-8")) if blob is not None else None)
+
+    def store(self, video_id: str, language: str, status: str, segments=None):
+        now = time.time()
+        ttl = self.ttl_seconds if status == STATUS_OK else self.negative_ttl_seconds
+        blob = compress(json.dumps(segments, separators=(",", ":")).encode("utf-8")) if segments else None
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO transcripts (video_id, language, status, segments, fetched_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (video_id, language, status, blob, now, now + ttl),
+            )
+
+    def invalidate(self, video_id: str):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM transcripts WHERE video_id = ?", (video_id,))
+
+    def get(self, video_id: str, language: str = "en") -> Optional[List[Dict[str, Any]]]:
+        """Cached transcript segments, fetching on a miss; None if the video has none."""
+        self._count("requests")
+        cached = self.lookup(video_id, language)
+        if cached is not None:
+            status, segments = cached
+            self._count("hits" if status == STATUS_OK else "negative_hits")
+            return segments if status == STATUS_OK else None
+
+        key = (video_id, language)
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._inflight[key] = future
+            else:
+                self._stats["coalesced"] += 1
+        if not leader:
+            return future.result()
+
+        try:
+            self._count("misses")
+            status, segments = self._fetch(video_id, language)
+            if status is not None:
+                self.store(video_id, language, status, segments)
+            else:
+                self._count("errors")
+            result = segments if status == STATUS_OK else None
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _fetch(self, video_id: str, language: str):
+        """
+        Run the fallback strategies concurrently. Returns (status, segments);
+        status is None for transient failures, which are not cached.
+        """
+        listing_lock = threading.Lock()
+        listing = {}
+
+        def transcript_list():
+            # One list request shared by the manual and generated lookups
+            with listing_lock:
+                if "value" not in listing:
+                    listing["value"] = self.transport.list(video_id)
+                return listing["value"]
+
+        strategies = [
+            # (name, quality rank: lower is better, callable)
+            ("direct", 0, lambda: self.transport.fetch(video_id, [language])),
+            ("manual", 0, lambda: transcript_list().find_manually_created_transcript([language]).fetch()),
+            ("generated", 1, lambda: transcript_list().find_generated_transcript([language]).fetch()),
+        ]
+        futures = {self._executor.submit(fn): (name, rank) for name, rank, fn in strategies}
+        pending = set(futures)
+        successes = {}
+        errors = []
+        try:
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name, rank = futures[future]
+                    try:
+                        segments = normalize_segments(future.result())
+                        if segments:
+                            successes[name] = (rank, segments)
+                        else:
+                            errors.append(NoTranscriptFound(video_id, [language], None))
+                    except Exception as e:
+                        errors.append(e)
+                if successes:
+                    best_name = min(successes, key=lambda n: successes[n][0])
+                    best_rank = successes[best_name][0]
+                    # Accept once nothing still running could return a better transcript
+                    if all(futures[f][1] >= best_rank for f in pending):
+                        self._count_win(best_name)
+                        logger.info(f"✓ Transcript for {video_id} via {best_name} ({len(successes[best_name][1])} segments)")
+                        return STATUS_OK, successes[best_name][1]
+        finally:
+            for future in pending:
+                future.cancel()
+
+        if any(isinstance(e, TranscriptsDisabled) for e in errors):
+            logger.warning(f"Transcripts are disabled for video: {video_id}")
+            return STATUS_DISABLED, None
+        if errors and all(isinstance(e, NoTranscriptFound) for e in errors):
+            logger.warning(f"No transcripts found for video: {video_id}")
+            return STATUS_NOT_FOUND, None
+        logger.error(f"✗ All transcript fetch methods failed for video {video_id}: {errors}")
+        return None, None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats, wins=dict(self._stats["wins"]))
+        with self._connection() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM transcripts GROUP BY status").fetchall()
+        stats["entries"] = {status: count for status, count in rows}
+        return stats
@@ -0,0 +1,115 @@
+"""
+Concurrency and memory budget for upload processing.
+
+Each worker process admits upload tasks (one per file) in arrival order
+while both the number of running tasks and their estimated memory stay
+within limits. A task that does not fit waits; because admission is FIFO, a
+large file cannot be starved by a stream of small ones, and one student's
+multi-file upload cannot jump ahead of files other users queued earlier.
+map_ordered() additionally caps how many of a single request's items are in
+flight, so one request leaves room for others.
+"""
+import collections
+import concurrent.futures
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List
+
+
+class BudgetTimeout(Exception):
+    """Raised when a task could not be admitted within its timeout."""
+
+
+class ResourceBudget:
+    """FIFO admission of tasks under a task-count and estimated-bytes limit."""
+
+    def __init__(self, max_tasks: int, max_bytes: int):
+        self.max_tasks = max(1, max_tasks)
+        self.max_bytes = max(1, max_bytes)
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._tasks = 0
+        self._bytes = 0
+        self._stats = {"admitted": 0, "timeouts": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+
+    def _fits(self, cost: int) -> bool:
+        # A task larger than the whole budget still runs, but only on its own
+        return self._tasks < self.max_tasks and (self._bytes + cost <= self.max_bytes or self._tasks == 0)
+
+    @contextmanager
+    def reserve(self, cost_bytes: int, timeout: float = None):
+        """Hold `cost_bytes` of the budget (and one task slot) for the duration of the block."""
+        ticket = object()
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while self._queue[0] is not ticket or not self._fits(cost_bytes):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise BudgetTimeout(f"Upload processing budget busy for {timeout:.0f}s")
+                    self._cond.wait(remaining)
+            finally:
+                if self._queue and self._queue[0] is ticket:
+                    self._queue.popleft()
+                elif ticket in self._queue:
+                    self._queue.remove(ticket)
+                self._cond.notify_all()
+            self._tasks += 1
+            self._bytes += cost_bytes
+            waited = time.monotonic() - start
+            self._stats["admitted"] += 1
+            self._stats["wait_seconds_total"] += waited
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._tasks -= 1
+                self._bytes -= cost_bytes
+                self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return dict(
+                self._stats,
+                running=self._tasks,
+                reserved_bytes=self._bytes,
+                waiting=len(self._queue),
+                max_tasks=self.max_tasks,
+                max_bytes=self.max_bytes,
+            )
+
+
+def map_ordered(executor: concurrent.futures.Executor, fn: Callable[[Any], Any], items: Iterable[Any],
+                max_parallel: int) -> List[Any]:
+    """
+    Run fn over items on `executor` with at most `max_parallel` in flight and
+    return the results in input order. On the first failure no more items
+    are submitted, queued ones are cancelled, and the exception is raised
+    once the items already running have finished, so the caller can clean
+    up what they use (e.g. temp files) without pulling it from under them.
+    """
+    items = list(items)
+    results: List[Any] = [None] * len(items)
+    pending = {}
+    next_index = 0
+    max_parallel = max(1, max_parallel)
+
+    while next_index < len(items) or pending:
+        while next_index < len(items) and len(pending) < max_parallel:
+            pending[executor.submit(fn, items[next_index])] = next_index
+            next_index += 1
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        failed = [future for future in done if future.exception() is not None]
+        if failed:
+            for future in pending:
+                future.cancel()
+            concurrent.futures.wait(pending)
+            raise min(failed, key=pending.get).exception()
+        for future in done:
+            results[pending.pop(future)] = future.result()
+    return results
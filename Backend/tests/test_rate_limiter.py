@@ -0,0 +1,72 @@
+"""
+Regression tests for TokenBucketLimiter.slot().
+
+    cd Backend
+    python -m pytest tests
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.rate_limiter import TokenBucketLimiter  # noqa: E402
+
+
+class SlotTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.limiter = TokenBucketLimiter(os.path.join(self.tmp.name, "limiter.db"), queue_timeout=2)
+        self.limiter.register("g", requests_per_minute=600, burst=5)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_failed_take_leaves_the_queue(self):
+        real_take = self.limiter._try_take
+        calls = []
+
+        def flaky_take(bucket):
+            calls.append(bucket.name)
+            if len(calls) == 1:
+                raise sqlite3.OperationalError("database is locked")
+            return real_take(bucket)
+
+        with mock.patch.object(self.limiter, "_try_take", side_effect=flaky_take):
+            with self.assertRaises(sqlite3.OperationalError):
+                with self.limiter.slot("g"):
+                    pass
+            self.assertEqual(self.limiter._buckets["g"].waiters, [])
+            with self.limiter.slot("g", timeout=1):
+                pass
+        self.assertEqual(self.limiter.metrics()["g"]["queue_depth"], 0)
+        self.assertEqual(self.limiter.metrics()["g"]["in_flight"], 0)
+
+    def test_token_taken_without_holding_the_condition(self):
+        real_take = self.limiter._try_take
+        acquired_elsewhere = []
+
+        def take(bucket):
+            # Another thread (e.g. a release in slot()'s finally) must not block
+            result = []
+            thread = threading.Thread(target=lambda: result.append(self.limiter._cond.acquire(timeout=1)))
+            thread.start()
+            thread.join()
+            if result[0]:
+                self.limiter._cond.release()
+            acquired_elsewhere.append(result[0])
+            return real_take(bucket)
+
+        with mock.patch.object(self.limiter, "_try_take", side_effect=take):
+            with self.limiter.slot("g"):
+                pass
+        self.assertEqual(acquired_elsewhere, [True])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,7 @@
 import { useState, useRef, useEffect, useMemo, Suspense, lazy } from "react";
 import toast, { Toaster } from 'react-hot-toast';
 import axios from "axios";
-import { endpoint } from "./utils/api";
+import { endpoint, artifactKind, artifactUrl, fetchArtifact } from "./utils/api";
 import useAppState from "./hooks/useAppState";
 import useFileHandling from "./hooks/useFileHandling";
 import bgImage from "./utils/Background.jpg";
@@ -93,6 +93,7 @@ function App() {
 
   useEffect(() => {
     localStorage.removeItem('studyAssistantChat');
+    localStorage.removeItem('studyAssistantConversationId');
   }, []);
 
   useEffect(() => {
@@ -146,6 +147,34 @@ function App() {
     type: "",
   };
 
+  // Lazily generated artifacts are fetched the first time their section is opened
+  useEffect(() => {
+    const url = artifactUrl(currentContent, activeSection);
+    const kind = artifactKind(activeSection);
+    const isEmpty = Array.isArray(currentContent[kind]) ? currentContent[kind].length === 0 : !currentContent[kind];
+    if (!url || !isEmpty || isGenerating[activeSection]) return;
+
+    const section = activeSection;
+    const fileIndex = selectedFileIndex;
+    setIsGenerating((prev) => ({ ...prev, [section]: true }));
+    fetchArtifact(url)
+      .then((res) => {
+        if (res.data.status !== "ready") {
+          toast.error(`Could not generate ${section} right now. Try the generate button.`);
+          return;
+        }
+        setUploadedFiles((prev) =>
+          prev.map((f, i) =>
+            i === fileIndex
+              ? { ...f, [kind]: res.data.data, artifacts: { ...f.artifacts, [kind]: { ...f.artifacts[kind], status: "ready" } } }
+              : f
+          )
+        );
+      })
+      .catch((err) => console.error(`Loading ${section} failed:`, err))
+      .finally(() => setIsGenerating((prev) => ({ ...prev, [section]: false })));
+  }, [activeSection, selectedFileIndex, currentContent.artifacts]);
+
   const speakText = (text, type) => {
     if (!text) return;
     if (speechSynthesisRef.current.speaking) {
@@ -225,6 +254,36 @@ function App() {
     }
   };
 
+  // Every artifact of every uploaded file in one streamed ZIP
+  const handleBulkDownload = async (formats = ["pdf"]) => {
+    try {
+      const files = uploadedFiles.map((file) => ({
+        filename: file.filename,
+        summary: file.summary,
+        short_notes: file.short_notes,
+        flashcards: file.flashcards,
+        mcqs: file.mcqs,
+        image_description: file.image_description,
+        transcript: file.transcript,
+      }));
+      const response = await axios.post(
+        endpoint("/download/bulk"),
+        { files, formats },
+        { responseType: "blob" }
+      );
+      const url = window.URL.createObjectURL(new Blob([response.data]));
+      const link = document.createElement("a");
+      link.href = url;
+      link.setAttribute("download", "notelooms_export.zip");
+      document.body.appendChild(link);
+      link.click();
+      link.remove();
+      window.URL.revokeObjectURL(url);
+    } catch (error) {
+      setError("Failed to download the export. Please try again.");
+    }
+  };
+
   const showConfirmation = (action, message) => {
     setConfirmAction(action);
     setConfirmMessage(message);
@@ -242,6 +301,10 @@ function App() {
       setActiveSection("summary");
       setIsChatbotVisible(false);
       localStorage.removeItem('studyAssistantChat');
+      localStorage.removeItem('studyAssistantConversationId');
+      // A fresh start saves as a new session rather than overwriting the last one
+      setCurrentSessionId(null);
+      savedSessionRef.current = null;
       setPreviewFiles([]);
       setIsPreviewModalOpen(false);
       setIsPreviewMinimized(false);
@@ -268,6 +331,7 @@ function App() {
     const confirmMessage = 'Are you sure you want to reset? Your uploaded content and chat history will disappear.';
     // Clear chat history from localStorage
     localStorage.removeItem('studyAssistantChat');
+    localStorage.removeItem('studyAssistantConversationId');
     // Also clear from sessionStorage if used
     sessionStorage.removeItem('studyAssistantChat');
     // Clear any active chat sessions
@@ -280,6 +344,34 @@ function App() {
   // Session Management
   const [isSessionHistoryOpen, setIsSessionHistoryOpen] = useState(false);
   const [currentSessionId, setCurrentSessionId] = useState(null);
+  // What the server already has for the current session, so re-saves only send changes
+  const savedSessionRef = useRef(null);
+
+  const snapshotSession = (id, files, chatHistory) => {
+    savedSessionRef.current = {
+      id,
+      files: files.map((file) =>
+        Object.fromEntries(Object.entries(file).map(([key, value]) => [key, JSON.stringify(value)]))
+      ),
+      chatLength: chatHistory.length,
+    };
+  };
+
+  const diffSessionFiles = (savedFiles, files) => {
+    const changes = {};
+    files.forEach((file, index) => {
+      const before = savedFiles[index] || {};
+      const changed = {};
+      Object.entries(file).forEach(([key, value]) => {
+        if (before[key] !== JSON.stringify(value)) changed[key] = value;
+      });
+      Object.keys(before).forEach((key) => {
+        if (!(key in file)) changed[key] = null;
+      });
+      if (Object.keys(changed).length > 0) changes[index] = changed;
+    });
+    return changes;
+  };
 
   const handleSaveSession = async () => {
     try {
@@ -288,12 +380,29 @@ function App() {
         return;
       }
 
-      const sessionName = prompt("Enter a name for this session:", `Session ${new Date().toLocaleString()}`);
-      if (!sessionName) return;
-
       // Get chat history from localStorage
       const chatHistory = JSON.parse(localStorage.getItem('studyAssistantChat') || '[]');
 
+      // Update the loaded/saved session in place with only what changed
+      const saved = savedSessionRef.current;
+      if (saved && saved.id === currentSessionId) {
+        const patch = { files: diffSessionFiles(saved.files, uploadedFiles) };
+        if (uploadedFiles.length < saved.files.length) patch.file_count = uploadedFiles.length;
+        if (chatHistory.length >= saved.chatLength) {
+          patch.append_chat = chatHistory.slice(saved.chatLength);
+        } else {
+          patch.chatHistory = chatHistory;
+        }
+        await axios.patch(endpoint(`/api/sessions/${currentSessionId}`), patch);
+        snapshotSession(currentSessionId, uploadedFiles, chatHistory);
+        toast.success("Session updated!");
+        window.dispatchEvent(new Event('sessionSaved'));
+        return;
+      }
+
+      const sessionName = prompt("Enter a name for this session:", `Session ${new Date().toLocaleString()}`);
+      if (!sessionName) return;
+
       const sessionData = {
         name: sessionName,
         uploadedFiles: uploadedFiles,
@@ -304,6 +413,7 @@ function App() {
 
       if (response.data.session_id) {
         setCurrentSessionId(response.data.session_id);
+        snapshotSession(response.data.session_id, uploadedFiles, chatHistory);
         toast.success("Session saved successfully!");
         // Trigger refresh event for SessionHistory component
         window.dispatchEvent(new Event('sessionSaved'));
@@ -331,8 +441,11 @@ function App() {
       if (sessionData.chatHistory && sessionData.chatHistory.length > 0) {
         localStorage.setItem('studyAssistantChat', JSON.stringify(sessionData.chatHistory));
       }
+      // Start a fresh server-side conversation seeded from the loaded history
+      localStorage.removeItem('studyAssistantConversationId');
 
       setCurrentSessionId(sessionData.id);
+      snapshotSession(sessionData.id, sessionData.uploadedFiles || [], sessionData.chatHistory || []);
       toast.success("Session loaded successfully!");
     } catch (error) {
       if (import.meta.env.DEV) console.error("Error loading session:", error);
@@ -378,6 +491,7 @@ function App() {
       handleUploadedFileClick,
       handleExport,
       handleDownload,
+      handleBulkDownload,
       handleReset,
       handleConfirm,
       handleCancel,
@@ -422,6 +536,7 @@ function App() {
       handleUploadedFileClick,
       handleExport,
       handleDownload,
+      handleBulkDownload,
       handleReset,
       handleConfirm,
       handleCancel,
@@ -1,7 +1,7 @@
 import { useState, useEffect, useRef, useMemo, memo } from "react";
 import { motion, AnimatePresence } from "framer-motion";
 import axios from "axios";
-import { endpoint } from "../utils/api";
+import { endpoint, chatContext } from "../utils/api";
 import 'katex/dist/katex.min.css';
 import { InlineMath, BlockMath } from 'react-katex';
 import { IconClose } from '../utils/icons';
@@ -29,6 +29,7 @@ MemoizedMessageContent.displayName = 'MemoizedMessageContent';
 
 function Chatbot({ content, onClose }) {
   const STORAGE_KEY = 'studyAssistantChat';
+  const CONVERSATION_KEY = 'studyAssistantConversationId';
   
   // Detect if device is mobile/tablet (not desktop) - only show photo/homework mention on mobile/tablet
   const isMobileOrTablet = typeof window !== 'undefined' && window.innerWidth < 1024;
@@ -63,6 +64,8 @@ function Chatbot({ content, onClose }) {
     }
     return [initialGreeting];
   });
+  // Server-side conversation: once known, only the new message is sent each turn
+  const [conversationId, setConversationId] = useState(() => localStorage.getItem(CONVERSATION_KEY) || null);
   const [userInput, setUserInput] = useState("");
   const [isLoading, setIsLoading] = useState(false);
   const [showEmojiPicker, setShowEmojiPicker] = useState(false);
@@ -91,6 +94,10 @@ function Chatbot({ content, onClose }) {
     };
   }, [messages]);
 
+  useEffect(() => {
+    if (conversationId) localStorage.setItem(CONVERSATION_KEY, conversationId);
+  }, [conversationId]);
+
   useEffect(() => {
     messagesEndRef.current?.scrollIntoView({ block: "end" });
   }, [messages]);
@@ -117,6 +124,56 @@ function Chatbot({ content, onClose }) {
     setShowEmojiPicker(false);
   };
 
+  // Read Server-Sent Events from /chat/stream, calling onToken with the reply so far
+  const streamChatReply = async (payload, onToken) => {
+    const res = await fetch(endpoint("/chat/stream"), {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(payload),
+    });
+    if (!res.ok || !res.body) throw new Error(`Streaming request failed (${res.status})`);
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let received = "";
+    let fallback = null;
+    let streamedConversationId = null;
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split("\n\n");
+      buffer = events.pop();
+      for (const rawEvent of events) {
+        let eventName = "message";
+        let data = "";
+        rawEvent.split("\n").forEach((line) => {
+          if (line.startsWith("event:")) eventName = line.slice(6).trim();
+          else if (line.startsWith("data:")) data += line.slice(5).trim();
+        });
+        if (!data) continue;
+        const parsed = JSON.parse(data);
+        if (eventName === "token") {
+          received += parsed.text;
+          onToken(received);
+        } else if (eventName === "error") {
+          fallback = parsed.fallback;
+        } else if (eventName === "done") {
+          streamedConversationId = parsed.conversation_id || null;
+        }
+      }
+    }
+
+    if (streamedConversationId) setConversationId(streamedConversationId);
+    if (!received && fallback) {
+      onToken(fallback);
+      return fallback;
+    }
+    return received;
+  };
+
   const handleSendMessage = async () => {
     const trimmed = userInput.trim();
     if (!trimmed) return;
@@ -149,18 +206,37 @@ function Chatbot({ content, onClose }) {
     setUserInput("");
     setIsLoading(true);
 
-    try {
-      const response = await axios.post(endpoint("/chat"), {
-        message: userInput,
-        history: updatedMessages,
-        content: content,
-      });
+    const payload = conversationId
+      ? { message: userInput, conversation_id: conversationId, content: chatContext(content) }
+      : { message: userInput, history: updatedMessages, content: chatContext(content) };
 
-      const botResponse = response.data.response;
-      setMessages((prev) => [...prev, { sender: "bot", text: botResponse }]);
-    } catch (error) {
-      const errorMessage = error.response?.data?.error || "Sorry, I couldn't process your request. Please try again.";
-      setMessages((prev) => [...prev, { sender: "bot", text: errorMessage }]);
+    // Show tokens as they arrive: add the bot message on the first token, then update it in place
+    let streamStarted = false;
+    const showPartialReply = (text) => {
+      if (!streamStarted) {
+        streamStarted = true;
+        setMessages((prev) => [...prev, { sender: "bot", text }]);
+      } else {
+        setMessages((prev) => [...prev.slice(0, -1), { sender: "bot", text }]);
+      }
+    };
+
+    try {
+      const reply = await streamChatReply(payload, showPartialReply);
+      if (!reply) throw new Error("Empty streamed reply");
+    } catch (streamError) {
+      if (import.meta.env.DEV) console.warn("Chat streaming failed, falling back to /chat:", streamError);
+      if (!streamStarted) {
+        try {
+          const response = await axios.post(endpoint("/chat"), payload);
+          const botResponse = response.data.response;
+          if (response.data.conversation_id) setConversationId(response.data.conversation_id);
+          setMessages((prev) => [...prev, { sender: "bot", text: botResponse }]);
+        } catch (error) {
+          const errorMessage = error.response?.data?.error || "Sorry, I couldn't process your request. Please try again.";
+          setMessages((prev) => [...prev, { sender: "bot", text: errorMessage }]);
+        }
+      }
     } finally {
       setIsLoading(false);
     }
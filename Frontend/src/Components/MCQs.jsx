@@ -1,6 +1,6 @@
 import { useState, useMemo, useEffect, useRef } from "react";
 import axios from "axios";
-import { endpoint } from "../utils/api";
+import { endpoint, hasSourceText, sourceTextPayload } from "../utils/api";
 
 export default function MCQs({ currentContent, onUpdate, numQuestions = 10, setNumQuestions }) {
   const [isGenerating, setIsGenerating] = useState(false);
@@ -64,13 +64,13 @@ export default function MCQs({ currentContent, onUpdate, numQuestions = 10, setN
   testMcqsRef.current = testMcqs;
 
   const handleGenerateMCQs = async () => {
-    if (!currentContent?.raw_text || isGenerating) return;
+    if (!hasSourceText(currentContent) || isGenerating) return;
     
     setIsGenerating(true);
     setGenerationError("");
     try {
       const res = await axios.post(endpoint("/generate/mcqs"), { 
-        text: currentContent.raw_text, 
+        ...sourceTextPayload(currentContent),
         num_questions: numQuestions || 10
       });
       
@@ -240,7 +240,7 @@ export default function MCQs({ currentContent, onUpdate, numQuestions = 10, setN
               <p className="text-lg text-red-400 mb-4">
                 {generationError}
               </p>
-              {currentContent?.raw_text && (
+              {hasSourceText(currentContent) && (
                 <button
                   onClick={handleGenerateMCQs}
                   disabled={isGenerating}
@@ -258,7 +258,7 @@ export default function MCQs({ currentContent, onUpdate, numQuestions = 10, setN
               <p className="text-sm text-[--text-tertiary] mb-4">
                 MCQs are automatically generated when you upload content. Please upload a PDF or YouTube video to get started.
               </p>
-              {currentContent?.raw_text && (
+              {hasSourceText(currentContent) && (
                 <button
                   onClick={handleGenerateMCQs}
                   disabled={isGenerating}
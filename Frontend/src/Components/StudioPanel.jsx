@@ -2,7 +2,7 @@ import React from 'react';
 import { motion } from 'framer-motion';
 import axios from 'axios';
 import toast from 'react-hot-toast';
-import { endpoint } from '../utils/api';
+import { endpoint, imageSrc, hasSourceText, sourceTextPayload, artifactKind, artifactUrl, fetchArtifact } from '../utils/api';
 import OutputModal from './OutputModal';
 import FlashcardCarousel from './FlashcardCarousel';
 import MCQs from './MCQs';
@@ -114,7 +114,7 @@ export default function StudioPanel({
       return;
     }
     
-    if (!currentContent?.raw_text) {
+    if (!hasSourceText(currentContent)) {
       toast.error('No content available to generate from');
       return;
     }
@@ -129,13 +129,19 @@ export default function StudioPanel({
     
     try {
       let res;
-      if (type === 'notes') {
-        res = await axios.post(endpoint('/generate/notes'), { text: currentContent.raw_text });
+      // Notes and flashcards left for later by the upload are generated once per document
+      const lazyUrl = type !== 'mcqs' && artifactUrl(currentContent, type);
+      if (lazyUrl) {
+        const { data } = await fetchArtifact(lazyUrl);
+        if (data.status !== 'ready') throw new Error(data.status === 'error' ? 'generation failed' : 'still generating, try again shortly');
+        res = { data: { [artifactKind(type)]: data.data } };
+      } else if (type === 'notes') {
+        res = await axios.post(endpoint('/generate/notes'), sourceTextPayload(currentContent));
       } else if (type === 'flashcards') {
-        res = await axios.post(endpoint('/generate/flashcards'), { text: currentContent.raw_text });
+        res = await axios.post(endpoint('/generate/flashcards'), sourceTextPayload(currentContent));
       } else if (type === 'mcqs') {
         res = await axios.post(endpoint('/generate/mcqs'), { 
-          text: currentContent.raw_text, 
+          ...sourceTextPayload(currentContent),
           num_questions: numQuestions || 10 
         });
       } else {
@@ -277,10 +283,10 @@ export default function StudioPanel({
       case 'image_description':
         return (
           <div className="space-y-6">
-            {currentContent?.base64_image && (
+            {(currentContent?.image_url || currentContent?.base64_image) && (
               <div className="bg-[--bg-secondary] p-4 rounded-xl border border-[--border-color] shadow-sm">
                 <img 
-                  src={currentContent.base64_image} 
+                  src={imageSrc(currentContent)} 
                   alt="Uploaded content" 
                   className="max-h-96 w-auto mx-auto object-contain rounded-lg"
                 />
@@ -63,6 +63,7 @@ const ClassicLayout = (props) => {
     handleAddMoreFiles,
     handleUploadedFileClick,
     handleDownload,
+    handleBulkDownload,
     handleReset,
     handleConfirm,
     handleCancel,
@@ -236,6 +237,7 @@ const ClassicLayout = (props) => {
             speakText={speakText}
             stopSpeaking={stopSpeaking}
             handleDownload={handleDownload}
+            handleBulkDownload={handleBulkDownload}
             handleFileSelect={handleFileSelect}
             selectedFileIndex={selectedFileIndex}
             setSelectedFileIndex={setSelectedFileIndex}
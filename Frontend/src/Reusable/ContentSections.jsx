@@ -3,7 +3,7 @@ import { lazy, Suspense } from "react";
 import FileUploader from "../Components/FileUploader";
 import DownloadButtons from "./DownloadButtons";
 import axios from "axios";
-import { endpoint } from "../utils/api";
+import { endpoint, imageSrc, hasSourceText, sourceTextPayload, artifactUrl, fetchArtifact } from "../utils/api";
 
 // Lazy-load heavier, less frequently used sections to improve initial LCP
 const FlashcardCarousel = lazy(() =>
@@ -22,6 +22,7 @@ const ContentSections = ({
   speakText,
   stopSpeaking,
   handleDownload,
+  handleBulkDownload,
   handleFileSelect,
   selectedFileIndex,
   setSelectedFileIndex,
@@ -54,9 +55,20 @@ const ContentSections = ({
       {/* Uploaded Files List */}
       {uploadedFiles.length > 0 && (
         <div className="card">
-          <h3 className="text-xl font-semibold mb-4 text-[--text-primary]">
-            Uploaded Files
-          </h3>
+          <div className="flex items-center justify-between mb-4">
+            <h3 className="text-xl font-semibold text-[--text-primary]">
+              Uploaded Files
+            </h3>
+            {handleBulkDownload && (
+              <button
+                onClick={() => handleBulkDownload(["pdf", "docx"])}
+                className="px-3 py-1.5 text-xs rounded-md font-medium text-white glass-button transition-all duration-200 shadow-sm hover:shadow-md"
+                aria-label="Download all study materials as a ZIP"
+              >
+                Download all (ZIP)
+              </button>
+            )}
+          </div>
           <div className="flex flex-wrap gap-2">
             {uploadedFiles.map((file, index) => (
               <div key={index} className="relative group">
@@ -206,16 +218,19 @@ const ContentSections = ({
               </p>
               <button
                 onClick={async () => {
-                  if (!currentContent.raw_text || isGenerating.notes) return;
+                  if (!hasSourceText(currentContent) || isGenerating.notes) return;
                   setIsGenerating((p) => ({ ...p, notes: true }));
                   try {
-                    const res = await axios.post(
-                      endpoint("/generate/notes"),
-                      { text: currentContent.raw_text }
-                    );
+                    const lazyUrl = artifactUrl(currentContent, "notes");
+                    const res = lazyUrl
+                      ? await fetchArtifact(lazyUrl)
+                      : await axios.post(
+                          endpoint("/generate/notes"),
+                          sourceTextPayload(currentContent)
+                        );
                     const updated = {
                       ...currentContent,
-                      short_notes: res.data.short_notes || "",
+                      short_notes: (lazyUrl ? res.data.data : res.data.short_notes) || "",
                     };
                     setUploadedFiles((prev) =>
                       prev.map((f, i) =>
@@ -244,7 +259,7 @@ const ContentSections = ({
             <div className="image-description-container mt-6">
               <div className="image-preview mb-6">
                 <img
-                  src={currentContent.base64_image}
+                  src={imageSrc(currentContent)}
                   alt="Uploaded"
                   className="max-w-full max-h-96 object-contain rounded-lg shadow-md"
                 />
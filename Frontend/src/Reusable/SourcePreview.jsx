@@ -1,4 +1,5 @@
 import { motion } from "framer-motion";
+import { imageSrc } from "../utils/api";
 
 const FileIcon = () => (
   <svg className="w-8 h-8 text-[--text-tertiary]" fill="none" stroke="currentColor" viewBox="0 0 24 24">
@@ -28,7 +29,7 @@ const SourcePreview = ({ file, index, selectedFileIndex, handleUploadedFileClick
         {file.type === 'youtube' ? (
           <img src={`https://img.youtube.com/vi/${file.youtube_id || file.id}/mqdefault.jpg`} alt="YT Preview" className="w-full h-32 object-cover rounded-lg" />  
         ) : file.is_image ? (
-          <img src={file.base64_image} alt="Preview" className="w-full h-32 object-cover rounded-lg" />
+          <img src={imageSrc(file, { thumbnail: true })} alt="Preview" loading="lazy" className="w-full h-32 object-cover rounded-lg" />
         ) : (
           <div className="w-full h-32 bg-[--bg-secondary] rounded-lg flex items-center justify-center text-[--text-tertiary]">  
             <FileIcon className="w-8 h-8" />
@@ -1,6 +1,6 @@
 import axios from "axios";
 import toast from 'react-hot-toast';
-import { endpoint } from "../utils/api";
+import { endpoint, imageSrc } from "../utils/api";
 
 const useFileHandling = ({
   previewFiles,
@@ -90,6 +90,8 @@ const useFileHandling = ({
     }
 
     formData.append("quick_mode", "false");
+    // Text stays on the server; generation endpoints take document_id
+    formData.append("include_text", "0");
     try {
       const response = await axios.post(endpoint("/upload"), formData, {
         headers: { "Content-Type": "multipart/form-data" },
@@ -159,8 +161,8 @@ const useFileHandling = ({
       return;
     }
 
-    if (file.base64_image) {
-      window.open(file.base64_image, "_blank", "noopener,noreferrer");
+    if (file.image_url || file.base64_image) {
+      window.open(imageSrc(file), "_blank", "noopener,noreferrer");
       return;
     }
 
@@ -227,8 +229,13 @@ const useFileHandling = ({
         mcqs: cleanMcqs,
         flashcards: cleanFlashcards,
         raw_text: fileData.raw_text || "",
+        document_id: fileData.document_id || null,
+        artifacts: fileData.artifacts || null,
+        page_count: fileData.page_count || 0,
         image_description: cleanImageDescription,
         base64_image: fileData.base64_image || "",
+        image_url: fileData.image_url || "",
+        thumbnail_url: fileData.thumbnail_url || "",
         is_image: fileData.is_image,
         transcript: fileData.transcript || null,
         youtube_id: fileData.youtube_id || null,
@@ -11,6 +11,8 @@
 // - Defaults to http://127.0.0.1:5000 (works on same machine only)
 // - Or create .env.local with: VITE_BACKEND_URL=http://127.0.0.1:5000
 
+import axios from "axios";
+
 const getApiBase = () => {
   // Support both VITE_API_BASE and VITE_BACKEND_URL for compatibility
   // Prefer VITE_API_BASE if set
@@ -61,3 +63,54 @@ export const endpoint = (path) => {
 };
 
 
+
+// Image source for an uploaded file: the served blob URL, or a legacy inline data URI
+export const imageSrc = (file, { thumbnail = false } = {}) => {
+  if (!file) return "";
+  const url = thumbnail ? file.thumbnail_url || file.image_url : file.image_url;
+  if (url) return endpoint(url);
+  return file.base64_image || "";
+};
+
+// Whether a file has extracted text the generation endpoints can use
+export const hasSourceText = (content) => Boolean(content?.document_id || content?.raw_text);
+
+// Generation request body: reference the server-side document instead of re-posting its text
+export const sourceTextPayload = (content) =>
+  content?.document_id ? { document_id: content.document_id } : { text: content?.raw_text || "" };
+
+// The parts of a file the chat endpoint uses (avoids posting raw text and quizzes every turn)
+export const chatContext = (content) => ({
+  summary: content?.summary,
+  short_notes: content?.short_notes,
+  image_description: content?.image_description,
+  book_id: content?.book_id,
+  document_id: content?.document_id,
+});
+
+// Lazily generated artifacts: upload returns a handle per kind instead of the content
+const ARTIFACT_KINDS = { notes: "short_notes", flashcards: "flashcards", mcqs: "mcqs" };
+
+// Field of an uploaded file holding a section's artifact (notes -> short_notes)
+export const artifactKind = (section) => ARTIFACT_KINDS[section];
+
+// URL that generates/returns a section's artifact, when the upload left it to be fetched
+export const artifactUrl = (content, section) => {
+  const kind = ARTIFACT_KINDS[section];
+  const url = kind && content?.artifacts?.[kind]?.url;
+  return url ? endpoint(url) : null;
+};
+
+// Polling for an artifact still being generated after the first (waiting) request
+const ARTIFACT_POLL_MS = 2000;
+const ARTIFACT_POLL_ATTEMPTS = 60;
+
+// GET an artifact URL; while it is still generating (202), poll with ?wait=0 until it is ready or failed
+export const fetchArtifact = async (url) => {
+  let res = await axios.get(url);
+  for (let attempt = 0; res.status === 202 && res.data.status !== "error" && attempt < ARTIFACT_POLL_ATTEMPTS; attempt++) {
+    await new Promise((resolve) => setTimeout(resolve, ARTIFACT_POLL_MS));
+    res = await axios.get(url, { params: { wait: 0 } });
+  }
+  return res;
+};